@@ -1,7 +1,10 @@
 from pyzebra.anatric import *
+from pyzebra.catalog import *
 from pyzebra.ccl_io import *
 from pyzebra.ccl_process import *
 from pyzebra.h5 import *
+from pyzebra.result_cache import *
+from pyzebra.rsmap import *
 from pyzebra.sxtal_refgen import *
 from pyzebra.utils import *
 from pyzebra.xtal import *
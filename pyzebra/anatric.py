@@ -1,6 +1,16 @@
+import asyncio
+import collections
+import copy
+import itertools
+import os
+import re
 import subprocess
+import tempfile
+import time
 import xml.etree.ElementTree as ET
 
+import numpy as np
+
 DATA_FACTORY_IMPLEMENTATION = ["trics", "morph", "d10"]
 
 REFLECTION_PRINTER_FORMATS = [
@@ -32,9 +42,519 @@ def anatric(config_file, anatric_path=ANATRIC_PATH, cwd=None):
     print(" ".join(comp_proc.args))
     print(comp_proc.stdout)
 
+    return comp_proc.stdout
+
+
+async def anatric_async(
+    config_file, anatric_path=ANATRIC_PATH, cwd=None, logfile=None, on_output=None, poll_interval=1
+):
+    """Run anatric without blocking the event loop.
+
+    Cancelling the task that awaits this coroutine terminates the anatric process.
+
+    Args:
+        config_file (str): Path to the anatric config file.
+        anatric_path (str): Path to the anatric executable.
+        cwd (str): Working directory of the anatric process.
+        logfile (str): Path to the anatric logfile, relative to cwd, to be tailed.
+        on_output (callable): Called periodically with the anatric output and the logfile
+            content collected so far.
+        poll_interval (float): Interval between on_output calls in seconds.
+
+    Returns:
+        str: The anatric output.
+    """
+    args = [anatric_path, config_file]
+    print(" ".join(args))
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd
+    )
+
+    output = []
+
+    async def read_output():
+        async for line in proc.stdout:
+            output.append(line.decode(errors="replace"))
+
+    reader = asyncio.ensure_future(read_output())
+    if logfile is not None:
+        logfile = os.path.join(cwd or "", logfile)
+    log_pos = 0
+    log = []
+
+    try:
+        while True:
+            done, _ = await asyncio.wait({reader}, timeout=poll_interval)
+
+            if logfile is not None and os.path.isfile(logfile):
+                with open(logfile, "rb") as f:
+                    f.seek(log_pos)
+                    new_log = f.read()
+                log_pos += len(new_log)
+                log.append(new_log.decode(errors="replace"))
+
+            if on_output is not None:
+                on_output("".join(output), "".join(log))
+
+            if done:
+                break
+
+        returncode = await proc.wait()
+
+    except asyncio.CancelledError:
+        reader.cancel()
+        if proc.returncode is None:
+            proc.terminate()
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                proc.kill()
+        print(f"anatric run cancelled: {' '.join(args)}")
+        raise
+
+    stdout = "".join(output)
+    print(stdout)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args, output=stdout)
+
+    return stdout
+
+
+class AnatricRunner:
+    """Run anatric asynchronously with a limit on the number of simultaneous runs.
+
+    Runs above the limit wait in a first-in, first-out queue. A single runner is meant to be
+    shared between all sessions of a server.
+
+    Args:
+        max_running (int): Maximum number of simultaneously running anatric processes.
+    """
+
+    def __init__(self, max_running=1):
+        self.max_running = max_running
+        self._running = 0
+        self._queue = collections.deque()
+
+    async def _acquire(self, on_queued):
+        if self._running < self.max_running and not self._queue:
+            self._running += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queue.append(waiter)
+        if on_queued is not None:
+            on_queued(len(self._queue))
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+            elif not waiter.cancelled():
+                # the slot has already been handed over to this run
+                self._release()
+            raise
+
+    def _release(self):
+        # hand the slot over to the next run in the queue
+        while self._queue:
+            waiter = self._queue.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self._running -= 1
+
+    async def run(
+        self,
+        config_file,
+        anatric_path=ANATRIC_PATH,
+        cwd=None,
+        logfile=None,
+        on_output=None,
+        on_queued=None,
+        poll_interval=1,
+        on_started=None,
+    ):
+        """Run anatric with anatric_async, waiting for a free slot first.
+
+        Cancelling the task that awaits this coroutine removes the run from the queue or
+        terminates the running anatric process.
+
+        Args:
+            on_queued (callable): Called with the position in the queue if the run has to wait.
+            on_started (callable): Called without arguments when the run gets a free slot.
+            Other arguments are passed to anatric_async.
+
+        Returns:
+            str: The anatric output.
+        """
+        await self._acquire(on_queued)
+        try:
+            if on_started is not None:
+                on_started()
+            return await anatric_async(
+                config_file, anatric_path, cwd, logfile, on_output, poll_interval
+            )
+        finally:
+            self._release()
+
+
+def _is_reflection_line(line):
+    # reflection lines start with hkl indices, 0 0 0 is used as an end marker (e.g. in shelx)
+    vals = line.split()[:3]
+    if len(vals) < 3:
+        return False
+    try:
+        hkl = list(map(float, vals))
+    except ValueError:
+        return False
+    return any(hkl)
+
+
+def count_reflections(text):
+    """Count reflections in a ReflectionPrinter output.
+
+    Every line that starts with three numbers (hkl indices) is counted as a reflection, which
+    holds for all supported formats.
+
+    Args:
+        text (str): Content of the reflection file.
+
+    Returns:
+        int: Number of reflections.
+    """
+    return sum(map(_is_reflection_line, text.splitlines()))
+
+
+# fixed field widths of formats, which fields are not always separated by whitespace
+_REFLECTION_FIELD_WIDTHS = {"shelx": (4, 4, 4, 8, 8, 4)}
+
+# names of columns following hkl indices, other columns are named by their position
+REFLECTION_COLUMNS = {"shelx": ("f2", "sigma", "batch")}
+
+
+def _split_fixed(line, widths):
+    fields = []
+    pos = 0
+    for width in widths:
+        field = line[pos : pos + width].strip()
+        if not field:
+            break
+        fields.append(field)
+        pos += width
+    return fields
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def parse_reflection_file(text, fmt=None):
+    """Parse a ReflectionPrinter output into a structured array.
+
+    Args:
+        text (str): Content of the reflection file.
+        fmt (str): One of REFLECTION_PRINTER_FORMATS. Fields of formats with known fixed widths
+            are split by position, and by whitespace otherwise.
+
+    Returns:
+        ndarray: A structured array with "h", "k", "l" fields followed by fields named as in
+            REFLECTION_COLUMNS or "col<n>" by the column number. All fields are float, so that
+            fractional indices of satellites are kept. Missing or non-numeric values are NaN.
+    """
+    widths = _REFLECTION_FIELD_WIDTHS.get(fmt)
+    rows = []
+    for line in text.splitlines():
+        if widths is None:
+            fields = line.split()
+        else:
+            fields = _split_fixed(line, widths)
+        if _is_reflection_line(" ".join(fields)):
+            rows.append(fields)
+
+    n_cols = max(map(len, rows), default=3)
+    col_names = REFLECTION_COLUMNS.get(fmt, ())
+    names = ["h", "k", "l"]
+    for col in range(3, n_cols):
+        names.append(col_names[col - 3] if col - 3 < len(col_names) else f"col{col + 1}")
+
+    values = np.full((len(rows), n_cols), np.nan)
+    for ind, fields in enumerate(rows):
+        try:
+            values[ind, : len(fields)] = fields
+        except ValueError:
+            values[ind, : len(fields)] = list(map(_to_float, fields))
+
+    res = np.empty(len(rows), dtype=[(name, np.float64) for name in names])
+    for col, name in enumerate(names):
+        res[name] = values[:, col]
+
+    return res
+
+
+def split_filelist_ranges(ranges, n_chunks):
+    """Split file ranges into contiguous chunks with similar numbers of files.
+
+    Args:
+        ranges (list): File ranges as returned by AnatricConfig.filelist_ranges.
+        n_chunks (int): Number of chunks.
+
+    Returns:
+        list: File ranges of every non-empty chunk, in a form accepted by the
+            AnatricConfig.filelist_ranges setter.
+    """
+    numbers = []
+    for file_range in ranges:
+        if isinstance(file_range, tuple):
+            numbers.extend(range(file_range[0], file_range[1] + 1))
+        else:
+            numbers.append(file_range)
+
+    chunks = []
+    if not numbers:
+        return chunks
+
+    for chunk_numbers in np.array_split(numbers, min(n_chunks, len(numbers))):
+        # group consecutive file numbers back into ranges
+        chunk_ranges = []
+        breaks = np.flatnonzero(np.diff(chunk_numbers) != 1) + 1
+        for group in np.split(chunk_numbers, breaks):
+            if len(group) == 1:
+                chunk_ranges.append((str(group[0]),))
+            else:
+                chunk_ranges.append((str(group[0]), str(group[-1])))
+        chunks.append(chunk_ranges)
+
+    return chunks
+
+
+def _running_index_columns(lines):
+    # columns that number reflections 1, 2, 3, ... in the order of lines
+    if len(lines) < 2:
+        return []
+
+    columns = [line.split() for line in lines]
+    n_cols = min(map(len, columns))
+    res = []
+    for col in range(3, n_cols):
+        if all(vals[col] == str(ind) for ind, vals in enumerate(columns, start=1)):
+            res.append(col)
+    return res
+
+
+def _replace_column(line, col, value):
+    # replace a whitespace separated field, keeping its right alignment
+    spans = [m.span() for m in re.finditer(r"\S+", line)]
+    start, end = spans[col]
+    value = str(value)
+    prev_end = spans[col - 1][1] + 1 if col > 0 else 0
+    new_start = max(min(start, end - len(value)), prev_end)
+    return line[:new_start] + value.rjust(end - new_start) + line[end:]
+
+
+def merge_reflection_files(texts):
+    """Merge ReflectionPrinter outputs of anatric runs over different files.
+
+    The header and the trailing lines (e.g. end markers) are taken from the first output, and
+    reflection lines of all outputs are concatenated. Columns that number reflections within
+    every output are renumbered to run through the merged output.
+
+    Args:
+        texts (list): Contents of reflection files.
+
+    Returns:
+        str: The merged content.
+    """
+    header, trailer, refl_lines = [], [], []
+    for ind, text in enumerate(texts):
+        lines = text.splitlines(keepends=True)
+        refl_inds = [i for i, line in enumerate(lines) if _is_reflection_line(line)]
+        if not refl_inds:
+            if ind == 0:
+                header = lines
+            continue
+
+        if not refl_lines:
+            header = lines[: refl_inds[0]]
+            trailer = lines[refl_inds[-1] + 1 :]
+
+        chunk_lines = [lines[i] for i in refl_inds]
+        offset = len(refl_lines)
+        for col in _running_index_columns(chunk_lines):
+            chunk_lines = [
+                _replace_column(line, col, i)
+                for i, line in enumerate(chunk_lines, start=offset + 1)
+            ]
+        refl_lines.extend(chunk_lines)
+
+    return "".join(header + refl_lines + trailer)
+
+
+async def anatric_split(
+    config, n_chunks, anatric_path=ANATRIC_PATH, max_workers=None, runner=None, on_queued=None
+):
+    """Run anatric in parallel over chunks of the config file list and merge the results.
+
+    Every chunk is processed with its own copy of the config in a temporary working directory.
+    Cancelling the task that awaits this coroutine terminates all running anatric processes.
+
+    Args:
+        config (AnatricConfig): Anatric config.
+        n_chunks (int): Number of chunks to split the file list into.
+        anatric_path (str): Path to the anatric executable.
+        max_workers (int): Maximum number of simultaneously running anatric processes, used only
+            if no runner is provided, the number of CPUs by default.
+        runner (AnatricRunner): A runner shared with other anatric runs.
+        on_queued (callable): Called with the position in the queue if a chunk has to wait.
+
+    Returns:
+        tuple: Merged reflection file content, and concatenated logfiles of all chunks.
+    """
+    if runner is None:
+        runner = AnatricRunner(max_workers or os.cpu_count() or 1)
+
+    async def run_chunk(chunk_ranges):
+        run_config = copy.deepcopy(config)
+        run_config.filelist_ranges = chunk_ranges
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config_file = os.path.join(temp_dir, "config.xml")
+            run_config.save_as(config_file)
+            await runner.run(config_file, anatric_path, cwd=temp_dir, on_queued=on_queued)
+
+            with open(os.path.join(temp_dir, run_config.reflectionPrinter_file)) as f:
+                res = f.read()
+            with open(os.path.join(temp_dir, run_config.logfile)) as f:
+                log = f.read()
+
+        files = ", ".join("-".join(chunk_range) for chunk_range in chunk_ranges)
+        return res, f"----- files {files} -----\n{log}"
+
+    chunks = split_filelist_ranges(config.filelist_ranges, n_chunks)
+    if not chunks:
+        raise ValueError("The file list of the config is empty")
+
+    tasks = [asyncio.ensure_future(run_chunk(chunk_ranges)) for chunk_ranges in chunks]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # results are incomplete if any of the chunks fails
+        for task in tasks:
+            task.cancel()
+        raise
+    res_texts, logs = zip(*results)
+
+    return merge_reflection_files(res_texts), "".join(logs)
+
+
+async def anatric_sweep(
+    config, param_grid, anatric_path=ANATRIC_PATH, max_workers=2, on_result=None, runner=None
+):
+    """Run anatric for all combinations of config parameter values.
+
+    Every run gets its own copy of the config and a temporary working directory. Cancelling the
+    task that awaits this coroutine terminates all running anatric processes.
+
+    Args:
+        config (AnatricConfig): Base anatric config.
+        param_grid (dict): Names of AnatricConfig properties and lists of their values.
+        anatric_path (str): Path to the anatric executable.
+        max_workers (int): Maximum number of simultaneously running or queued anatric processes
+            of this sweep.
+        on_result (callable): Called with a result of every run as soon as it is finished.
+        runner (AnatricRunner): A runner shared with other anatric runs, a new runner limited
+            to max_workers processes by default.
+
+    Returns:
+        list: Results of all runs in the order of combinations. Every result is a dict with
+            parameter values, number of "reflections" and "runtime" in seconds, or "error".
+    """
+    if runner is None:
+        runner = AnatricRunner(max_workers)
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def run_combination(values):
+        params = dict(zip(param_grid, values))
+        run_config = copy.deepcopy(config)
+        for name, value in params.items():
+            setattr(run_config, name, value)
+
+        result = dict(params, reflections=None, runtime=None, error="")
+        async with semaphore:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                config_file = os.path.join(temp_dir, "config.xml")
+                run_config.save_as(config_file)
+
+                start_time = None
+
+                def on_started():
+                    # do not count time spent in the queue
+                    nonlocal start_time
+                    start_time = time.monotonic()
+
+                try:
+                    await runner.run(config_file, anatric_path, cwd=temp_dir, on_started=on_started)
+                    res_file = os.path.join(temp_dir, run_config.reflectionPrinter_file)
+                    with open(res_file) as f:
+                        result["reflections"] = count_reflections(f.read())
+                except (OSError, subprocess.CalledProcessError) as e:
+                    result["error"] = str(e)
+                if start_time is not None:
+                    result["runtime"] = time.monotonic() - start_time
+
+        if on_result is not None:
+            on_result(result)
+
+        return result
+
+    combinations = itertools.product(*param_grid.values())
+    return await asyncio.gather(*(run_combination(values) for values in combinations))
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def filelist_mtimes(config):
+    """Get modification times of data files referenced by the FileList of a config.
+
+    File names are obtained by applying the printf-style FileList format to file numbers. If the
+    format can not be applied, all files in the data directory are listed instead.
+
+    Args:
+        config (AnatricConfig): Anatric config.
+
+    Returns:
+        list: Tuples of file paths and their modification times, None for missing files.
+    """
+    datapath = config.filelist_datapath
+    numbers = []
+    for file_range in config.filelist_ranges:
+        if isinstance(file_range, tuple):
+            numbers.extend(range(file_range[0], file_range[1] + 1))
+        else:
+            numbers.append(file_range)
+
+    try:
+        paths = [os.path.join(datapath, config.filelist_format % num) for num in numbers]
+    except (TypeError, ValueError):
+        try:
+            paths = sorted(entry.path for entry in os.scandir(datapath))
+        except OSError:
+            paths = []
+
+    return [(path, _mtime(path)) for path in paths]
+
 
 class AnatricConfig:
     def __init__(self, filename=None):
+        self._observers = []
         self._alg_elems = dict()
         for alg in ALGORITHMS:
             self._alg_elems[alg] = ET.Element("Algorithm", attrib={"implementation": alg})
@@ -50,9 +570,30 @@ class AnatricConfig:
         if filename:
             self.load_from_file(filename)
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # all public attributes are properties that modify the xml tree
+        if not name.startswith("_"):
+            self._notify()
+
+    def __getstate__(self):
+        # observers belong to the original config, they are not copied
+        state = self.__dict__.copy()
+        state["_observers"] = []
+        return state
+
+    def on_change(self, callback):
+        """Register a callback without arguments to be called on every change of the config."""
+        self._observers.append(callback)
+
+    def _notify(self):
+        for callback in self._observers:
+            callback()
+
     def load_from_file(self, filename):
         self._tree.parse(filename)
         self._alg_elems[self.algorithm] = self._tree.find("Algorithm")
+        self._notify()
 
     def save_as(self, filename):
         self._tree.write(filename)
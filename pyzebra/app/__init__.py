@@ -1,4 +1,7 @@
+from pyzebra.app.catalog_filter import CatalogFilter, CatalogIndexer
+from pyzebra.app.dir_watcher import DirWatcher, watch_proposal_files
 from pyzebra.app.download_files import DownloadFiles
 from pyzebra.app.fit_controls import FitControls
+from pyzebra.app.frame_prefetcher import FramePrefetcher
 from pyzebra.app.input_controls import InputControls
 from pyzebra.app.plot_hkl import PlotHKL
@@ -2,6 +2,8 @@ import logging
 import sys
 from io import StringIO
 
+import pyzebra
+
 
 def on_server_loaded(_server_context):
     formatter = logging.Formatter(
@@ -15,3 +17,6 @@ def on_server_loaded(_server_context):
     bokeh_logger = logging.getLogger("bokeh")
     bokeh_logger.setLevel(logging.WARNING)
     bokeh_logger.addHandler(bokeh_handler)
+
+    # index proposal directories once at startup, then keep it up to date in the background
+    pyzebra.proposal_index.start()
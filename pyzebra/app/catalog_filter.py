@@ -0,0 +1,160 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from bokeh.io import curdoc
+from bokeh.models import TextInput
+
+import pyzebra
+from pyzebra.app.dir_watcher import dir_watcher
+
+
+class CatalogIndexer:
+    """Server-wide indexing of watched directories into a metadata catalog.
+
+    Every directory is indexed when the first listener subscribes to it and then once per change
+    of its files, regardless of the number of sessions following it, so that sessions only need
+    to query the catalog.
+
+    Args:
+        catalog (MetadataCatalog): A catalog to update.
+        watcher (DirWatcher): A watcher reporting changes of files in directories.
+    """
+
+    def __init__(self, catalog, watcher):
+        self.catalog = catalog
+        self.watcher = watcher
+
+        # a single indexing thread for all sessions, file reads on AFS are the bottleneck anyway
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        self._listeners = {}
+        self._watch_callbacks = {}
+
+    def subscribe(self, path, listener):
+        """Start following a directory.
+
+        Args:
+            path (str): A directory with data files.
+            listener (callable): Function without arguments, called from the indexing thread
+                whenever indexed files of the directory change.
+        """
+        with self._lock:
+            listeners = self._listeners.setdefault(path, [])
+            listeners.append(listener)
+            if len(listeners) > 1:
+                return
+
+        watch_callback = partial(self._index, path)
+        try:
+            files = self.watcher.subscribe(path, watch_callback)
+        except OSError as e:
+            print(e)
+            with self._lock:
+                del self._listeners[path]
+            return
+
+        self._watch_callbacks[path] = watch_callback
+        self._index(path, files)
+
+    def unsubscribe(self, path, listener):
+        """Stop calling the listener on changes of the directory."""
+        with self._lock:
+            listeners = self._listeners.get(path)
+            if listeners is None or listener not in listeners:
+                return
+
+            listeners.remove(listener)
+            if listeners:
+                return
+
+            del self._listeners[path]
+
+        self.watcher.unsubscribe(path, self._watch_callbacks.pop(path))
+
+    def _index(self, path, files):
+        future = self._executor.submit(self.catalog.update, path, files)
+        future.add_done_callback(partial(self._index_done_callback, path))
+
+    def _index_done_callback(self, path, future):
+        try:
+            n_changed = future.result()
+        except Exception as e:
+            print(f"Error indexing {path}: {e}")
+            return
+
+        if n_changed:
+            with self._lock:
+                listeners = list(self._listeners.get(path, []))
+
+            for listener in listeners:
+                # a failing listener must not stop updates for all other sessions
+                try:
+                    listener()
+                except Exception as e:
+                    print(f"Error notifying about indexed files in {path}: {e}")
+
+
+metadata_catalog = pyzebra.MetadataCatalog(
+    os.path.join(pyzebra.RESULT_CACHE_PATH, "metadata_catalog.sqlite")
+)
+catalog_indexer = CatalogIndexer(metadata_catalog, dir_watcher)
+
+
+class CatalogFilter:
+    """Filter of proposal files by their scan metadata, stored in a server-wide catalog.
+
+    Files of the proposal selected in the current document are indexed by the server-wide
+    catalog_indexer.
+
+    Args:
+        on_change (callable): Function without arguments, called when the filter or indexed files
+            change.
+    """
+
+    def __init__(self, on_change):
+        doc = curdoc()
+        proposal_textinput = doc.proposal_textinput
+        proposal_path = ""
+
+        def textinput_callback(_attr, _old, _new):
+            on_change()
+
+        self.textinput = TextInput(
+            title="Filter by scan metadata:", placeholder="temp=1.4:1.6, h=2", width=210
+        )
+        self.textinput.on_change("value", textinput_callback)
+
+        def indexed_callback():
+            if self.textinput.value:
+                doc.add_next_tick_callback(on_change)
+
+        def unsubscribe():
+            if proposal_path:
+                catalog_indexer.unsubscribe(proposal_path, indexed_callback)
+
+        def proposal_textinput_callback(_attr, _old, new):
+            nonlocal proposal_path
+            unsubscribe()
+            proposal_path = new
+            if new:
+                catalog_indexer.subscribe(new, indexed_callback)
+
+        proposal_textinput.on_change("name", proposal_textinput_callback)
+        doc.on_session_destroyed(lambda _session_context: unsubscribe())
+
+    def apply(self, proposal_path, files):
+        """Return files matching the filter, all files if the filter is empty."""
+        text = self.textinput.value.strip()
+        if not (text and proposal_path):
+            return files
+
+        try:
+            conditions = pyzebra.parse_catalog_filter(text)
+        except ValueError as e:
+            print(e)
+            return files
+
+        matching = metadata_catalog.query(proposal_path, conditions)
+        return [file for file in files if file in matching]
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from functools import partial
+
+from bokeh.io import curdoc
+
+
+class DirWatcher:
+    """Server-wide index of files in watched directories.
+
+    A single background thread checks modification times of all watched directories, and lists
+    only those that have changed, so that every directory is scanned once regardless of the
+    number of sessions subscribed to it.
+
+    Args:
+        interval (float): Time between checks of directories, in seconds.
+    """
+
+    def __init__(self, interval=5):
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._dirs = {}
+        self._thread = None
+
+    def subscribe(self, path, callback):
+        """Start watching a directory.
+
+        Args:
+            path (str): A directory to watch.
+            callback (callable): Function of a sorted list of file names, called from the watcher
+                thread whenever the content of the directory changes.
+
+        Returns:
+            list: Sorted file names in the directory.
+        """
+        with self._lock:
+            entry = self._dirs.get(path)
+
+        if entry is None:
+            mtime, files = _scan(path)
+            with self._lock:
+                entry = self._dirs.setdefault(path, {"mtime": mtime, "files": files, "subs": []})
+
+        with self._lock:
+            entry["subs"].append(callback)
+            files = entry["files"]
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+        return files
+
+    def unsubscribe(self, path, callback):
+        """Stop calling the callback on changes of the directory."""
+        with self._lock:
+            entry = self._dirs.get(path)
+            if entry is None or callback not in entry["subs"]:
+                return
+
+            entry["subs"].remove(callback)
+            if not entry["subs"]:
+                # unused directories are not checked, they are listed again on a next subscription
+                del self._dirs[path]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+
+            with self._lock:
+                paths = list(self._dirs)
+
+            for path in paths:
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    continue
+
+                with self._lock:
+                    entry = self._dirs.get(path)
+                    if entry is None or entry["mtime"] == mtime:
+                        continue
+
+                try:
+                    mtime, files = _scan(path)
+                except OSError:
+                    continue
+
+                with self._lock:
+                    changed = files != entry["files"]
+                    entry["mtime"] = mtime
+                    entry["files"] = files
+                    subs = list(entry["subs"])
+
+                if changed:
+                    for callback in subs:
+                        # a failing subscriber must not stop updates for all other sessions
+                        try:
+                            callback(files)
+                        except Exception as e:
+                            print(f"Error notifying about changes in {path}: {e}")
+
+
+def _scan(path):
+    mtime = os.stat(path).st_mtime
+    return mtime, sorted(os.listdir(path))
+
+
+dir_watcher = DirWatcher()
+
+
+def watch_proposal_files(callback):
+    """Follow files of the proposal directory selected in the current document.
+
+    Args:
+        callback (callable): Function of the proposal path and a sorted list of file names in it,
+            called in the document context on every change of the proposal or its files.
+    """
+    doc = curdoc()
+    proposal_textinput = doc.proposal_textinput
+    subscription = None
+
+    def unsubscribe():
+        nonlocal subscription
+        if subscription is not None:
+            dir_watcher.unsubscribe(*subscription)
+            subscription = None
+
+    def files_update(path, files):
+        # drop updates queued before the proposal has been changed
+        if path == proposal_textinput.name:
+            callback(path, files)
+
+    def proposal_textinput_callback(_attr, _old, new):
+        nonlocal subscription
+        unsubscribe()
+
+        files = []
+        if new:
+
+            def files_callback(files):
+                doc.add_next_tick_callback(partial(files_update, new, files))
+
+            try:
+                files = dir_watcher.subscribe(new, files_callback)
+                subscription = (new, files_callback)
+            except OSError as e:
+                print(e)
+
+        callback(new, files)
+
+    proposal_textinput.on_change("name", proposal_textinput_callback)
+    doc.on_session_destroyed(lambda _session_context: unsubscribe())
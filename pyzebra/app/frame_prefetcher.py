@@ -0,0 +1,104 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FramePrefetcher:
+    """Cache of per-frame display payloads, filled in a background thread.
+
+    Payloads for a window of frames around the currently displayed one are precomputed, so that
+    scrubbing and playback only need to push already prepared data to the browser. Only frames of
+    a single scan are cached, and every reset of the cache starts a new generation, so that
+    payloads computed in the background for previous data are never stored.
+
+    Args:
+        compute (callable): Function of (scan, index) that returns a payload for a frame.
+        window (int): Number of frames to prefetch on each side of the current frame.
+    """
+
+    def __init__(self, compute, window=10):
+        self.compute = compute
+        self.window = window
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        self._scan = None
+        self._generation = 0
+        self._cache = {}
+        self._pending = {}
+
+    def _reset(self, scan):
+        # must be called with the lock held
+        self._generation += 1
+        self._scan = scan
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self._cache.clear()
+
+    def get(self, scan, index):
+        """Return a payload for a frame, computing it in place if it was not prefetched."""
+        with self._lock:
+            if scan is not self._scan:
+                self._reset(scan)
+            generation = self._generation
+            payload = self._cache.get(index)
+            future = self._pending.get(index)
+
+        if payload is None:
+            if future is not None and not future.cancel():
+                payload = future.result()
+            else:
+                payload = self.compute(scan, index)
+                with self._lock:
+                    if generation == self._generation:
+                        self._pending.pop(index, None)
+                        self._cache[index] = payload
+
+        return payload
+
+    def prefetch(self, scan, index):
+        """Schedule computation of payloads for frames around the index."""
+        n_im = scan["counts"].shape[0]
+        start = max(index - self.window, 0)
+        end = min(index + self.window + 1, n_im)
+        # frames ahead of the current one go first, as they are needed for playback
+        indices = [*range(index + 1, end), *range(index - 1, start - 1, -1)]
+
+        with self._lock:
+            if scan is not self._scan:
+                self._reset(scan)
+
+            # drop frames out of the window
+            for ind in list(self._pending):
+                if not start <= ind < end and self._pending[ind].cancel():
+                    del self._pending[ind]
+            for ind in list(self._cache):
+                if not start <= ind < end:
+                    del self._cache[ind]
+
+            for ind in indices:
+                if ind not in self._cache and ind not in self._pending:
+                    self._pending[ind] = self._executor.submit(
+                        self._worker, scan, ind, self._generation
+                    )
+
+    def _worker(self, scan, index, generation):
+        payload = self.compute(scan, index)
+        with self._lock:
+            # skip payloads computed from data that has been modified in the meantime
+            if generation == self._generation:
+                self._pending.pop(index, None)
+                self._cache[index] = payload
+
+        return payload
+
+    def clear(self):
+        """Discard all cached and scheduled payloads, e.g. after scan counts were modified."""
+        with self._lock:
+            self._reset(self._scan)
+
+    def shutdown(self):
+        """Discard all payloads and stop the background thread."""
+        with self._lock:
+            self._reset(None)
+        self._executor.shutdown(wait=False)
@@ -2,24 +2,25 @@ import base64
 import io
 import os
 
-from bokeh.io import curdoc
 from bokeh.models import Button, FileInput, MultiSelect, Spinner
 
 import pyzebra
+from pyzebra.app.catalog_filter import CatalogFilter
+from pyzebra.app.dir_watcher import watch_proposal_files
 
 
 class InputControls:
     def __init__(self, dataset, dlfiles, on_file_open=lambda: None, on_monitor_change=lambda: None):
-        doc = curdoc()
+        proposal_path = ""
+        proposal_files = []
 
-        def filelist_select_update_for_proposal():
-            proposal_path = proposal_textinput.name
+        def filelist_select_update():
             if proposal_path:
-                file_list = []
-                for file in os.listdir(proposal_path):
-                    if file.endswith((".ccl", ".dat")):
-                        file_list.append((os.path.join(proposal_path, file), file))
-                filelist_select.options = file_list
+                filelist_select.options = [
+                    (os.path.join(proposal_path, file), file)
+                    for file in catalog_filter.apply(proposal_path, proposal_files)
+                    if file.endswith((".ccl", ".dat"))
+                ]
                 open_button.disabled = False
                 append_button.disabled = False
             else:
@@ -27,13 +28,16 @@ class InputControls:
                 open_button.disabled = True
                 append_button.disabled = True
 
-        doc.add_periodic_callback(filelist_select_update_for_proposal, 5000)
+        catalog_filter = CatalogFilter(filelist_select_update)
+        self.filter_textinput = catalog_filter.textinput
 
-        def proposal_textinput_callback(_attr, _old, _new):
-            filelist_select_update_for_proposal()
+        def proposal_files_callback(path, files):
+            nonlocal proposal_path, proposal_files
+            proposal_path = path
+            proposal_files = files
+            filelist_select_update()
 
-        proposal_textinput = doc.proposal_textinput
-        proposal_textinput.on_change("name", proposal_textinput_callback)
+        watch_proposal_files(proposal_files_callback)
 
         filelist_select = MultiSelect(title="Available .ccl/.dat files:", width=210, height=250)
         self.filelist_select = filelist_select
@@ -1,5 +1,6 @@
 import argparse
 import logging
+import os
 import sys
 
 from bokeh.io import curdoc
@@ -28,6 +29,13 @@ parser.add_argument(
     "--anatric-path", type=str, default=pyzebra.ANATRIC_PATH, help="path to anatric executable"
 )
 
+parser.add_argument(
+    "--anatric-max-runs",
+    type=int,
+    default=1,
+    help="maximum number of simultaneous anatric runs, other runs are queued",
+)
+
 parser.add_argument(
     "--sxtal-refgen-path",
     type=str,
@@ -37,10 +45,19 @@ parser.add_argument(
 
 parser.add_argument("--spind-path", type=str, default=None, help="path to spind scripts folder")
 
+parser.add_argument(
+    "--spind-mpi-ranks",
+    type=int,
+    default=os.cpu_count(),
+    help="number of MPI processes for spind scripts, defaults to the number of cpu cores",
+)
+
 args = parser.parse_args()
 
 doc.anatric_path = args.anatric_path
+doc.anatric_max_runs = args.anatric_max_runs
 doc.spind_path = args.spind_path
+doc.spind_mpi_ranks = args.spind_mpi_ranks
 doc.sxtal_refgen_path = args.sxtal_refgen_path
 
 # In app_hooks.py a StreamHandler was added to "bokeh" logger
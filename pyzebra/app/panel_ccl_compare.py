@@ -4,7 +4,6 @@ import os
 import tempfile
 
 import numpy as np
-from bokeh.io import curdoc
 from bokeh.layouts import column, row
 from bokeh.models import (
     Button,
@@ -32,31 +31,34 @@ from pyzebra import EXPORT_TARGETS, app
 
 
 def create():
-    doc = curdoc()
     dataset1 = []
     dataset2 = []
     app_dlfiles = app.DownloadFiles(n_files=2)
 
-    def file_select_update_for_proposal():
-        proposal_path = proposal_textinput.name
+    proposal_path = ""
+    proposal_files = []
+
+    def file_select_update():
         if proposal_path:
-            file_list = []
-            for file in os.listdir(proposal_path):
-                if file.endswith((".ccl")):
-                    file_list.append((os.path.join(proposal_path, file), file))
-            file_select.options = file_list
+            file_select.options = [
+                (os.path.join(proposal_path, file), file)
+                for file in catalog_filter.apply(proposal_path, proposal_files)
+                if file.endswith(".ccl")
+            ]
             file_open_button.disabled = False
         else:
             file_select.options = []
             file_open_button.disabled = True
 
-    doc.add_periodic_callback(file_select_update_for_proposal, 5000)
+    catalog_filter = app.CatalogFilter(file_select_update)
 
-    def proposal_textinput_callback(_attr, _old, _new):
-        file_select_update_for_proposal()
+    def proposal_files_callback(path, files):
+        nonlocal proposal_path, proposal_files
+        proposal_path = path
+        proposal_files = files
+        file_select_update()
 
-    proposal_textinput = doc.proposal_textinput
-    proposal_textinput.on_change("name", proposal_textinput_callback)
+    app.watch_proposal_files(proposal_files_callback)
 
     def _init_datatable():
         # dataset2 should have the same metadata as dataset1
@@ -518,7 +520,9 @@ def create():
         row(column(Spacer(height=19), merge_button), merge_from_select),
     )
 
-    import_layout = column(file_select, file_open_button, upload_div, upload_button)
+    import_layout = column(
+        catalog_filter.textinput, file_select, file_open_button, upload_div, upload_button
+    )
 
     export_layout = column(
         export_preview_textinput,
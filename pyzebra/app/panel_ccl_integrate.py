@@ -339,6 +339,7 @@ def create():
     upload_div = Div(text="or upload new .ccl/.dat files:", margin=(5, 5, 0, 5))
     append_upload_div = Div(text="append extra files:", margin=(5, 5, 0, 5))
     import_layout = column(
+        app_inputctrl.filter_textinput,
         app_inputctrl.filelist_select,
         row(app_inputctrl.open_button, app_inputctrl.append_button),
         upload_div,
@@ -1,10 +1,16 @@
+import asyncio
 import base64
 import io
 import os
+import shutil
 import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import numpy as np
+from bokeh.document import without_document_lock
+from bokeh.io import curdoc
 from bokeh.layouts import column, row
 from bokeh.models import (
     Arrow,
@@ -32,13 +38,19 @@ from bokeh.plotting import figure
 
 import pyzebra
 from pyzebra import app
+from pyzebra.app.plot_hkl import grid_lines
 
 ANG_CHUNK_DEFAULTS = {"2theta": 30, "gamma": 30, "omega": 30, "chi": 35, "phi": 35, "nu": 10}
 SORT_OPT_BI = ["2theta", "chi", "phi", "omega"]
 SORT_OPT_NB = ["gamma", "nu", "omega"]
+MOTOR_SPEED_DEFAULTS = {"2theta": 1, "gamma": 1, "omega": 2, "chi": 1, "phi": 3, "nu": 1}
+
+# results are shared between all sessions
+sxtal_refgen_cache = pyzebra.ResultCache(os.path.join(pyzebra.RESULT_CACHE_PATH, "sxtal_refgen"))
 
 
 def create():
+    doc = curdoc()
     ang_lims = {}
     cif_data = {}
     params = {}
@@ -187,11 +199,67 @@ def create():
         sorting_1.value = sort_opt[1]
         sorting_2.value = sort_opt[2]
 
+        motor_speeds.value = " ".join(
+            str(MOTOR_SPEED_DEFAULTS[ang]) for ang in pyzebra.GEOM_ANGLES[ang_lims["geom"]]
+        )
+
+    optimize_travel_cb = CheckboxGroup(labels=["Minimize motor travel"], width=170)
+    motor_speeds = TextInput(title="motor speeds, deg/s", width=150)
+    optimize_time_limit = NumericInput(title="time limit, s", value=2, mode="float", width=80)
+    optimize_div = Div(margin=(5, 5, 0, 5))
+
     geom_radiogroup_div = Div(text="Geometry:", margin=(5, 5, 0, 5))
     geom_radiogroup = RadioGroup(labels=["bisecting", "normal beam"], width=150)
     geom_radiogroup.on_change("active", geom_radiogroup_callback)
     geom_radiogroup.active = 0
 
+    def _run_sxtal_refgen(temp_dir, base_fname, params, cfl_value):
+        cfl_path = os.path.join(temp_dir, base_fname + ".cfl")
+        if cfl_value:
+            cfl_template = io.StringIO(base64.b64decode(cfl_value).decode())
+        else:
+            cfl_template = None
+        pyzebra.export_cfl_file(cfl_path, params, cfl_template)
+
+        print(f"Content of {cfl_path}:")
+        with open(cfl_path) as f:
+            cfl_text = f.read()
+        print(cfl_text)
+
+        with open(os.path.join(temp_dir, "zebra.geom")) as f:
+            geom_text = f.read()
+
+        out_fnames = (base_fname + ".hkl", base_fname + ".mhkl")
+        cache_key = sxtal_refgen_cache.make_key(
+            pyzebra.SXTAL_REFGEN_PATH, base_fname, cfl_text, geom_text
+        )
+
+        cached = sxtal_refgen_cache.get(cache_key)
+        if cached is not None:
+            print(f"Using cached Sxtal_Refgen results for {base_fname}")
+            out_files, _ = cached
+            for fname, text in out_files.items():
+                with open(os.path.join(temp_dir, fname), "w") as f:
+                    f.write(text)
+            return
+
+        comp_proc = subprocess.run(
+            [pyzebra.SXTAL_REFGEN_PATH, cfl_path],
+            cwd=temp_dir,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        print(" ".join(comp_proc.args))
+        print(comp_proc.stdout)
+
+        out_files = {}
+        for fname in out_fnames:
+            with open(os.path.join(temp_dir, fname)) as f:
+                out_files[fname] = f.read()
+        sxtal_refgen_cache.put(cache_key, out_files, comp_proc.stdout)
+
     def go_button_callback():
         ang_lims["gamma"][0], ang_lims["gamma"][1] = sttgamma_ti.value.strip().split()
         ang_lims["omega"][0], ang_lims["omega"][1] = omega_ti.value.strip().split()
@@ -213,10 +281,108 @@ def create():
         params["lattiCE"] = magstruct_lattice.value
         kvects = magstruct_kvec.value.split("\n")
 
-        with tempfile.TemporaryDirectory() as temp_dir:
+        geom_value = open_geom.value
+        cfl_value = open_cfl.value
+        cfl_filename = open_cfl.filename
+        builtin_refgen = bool(builtin_refgen_cb.active)
+        optimize_travel = bool(optimize_travel_cb.active)
+        time_limit = optimize_time_limit.value
+
+        priority = [sorting_0.value, sorting_1.value, sorting_2.value]
+        chunks = [sorting_0_dt.value, sorting_1_dt.value, sorting_2_dt.value]
+        if geom_radiogroup.active == 0:
+            sort_hkl_file = pyzebra.sort_hkl_file_bi
+            priority.extend(set(SORT_OPT_BI) - set(priority))
+        else:
+            sort_hkl_file = pyzebra.sort_hkl_file_nb
+
+        geom = ang_lims["geom"]
+        speeds = None
+        if optimize_travel:
+            ang_names = pyzebra.GEOM_ANGLES[geom]
+            try:
+                values = list(map(float, motor_speeds.value.split()))
+            except ValueError:
+                print(f"Can not parse motor speeds '{motor_speeds.value}'")
+                return
+
+            if len(values) != len(ang_names):
+                print(f"Expected {len(ang_names)} motor speeds for {', '.join(ang_names)}")
+                return
+
+            speeds = dict(zip(ang_names, values))
+
+        def _sort_list(file_in, file_out):
+            sort_hkl_file(file_in, file_out, priority, chunks)
+            if not optimize_travel:
+                return []
+
+            init_time, opt_time = pyzebra.optimize_hkl_file(
+                file_out, file_out, geom, speeds, time_limit
+            )
+            fname = os.path.basename(file_out)
+            print(f"{fname}: drive time {init_time / 60:.1f} -> {opt_time / 60:.1f} min")
+            return [
+                f"{fname}: {init_time / 60:.1f} → {opt_time / 60:.1f} min "
+                f"(saved {(init_time - opt_time) / 60:.1f} min)"
+            ]
+
+        def _process_kvect(temp_dir, i, kvect):
+            # every job works in its own directory with a copy of the geometry file
+            job_dir = os.path.join(temp_dir, f"k{i}")
+            os.mkdir(job_dir)
+            shutil.copy(os.path.join(temp_dir, "zebra.geom"), job_dir)
+            job_params = {**params, "kvect": kvect}
+
+            if cfl_filename:
+                base_fname = f"{os.path.splitext(cfl_filename)[0]}_{i}"
+            else:
+                base_fname = f"zebra_{i}"
+
+            if builtin_refgen:
+                hkl_list = pyzebra.generate_hkl_list(job_params, ang_lims)
+                pyzebra.export_hkl_file(
+                    os.path.join(job_dir, base_fname + ".hkl"), hkl_list, geom, base_fname
+                )
+                mhkl_list = pyzebra.generate_hkl_list(job_params, ang_lims, kvect)
+                pyzebra.export_hkl_file(
+                    os.path.join(job_dir, base_fname + ".mhkl"), mhkl_list, geom, base_fname
+                )
+
+            else:
+                _run_sxtal_refgen(job_dir, base_fname, job_params, cfl_value)
+
+            job_files = {}
+            job_report = []
+            if i == 1:  # all hkl files are identical, so keep only one
+                hkl_fname = base_fname + ".hkl"
+                hkl_fpath = os.path.join(job_dir, hkl_fname)
+                with open(hkl_fpath) as f:
+                    job_files[hkl_fname] = f.read()
+
+                hkl_fname_sorted = base_fname + "_sorted.hkl"
+                hkl_fpath_sorted = os.path.join(job_dir, hkl_fname_sorted)
+                job_report.extend(_sort_list(hkl_fpath, hkl_fpath_sorted))
+                with open(hkl_fpath_sorted) as f:
+                    job_files[hkl_fname_sorted] = f.read()
+
+            mhkl_fname = base_fname + ".mhkl"
+            mhkl_fpath = os.path.join(job_dir, mhkl_fname)
+            with open(mhkl_fpath) as f:
+                job_files[mhkl_fname] = f.read()
+
+            mhkl_fname_sorted = base_fname + "_sorted.mhkl"
+            mhkl_fpath_sorted = os.path.join(job_dir, mhkl_fname_sorted)
+            job_report.extend(_sort_list(mhkl_fpath, mhkl_fpath_sorted))
+            with open(mhkl_fpath_sorted) as f:
+                job_files[mhkl_fname_sorted] = f.read()
+
+            return i, job_files, job_report
+
+        async def _process_kvects(temp_dir):
             geom_path = os.path.join(temp_dir, "zebra.geom")
-            if open_geom.value:
-                geom_template = io.StringIO(base64.b64decode(open_geom.value).decode())
+            if geom_value:
+                geom_template = io.StringIO(base64.b64decode(geom_value).decode())
             else:
                 geom_template = None
             pyzebra.export_geom_file(geom_path, ang_lims, geom_template)
@@ -225,72 +391,66 @@ def create():
             with open(geom_path) as f:
                 print(f.read())
 
-            priority = [sorting_0.value, sorting_1.value, sorting_2.value]
-            chunks = [sorting_0_dt.value, sorting_1_dt.value, sorting_2_dt.value]
-            if geom_radiogroup.active == 0:
-                sort_hkl_file = pyzebra.sort_hkl_file_bi
-                priority.extend(set(SORT_OPT_BI) - set(priority))
-            else:
-                sort_hkl_file = pyzebra.sort_hkl_file_nb
-
-            # run sxtal_refgen for each kvect provided
-            for i, kvect in enumerate(kvects, start=1):
-                params["kvect"] = kvect
-                if open_cfl.filename:
-                    base_fname = f"{os.path.splitext(open_cfl.filename)[0]}_{i}"
-                else:
-                    base_fname = f"zebra_{i}"
-
-                cfl_path = os.path.join(temp_dir, base_fname + ".cfl")
-                if open_cfl.value:
-                    cfl_template = io.StringIO(base64.b64decode(open_cfl.value).decode())
-                else:
-                    cfl_template = None
-                pyzebra.export_cfl_file(cfl_path, params, cfl_template)
-
-                print(f"Content of {cfl_path}:")
-                with open(cfl_path) as f:
-                    print(f.read())
-
-                comp_proc = subprocess.run(
-                    [pyzebra.SXTAL_REFGEN_PATH, cfl_path],
-                    cwd=temp_dir,
-                    check=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                )
-                print(" ".join(comp_proc.args))
-                print(comp_proc.stdout)
-
-                if i == 1:  # all hkl files are identical, so keep only one
-                    hkl_fname = base_fname + ".hkl"
-                    hkl_fpath = os.path.join(temp_dir, hkl_fname)
-                    with open(hkl_fpath) as f:
-                        res_files[hkl_fname] = f.read()
-
-                    hkl_fname_sorted = base_fname + "_sorted.hkl"
-                    hkl_fpath_sorted = os.path.join(temp_dir, hkl_fname_sorted)
-                    sort_hkl_file(hkl_fpath, hkl_fpath_sorted, priority, chunks)
-                    with open(hkl_fpath_sorted) as f:
-                        res_files[hkl_fname_sorted] = f.read()
-
-                mhkl_fname = base_fname + ".mhkl"
-                mhkl_fpath = os.path.join(temp_dir, mhkl_fname)
-                with open(mhkl_fpath) as f:
-                    res_files[mhkl_fname] = f.read()
-
-                mhkl_fname_sorted = base_fname + "_sorted.mhkl"
-                mhkl_fpath_sorted = os.path.join(temp_dir, hkl_fname_sorted)
-                sort_hkl_file(mhkl_fpath, mhkl_fpath_sorted, priority, chunks)
-                with open(mhkl_fpath_sorted) as f:
-                    res_files[mhkl_fname_sorted] = f.read()
+            # generate and sort lists for all kvects concurrently, every Sxtal_Refgen run is a
+            # separate process
+            max_workers = min(len(kvects), os.cpu_count() or 1)
+            results = {}
+            n_failed = 0
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                jobs = [
+                    asyncio.wrap_future(executor.submit(_process_kvect, temp_dir, i, kvect))
+                    for i, kvect in enumerate(kvects, start=1)
+                ]
+                # wait for all jobs, so that none of them is still running when temp_dir is removed
+                for n_done, job in enumerate(asyncio.as_completed(jobs), start=1):
+                    try:
+                        i, job_files, job_report = await job
+                    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+                        print(f"Error generating reflection lists: {e}")
+                        n_failed += 1
+                        continue
+
+                    results[i] = job_files, job_report
+                    print(f"k vector {i} ({kvects[i - 1]}) done, {n_done}/{len(kvects)} finished")
+
+            if n_failed:
+                return None
+
+            # collect results in the order of kvects
+            return [results[i] for i in sorted(results)]
+
+        def _show_results(results):
+            optimize_report = []
+            for job_files, job_report in results:
+                res_files.update(job_files)
+                optimize_report.extend(job_report)
 
             created_lists.options = list(res_files)
+            optimize_div.text = "<br>".join(optimize_report)
+
+        def _finish_go():
+            go_button.disabled = False
+
+        # the lists are generated outside of the document lock, so that progress messages reach
+        # the log while jobs are still running
+        @without_document_lock
+        async def go_task():
+            try:
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    results = await _process_kvects(temp_dir)
+                if results is not None:
+                    doc.add_next_tick_callback(partial(_show_results, results))
+            finally:
+                doc.add_next_tick_callback(_finish_go)
+
+        go_button.disabled = True
+        doc.add_next_tick_callback(go_task)
 
     go_button = Button(label="GO", button_type="primary", width=50)
     go_button.on_click(go_button_callback)
 
+    builtin_refgen_cb = CheckboxGroup(labels=["Built-in generator"], active=[], width=150)
+
     def created_lists_callback(_attr, _old, new):
         sel_file = new[0]
         file_text = res_files[sel_file]
@@ -398,28 +558,28 @@ def create():
         o_c = o_c / np.linalg.norm(o_c)
 
         # Read all data
-        hkl_coord = []
-        intensity_vec = []
-        k_flag_vec = []
-        file_flag_vec = []
-
-        for j, fdata in enumerate(filedata):
-            for ind in range(len(fdata["counts"])):
-                # Recognize k_flag_vec
-                hkl = np.array([fdata["h"][ind], fdata["k"][ind], fdata["l"][ind]])
-                reduced_hkl_m = np.minimum(1 - hkl % 1, hkl % 1)
-                for k_ind, _k in enumerate(k):
-                    if all(np.abs(reduced_hkl_m - _k) < tol_k):
-                        k_flag_vec.append(k_ind)
-                        break
-                else:
-                    # not required
-                    continue
-
-                # Save data
-                hkl_coord.append(hkl)
-                intensity_vec.append(fdata["counts"][ind])
-                file_flag_vec.append(j)
+        hkl_coord = np.concatenate(
+            [np.stack((fdata["h"], fdata["k"], fdata["l"]), axis=1) for fdata in filedata]
+        )
+        intensity_vec = np.concatenate([fdata["counts"] for fdata in filedata])
+        file_flag_vec = np.concatenate(
+            [np.full(len(fdata["counts"]), j) for j, fdata in enumerate(filedata)]
+        )
+
+        # Recognize k_flag_vec, the first matching k vector is used
+        reduced_hkl_m = np.minimum(1 - hkl_coord % 1, hkl_coord % 1)
+        k_match = np.all(np.abs(reduced_hkl_m[:, None, :] - k) < tol_k, axis=2)
+        k_flag_vec = np.argmax(k_match, axis=1)
+
+        # Save only required data
+        required = np.any(k_match, axis=1)
+        hkl_coord = hkl_coord[required]
+        intensity_vec = intensity_vec[required]
+        file_flag_vec = file_flag_vec[required]
+        k_flag_vec = k_flag_vec[required]
+
+        # Convert to cartesian coordinates
+        hkl_coord_c = hkl_coord @ M.T
 
         x_spacing = np.dot(M @ x_dir, x_c) * x_length
         y_spacing = np.dot(M @ y_dir, y_vert) * y_length
@@ -439,71 +599,11 @@ def create():
         )
 
         # Plot grid lines
-        xs, ys = [], []
-        xs_minor, ys_minor = [], []
-        for yy in np.arange(min_grid_y, max_grid_y, 1):
-            # Calculate end and start point
-            hkl1 = min_grid_x * x_dir + yy * y_dir
-            hkl2 = max_grid_x * x_dir + yy * y_dir
-            hkl1 = M @ hkl1
-            hkl2 = M @ hkl2
-
-            # Project points onto axes
-            x1 = np.dot(x_c, hkl1) * x_length
-            y1 = np.dot(y_vert, hkl1) * y_length
-            x2 = np.dot(x_c, hkl2) * x_length
-            y2 = np.dot(y_vert, hkl2) * y_length
-
-            xs.append([x1, x2])
-            ys.append([y1, y2])
-
-        for xx in np.arange(min_grid_x, max_grid_x, 1):
-            # Calculate end and start point
-            hkl1 = xx * x_dir + min_grid_y * y_dir
-            hkl2 = xx * x_dir + max_grid_y * y_dir
-            hkl1 = M @ hkl1
-            hkl2 = M @ hkl2
-
-            # Project points onto axes
-            x1 = np.dot(x_c, hkl1) * x_length
-            y1 = np.dot(y_vert, hkl1) * y_length
-            x2 = np.dot(x_c, hkl2) * x_length
-            y2 = np.dot(y_vert, hkl2) * y_length
-
-            xs.append([x1, x2])
-            ys.append([y1, y2])
-
-        for yy in np.arange(min_grid_y, max_grid_y, 0.5):
-            # Calculate end and start point
-            hkl1 = min_grid_x * x_dir + yy * y_dir
-            hkl2 = max_grid_x * x_dir + yy * y_dir
-            hkl1 = M @ hkl1
-            hkl2 = M @ hkl2
-
-            # Project points onto axes
-            x1 = np.dot(x_c, hkl1) * x_length
-            y1 = np.dot(y_vert, hkl1) * y_length
-            x2 = np.dot(x_c, hkl2) * x_length
-            y2 = np.dot(y_vert, hkl2) * y_length
-
-            xs_minor.append([x1, x2])
-            ys_minor.append([y1, y2])
-
-        for xx in np.arange(min_grid_x, max_grid_x, 0.5):
-            # Calculate end and start point
-            hkl1 = xx * x_dir + min_grid_y * y_dir
-            hkl2 = xx * x_dir + max_grid_y * y_dir
-            hkl1 = M @ hkl1
-            hkl2 = M @ hkl2
-
-            # Project points onto axes
-            x1 = np.dot(x_c, hkl1) * x_length
-            y1 = np.dot(y_vert, hkl1) * y_length
-            x2 = np.dot(x_c, hkl2) * x_length
-            y2 = np.dot(y_vert, hkl2) * y_length
-
-            xs_minor.append([x1, x2])
-            ys_minor.append([y1, y2])
+        grid_args = (x_dir, y_dir, M, x_c, y_vert, x_length, y_length)
+        xs, ys = grid_lines((min_grid_x, max_grid_x), (min_grid_y, max_grid_y), 1, *grid_args)
+        xs_minor, ys_minor = grid_lines(
+            (min_grid_x, max_grid_x), (min_grid_y, max_grid_y), 0.5, *grid_args
+        )
 
         grid_source.data.update(xs=xs, ys=ys)
         minor_grid_source.data.update(xs=xs_minor, ys=ys_minor)
@@ -519,46 +619,33 @@ def create():
             # use color to mark different propagation vectors
             prop_legend_flag = 2 in disting_opt_cb.active
 
-            scan_x, scan_y = [], []
-            scan_m, scan_s, scan_c, scan_l, scan_hkl = [], [], [], [], []
-            for j in range(len(hkl_coord)):
-                # Get middle hkl from list
-                hklm = M @ hkl_coord[j]
-
-                # Decide if point is in the cut
-                proj = np.dot(hklm, o_c)
-                if abs(proj - cut_or) >= cut_tol:
-                    continue
-
-                # Project onto axes
-                hklmx = np.dot(hklm, x_c)
-                hklmy = np.dot(hklm, y_vert)
-
-                if intensity_flag and max(intensity_vec) != 0:
-                    markersize = max(6, int(intensity_vec[j] / max(intensity_vec) * 30))
-                else:
-                    markersize = 6
-
-                if file_flag:
-                    plot_symbol = syms[file_flag_vec[j]]
-                else:
-                    plot_symbol = "circle"
-
-                if prop_legend_flag:
-                    col_value = cmap[k_flag_vec[j]]
-                else:
-                    col_value = "black"
-
-                # Plot middle point of scan
-                scan_x.append(hklmx)
-                scan_y.append(hklmy)
-                scan_m.append(plot_symbol)
-                scan_s.append(markersize)
-
-                # Color and legend label
-                scan_c.append(col_value)
-                scan_l.append(filenames[file_flag_vec[j]])
-                scan_hkl.append(hkl_coord[j])
+            # Decide if points are in the cut
+            in_cut = np.abs(hkl_coord_c @ o_c - cut_or) < cut_tol
+            n_points = np.count_nonzero(in_cut)
+
+            # Project onto axes
+            scan_x = hkl_coord_c[in_cut] @ x_c
+            scan_y = hkl_coord_c[in_cut] @ y_vert
+
+            if intensity_flag and n_points and np.max(intensity_vec) != 0:
+                scan_s = intensity_vec[in_cut] / np.max(intensity_vec) * 30
+                scan_s = np.maximum(6, scan_s.astype(int))
+            else:
+                scan_s = np.full(n_points, 6)
+
+            if file_flag:
+                scan_m = [syms[ind] for ind in file_flag_vec[in_cut]]
+            else:
+                scan_m = ["circle"] * n_points
+
+            if prop_legend_flag:
+                scan_c = [cmap[ind] for ind in k_flag_vec[in_cut]]
+            else:
+                scan_c = ["black"] * n_points
+
+            # Legend labels
+            scan_l = [filenames[ind] for ind in file_flag_vec[in_cut]]
+            scan_hkl = list(hkl_coord[in_cut])
 
             scatter_source.data.update(
                 x=scan_x, y=scan_y, m=scan_m, s=scan_s, c=scan_c, l=scan_l, hkl=scan_hkl
@@ -691,7 +778,18 @@ def create():
         cryst_layout,
         ubmat_layout,
         row(ranges_layout, Spacer(width=50), magstruct_layout),
-        row(sorting_layout, Spacer(width=30), column(Spacer(height=19), go_button)),
+        row(
+            sorting_layout,
+            Spacer(width=30),
+            column(Spacer(height=19), go_button),
+            column(Spacer(height=19), builtin_refgen_cb),
+        ),
+        row(
+            column(Spacer(height=19), optimize_travel_cb),
+            motor_speeds,
+            optimize_time_limit,
+            optimize_div,
+        ),
         row(created_lists, preview_lists),
         row(app_dlfiles.button, plot_list),
     )
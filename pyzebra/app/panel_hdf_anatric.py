@@ -1,18 +1,30 @@
+import asyncio
 import base64
+import copy
 import io
 import os
 import re
+import subprocess
 import tempfile
+from functools import partial
 
+import numpy as np
+from bokeh.document import without_document_lock
 from bokeh.io import curdoc
 from bokeh.layouts import column, row
 from bokeh.models import (
     Button,
+    ColumnDataSource,
+    DataTable,
     Div,
     FileInput,
+    NumberFormatter,
+    NumericInput,
     Panel,
     Select,
     Spacer,
+    Spinner,
+    TableColumn,
     Tabs,
     TextAreaInput,
     TextInput,
@@ -21,9 +33,29 @@ from bokeh.models import (
 import pyzebra
 from pyzebra import DATA_FACTORY_IMPLEMENTATION, REFLECTION_PRINTER_FORMATS
 
+RES_PREVIEW_LINES = 1000
+REFL_PAGE_SIZE = 100
+
+SWEEP_PARAMS = [
+    "threshold",
+    "shell",
+    "steepness",
+    "duplicateDistance",
+    "maxequal",
+    "smoothSize",
+    "loop",
+    "minPeakCount",
+    "targetMonitor",
+]
+
+# results are shared between all sessions
+anatric_cache = pyzebra.ResultCache(os.path.join(pyzebra.RESULT_CACHE_PATH, "anatric"))
+anatric_runner = pyzebra.AnatricRunner()
+
 
 def create():
     doc = curdoc()
+    anatric_runner.max_running = doc.anatric_max_runs
     config = pyzebra.AnatricConfig()
 
     def _load_config_file(file):
@@ -343,21 +375,316 @@ def create():
     )
     algorithm_params.on_change("active", algorithm_tabs_callback)
 
-    def process_button_callback():
+    anatric_task = None
+
+    def _show_output(output_text, res_text=None):
+        output_log.value = output_text
+        if res_text is not None:
+            _show_reflections(res_text)
+
+    refl_data = pyzebra.parse_reflection_file("")
+    refl_view = np.arange(0)
+
+    def _show_reflections(res_text):
+        nonlocal refl_data
+
+        refl_data = pyzebra.parse_reflection_file(res_text, config.reflectionPrinter_format)
+
+        # avoid sending large files to the browser, they can be browsed in the table
+        lines = res_text.splitlines(keepends=True)
+        if len(lines) > RES_PREVIEW_LINES:
+            n_more = len(lines) - RES_PREVIEW_LINES
+            res_text = "".join(lines[:RES_PREVIEW_LINES]) + f"... {n_more} more lines\n"
+        output_res.value = res_text
+        names = list(refl_data.dtype.names)
+        refl_table.columns = [TableColumn(field=name, title=name) for name in names]
+        refl_sort_select.options = names
+        if refl_sort_select.value not in names:
+            refl_sort_select.value = "h"
+        refl_filter_select.options = names
+        if refl_filter_select.value not in names:
+            refl_filter_select.value = "h"
+
+        refl_table_source.data = {name: [] for name in names}
+        _update_refl_view()
+
+    def _update_refl_view():
+        nonlocal refl_view
+        filter_values = refl_data[refl_filter_select.value]
+        mask = np.ones(len(refl_data), dtype=bool)
+        if refl_filter_min.value is not None:
+            mask &= filter_values >= refl_filter_min.value
+        if refl_filter_max.value is not None:
+            mask &= filter_values <= refl_filter_max.value
+
+        refl_view = np.flatnonzero(mask)
+        order = np.argsort(refl_data[refl_sort_select.value][refl_view], kind="stable")
+        if refl_order_select.value == "descending":
+            order = order[::-1]
+        refl_view = refl_view[order]
+
+        n_pages = max(int(np.ceil(len(refl_view) / REFL_PAGE_SIZE)), 1)
+        refl_page_spinner.high = n_pages
+        refl_page_div.text = f"of {n_pages}, {len(refl_view)} of {len(refl_data)} reflections"
+        if refl_page_spinner.value > n_pages:
+            refl_page_spinner.value = n_pages  # triggers page update
+        else:
+            _update_refl_page()
+
+    def _update_refl_page():
+        start = (refl_page_spinner.value - 1) * REFL_PAGE_SIZE
+        page = refl_data[refl_view[start : start + REFL_PAGE_SIZE]]
+        n_rows = len(page)
+
+        data = refl_table_source.data
+        if set(data) == set(page.dtype.names) and all(len(val) == n_rows for val in data.values()):
+            # only patch values of the page that is already shown
+            refl_table_source.patch(
+                {name: [(slice(0, n_rows), page[name])] for name in page.dtype.names}
+            )
+        else:
+            refl_table_source.data = {name: page[name] for name in page.dtype.names}
+
+    def refl_view_callback(_attr, _old, _new):
+        _update_refl_view()
+
+    def refl_page_spinner_callback(_attr, _old, _new):
+        _update_refl_page()
+
+    refl_table_source = ColumnDataSource(dict(h=[], k=[], l=[]))
+    refl_table = DataTable(
+        source=refl_table_source,
+        columns=[TableColumn(field=name, title=name) for name in ("h", "k", "l")],
+        width=465,
+        height=250,
+        sortable=False,
+        autosize_mode="fit_columns",
+    )
+
+    refl_sort_select = Select(title="Sort by:", options=["h", "k", "l"], value="h", width=100)
+    refl_sort_select.on_change("value", refl_view_callback)
+    refl_order_select = Select(
+        title="Order:", options=["ascending", "descending"], value="ascending", width=100
+    )
+    refl_order_select.on_change("value", refl_view_callback)
+
+    refl_filter_select = Select(title="Filter:", options=["h", "k", "l"], value="h", width=100)
+    refl_filter_select.on_change("value", refl_view_callback)
+    refl_filter_min = NumericInput(title="min:", mode="float", width=70)
+    refl_filter_min.on_change("value", refl_view_callback)
+    refl_filter_max = NumericInput(title="max:", mode="float", width=70)
+    refl_filter_max.on_change("value", refl_view_callback)
+
+    refl_page_spinner = Spinner(title="Page:", value=1, low=1, high=1, step=1, width=70)
+    refl_page_spinner.on_change("value", refl_page_spinner_callback)
+    refl_page_div = Div(margin=(30, 5, 0, 5))
+
+    def _finish_run():
+        process_button.disabled = False
+        sweep_button.disabled = False
+        cancel_button.disabled = True
+
+    async def _run_anatric(run_config, n_chunks, cache_key):
+        nonlocal anatric_task
+        anatric_task = asyncio.current_task()
+
+        def on_output(stdout, log):
+            doc.add_next_tick_callback(partial(_show_output, log + stdout))
+
+        def on_queued(position):
+            text = f"Waiting for other anatric runs to finish, position in the queue: {position}"
+            doc.add_next_tick_callback(partial(_show_output, text))
+
+        logfile = run_config.logfile
+        res_file = run_config.reflectionPrinter_file
+        try:
+            if n_chunks > 1:
+                doc.add_next_tick_callback(
+                    partial(_show_output, f"Processing {n_chunks} chunks of the file list...")
+                )
+                res_text, log = await pyzebra.anatric_split(
+                    run_config,
+                    n_chunks,
+                    anatric_path=doc.anatric_path,
+                    runner=anatric_runner,
+                    on_queued=on_queued,
+                )
+                out_files = {logfile: log, res_file: res_text}
+
+            else:
+                out_files, log = await _run_single(run_config, on_output, on_queued)
+
+            anatric_cache.put(cache_key, out_files, log)
+            doc.add_next_tick_callback(
+                partial(_show_output, out_files[logfile], out_files[res_file])
+            )
+
+        except asyncio.CancelledError:
+            doc.add_next_tick_callback(partial(_show_output, "Cancelled."))
+
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            print(e)
+            doc.add_next_tick_callback(partial(_show_output, f"anatric failed: {e}"))
+
+        finally:
+            anatric_task = None
+            doc.add_next_tick_callback(_finish_run)
+
+    async def _run_single(run_config, on_output, on_queued):
+        logfile = run_config.logfile
+        res_file = run_config.reflectionPrinter_file
         with tempfile.TemporaryDirectory() as temp_dir:
-            temp_file = temp_dir + "/config.xml"
-            config.save_as(temp_file)
-            pyzebra.anatric(temp_file, anatric_path=doc.anatric_path, cwd=temp_dir)
+            temp_file = os.path.join(temp_dir, "config.xml")
+            run_config.save_as(temp_file)
+
+            log = await anatric_runner.run(
+                temp_file,
+                anatric_path=doc.anatric_path,
+                cwd=temp_dir,
+                logfile=logfile,
+                on_output=on_output,
+                on_queued=on_queued,
+            )
 
-            with open(os.path.join(temp_dir, config.logfile)) as f_log:
-                output_log.value = f_log.read()
+            out_files = {}
+            for fname in (logfile, res_file):
+                with open(os.path.join(temp_dir, fname)) as f:
+                    out_files[fname] = f.read()
 
-            with open(os.path.join(temp_dir, config.reflectionPrinter_file)) as f_res:
-                output_res.value = f_res.read()
+        return out_files, log
+
+    def process_button_callback():
+        logfile = config.logfile
+        res_file = config.reflectionPrinter_file
+        n_chunks = split_spinner.value
+        cache_key = anatric_cache.make_key(
+            doc.anatric_path, config.tostring(), pyzebra.filelist_mtimes(config), n_chunks
+        )
+
+        cached = anatric_cache.get(cache_key)
+        if cached is not None:
+            print("Input files and config are unchanged, using cached anatric results")
+            out_files, _ = cached
+            _show_output(out_files[logfile], out_files[res_file])
+            return
+
+        process_button.disabled = True
+        sweep_button.disabled = True
+        cancel_button.disabled = False
+        _show_output("", "")
+        run_config = copy.deepcopy(config)
+
+        # partial objects do not carry the nolock flag, so wrap the call in a coroutine function
+        @without_document_lock
+        async def run_task():
+            await _run_anatric(run_config, n_chunks, cache_key)
+
+        doc.add_next_tick_callback(run_task)
 
     process_button = Button(label="Process", button_type="primary")
     process_button.on_click(process_button_callback)
 
+    # split the file list into chunks processed in parallel, 1 means a single anatric run
+    split_spinner = Spinner(title="Parallel chunks:", value=1, low=1, step=1, width=100)
+
+    def cancel_button_callback():
+        if anatric_task is not None:
+            anatric_task.cancel()
+
+    cancel_button = Button(label="Cancel", disabled=True)
+    cancel_button.on_click(cancel_button_callback)
+
+    def _add_sweep_result(result):
+        sweep_table_source.stream({key: [val] for key, val in result.items()})
+
+    def _show_sweep_results(results):
+        sweep_table_source.data.update(
+            {key: [res[key] for res in results] for key in sweep_table_source.data}
+        )
+
+    async def _run_sweep(sweep_config, param_grid, max_workers):
+        nonlocal anatric_task
+        anatric_task = asyncio.current_task()
+
+        def on_result(result):
+            doc.add_next_tick_callback(partial(_add_sweep_result, result))
+
+        try:
+            results = await pyzebra.anatric_sweep(
+                sweep_config,
+                param_grid,
+                anatric_path=doc.anatric_path,
+                max_workers=max_workers,
+                on_result=on_result,
+                runner=anatric_runner,
+            )
+            # completed runs are streamed in arbitrary order, so show all results sorted
+            doc.add_next_tick_callback(partial(_show_sweep_results, results))
+
+        except asyncio.CancelledError:
+            print("Parameter sweep cancelled")
+
+        finally:
+            anatric_task = None
+            doc.add_next_tick_callback(_finish_run)
+
+    def sweep_button_callback():
+        param_grid = {}
+        for line in sweep_params_textareainput.value.splitlines():
+            if not line.strip():
+                continue
+            name, _, values = line.partition(":")
+            name = name.strip()
+            if name not in SWEEP_PARAMS:
+                print(f"Parameter '{name}' can not be swept, use one of {', '.join(SWEEP_PARAMS)}")
+                return
+            param_grid[name] = values.split()
+
+        if not param_grid:
+            return
+
+        fields = [*param_grid, "reflections", "runtime", "error"]
+        sweep_table.columns = [TableColumn(field=name, title=name) for name in param_grid] + [
+            TableColumn(field="reflections", title="Reflections"),
+            TableColumn(field="runtime", title="Runtime, s", formatter=num_formatter),
+            TableColumn(field="error", title="Error"),
+        ]
+        sweep_table_source.data = {field: [] for field in fields}
+
+        process_button.disabled = True
+        sweep_button.disabled = True
+        cancel_button.disabled = False
+        sweep_config = copy.deepcopy(config)
+        max_workers = sweep_workers_spinner.value
+
+        @without_document_lock
+        async def sweep_task():
+            await _run_sweep(sweep_config, param_grid, max_workers)
+
+        doc.add_next_tick_callback(sweep_task)
+
+    sweep_params_textareainput = TextAreaInput(
+        title="Parameter sweep:", placeholder="threshold: 10 20 40\nshell: 1 2", height=100
+    )
+    sweep_workers_spinner = Spinner(title="Workers:", value=2, low=1, step=1, width=70)
+
+    sweep_button = Button(label="Run sweep", button_type="primary")
+    sweep_button.on_click(sweep_button_callback)
+
+    num_formatter = NumberFormatter(format="0.0")
+    sweep_table_source = ColumnDataSource(dict(reflections=[], runtime=[], error=[]))
+    sweep_table = DataTable(
+        source=sweep_table_source,
+        columns=[
+            TableColumn(field="reflections", title="Reflections"),
+            TableColumn(field="runtime", title="Runtime, s", formatter=num_formatter),
+            TableColumn(field="error", title="Error"),
+        ],
+        width=465,
+        height=200,
+        autosize_mode="fit_columns",
+    )
+
     output_log = TextAreaInput(title="Logfile output:", height=320, width=465, disabled=True)
     output_res = TextAreaInput(title="Result output:", height=320, width=465, disabled=True)
     output_config = TextAreaInput(title="Current config:", height=320, width=465, disabled=True)
@@ -382,13 +709,46 @@ def create():
 
     tab_layout = row(
         general_params_layout,
-        column(output_config, algorithm_params, row(process_button)),
-        column(output_log, output_res),
+        column(
+            output_config,
+            algorithm_params,
+            row(split_spinner, column(Spacer(height=19), row(process_button, cancel_button))),
+        ),
+        column(
+            output_log,
+            output_res,
+            row(
+                refl_sort_select,
+                refl_order_select,
+                refl_filter_select,
+                refl_filter_min,
+                refl_filter_max,
+            ),
+            refl_table,
+            row(refl_page_spinner, refl_page_div),
+        ),
+        column(
+            sweep_params_textareainput,
+            row(sweep_workers_spinner, column(Spacer(height=19), sweep_button)),
+            sweep_table,
+        ),
     )
 
-    async def update_config():
+    config_update_scheduled = False
+
+    def update_config():
+        nonlocal config_update_scheduled
+        config_update_scheduled = False
         output_config.value = config.tostring()
 
-    doc.add_periodic_callback(update_config, 1000)
+    def config_change_callback():
+        # a single widget change can modify many config values, serialize them only once
+        nonlocal config_update_scheduled
+        if not config_update_scheduled:
+            config_update_scheduled = True
+            doc.add_next_tick_callback(update_config)
+
+    config.on_change(config_change_callback)
+    update_config()
 
     return Panel(child=tab_layout, title="hdf anatric")
@@ -3,7 +3,6 @@ import io
 import os
 
 import numpy as np
-from bokeh.io import curdoc
 from bokeh.layouts import column, gridplot, row
 from bokeh.models import (
     Button,
@@ -27,6 +26,7 @@ from bokeh.models import (
 from bokeh.plotting import figure
 
 import pyzebra
+from pyzebra import app
 
 IMAGE_W = 256
 IMAGE_H = 128
@@ -35,23 +35,21 @@ IMAGE_PLOT_H = int(IMAGE_H * 2.4) + 27
 
 
 def create():
-    doc = curdoc()
     dataset = []
     cami_meta = {}
 
     num_formatter = NumberFormatter(format="0.00", nan_format="")
 
+    proposal_path = ""
+    proposal_files = []
+
     def file_select_update():
         if data_source.value == "proposal number":
-            proposal_path = proposal_textinput.name
-            if proposal_path:
-                file_list = []
-                for file in os.listdir(proposal_path):
-                    if file.endswith(".hdf"):
-                        file_list.append((os.path.join(proposal_path, file), file))
-                file_select.options = file_list
-            else:
-                file_select.options = []
+            file_select.options = [
+                (os.path.join(proposal_path, file), file)
+                for file in catalog_filter.apply(proposal_path, proposal_files)
+                if file.endswith(".hdf")
+            ]
 
         else:  # "cami file"
             if not cami_meta:
@@ -72,13 +70,15 @@ def create():
     )
     data_source.on_change("value", data_source_callback)
 
-    doc.add_periodic_callback(file_select_update, 5000)
+    catalog_filter = app.CatalogFilter(file_select_update)
 
-    def proposal_textinput_callback(_attr, _old, _new):
+    def proposal_files_callback(path, files):
+        nonlocal proposal_path, proposal_files
+        proposal_path = path
+        proposal_files = files
         file_select_update()
 
-    proposal_textinput = doc.proposal_textinput
-    proposal_textinput.on_change("name", proposal_textinput_callback)
+    app.watch_proposal_files(proposal_files_callback)
 
     def upload_button_callback(_attr, _old, new):
         nonlocal cami_meta
@@ -248,10 +248,10 @@ def create():
 
     def _update_proj_plots():
         scan = _get_selected_scan()
-        counts = scan["counts"]
-        n_im, n_y, n_x = counts.shape
-        im_proj_x = np.mean(counts, axis=1)
-        im_proj_y = np.mean(counts, axis=2)
+        n_im, n_y, n_x = scan["counts"].shape
+        counts_stats = pyzebra.get_counts_stats(scan)
+        im_proj_x = counts_stats["proj_x"]
+        im_proj_y = counts_stats["proj_y"]
 
         # normalize for simpler colormapping
         im_proj_max_val = max(np.max(im_proj_x), np.max(im_proj_y))
@@ -506,6 +506,7 @@ def create():
         data_source,
         upload_div,
         upload_button,
+        catalog_filter.textinput,
         file_select,
         row(file_open_button, file_append_button),
     )
@@ -1,9 +1,11 @@
 import base64
 import io
 import os
+from functools import lru_cache
 
 import numpy as np
-from bokeh.events import MouseEnter
+from bokeh import palettes
+from bokeh.events import RangesUpdate
 from bokeh.io import curdoc
 from bokeh.layouts import column, gridplot, row
 from bokeh.models import (
@@ -12,6 +14,7 @@ from bokeh.models import (
     CellEditor,
     CheckboxGroup,
     ColumnDataSource,
+    CustomJSHover,
     DataTable,
     Div,
     FileInput,
@@ -30,15 +33,76 @@ from bokeh.models import (
     Spinner,
     TableColumn,
     Tabs,
+    Toggle,
 )
 from bokeh.plotting import figure
 
 import pyzebra
+from pyzebra import app
 
 IMAGE_W = 256
 IMAGE_H = 128
 IMAGE_PLOT_W = int(IMAGE_W * 2.4) + 52
 IMAGE_PLOT_H = int(IMAGE_H * 2.4) + 27
+# maximum number of frame bins displayed in projection plots
+PROJ_PLOT_FRAMES_H = 500
+
+# evaluate detector geometry only for the hovered pixel, instead of sending per-pixel arrays
+det_geom_js_code = """
+const p = source.data;
+const pi_r = 180 / Math.PI;
+
+const xobs = (Math.floor(special_vars.x) - p.xnorm[0]) * p.xpix[0];
+const yobs = (Math.floor(special_vars.y) - p.ynorm[0]) * p.ypix[0];
+const ddist = p.ddist[0];
+const b = ddist * Math.cos(yobs / ddist);
+const z = ddist * Math.sin(yobs / ddist);
+const d = Math.sqrt(xobs * xobs + b * b);
+
+const gamma = p.gammad[0] + Math.atan2(xobs, b) * pi_r;
+const nu = p.nud[0] + Math.atan2(z, d) * pi_r;
+
+if (format == "gamma") return gamma.toFixed(3);
+if (format == "nu") return nu.toFixed(3);
+if (format == "omega") return p.om[0].toFixed(3);
+
+// diffraction vector in lab system, rotated by omega, chi and phi
+const ga_r = gamma / pi_r;
+const nu_r = nu / pi_r;
+const wave = p.wave[0];
+const z4 = [
+    Math.sin(ga_r) * Math.cos(nu_r) / wave,
+    (Math.cos(ga_r) * Math.cos(nu_r) - 1) / wave,
+    Math.sin(nu_r) / wave,
+];
+
+let c = Math.cos(p.om[0] / pi_r);
+let s = Math.sin(p.om[0] / pi_r);
+const z3 = [c * z4[0] - s * z4[1], s * z4[0] + c * z4[1], z4[2]];
+
+c = Math.cos(p.chi[0] / pi_r);
+s = Math.sin(p.chi[0] / pi_r);
+const z2 = [c * z3[0] - s * z3[2], z3[1], s * z3[0] + c * z3[2]];
+
+c = Math.cos(p.phi[0] / pi_r);
+s = Math.sin(p.phi[0] / pi_r);
+const z1 = [c * z2[0] - s * z2[1], s * z2[0] + c * z2[1], z2[2]];
+
+const row = {h: 0, k: 1, l: 2}[format];
+const ub_inv = p.ub_inv[0];
+const val = ub_inv[3 * row] * z1[0] + ub_inv[3 * row + 1] * z1[1] + ub_inv[3 * row + 2] * z1[2];
+
+return val.toFixed(3);
+"""
+
+GEOM_TOOLTIPS = [
+    ("gamma", "$x{gamma}"),
+    ("nu", "$x{nu}"),
+    ("omega", "$x{omega}"),
+    ("h", "$x{h}"),
+    ("k", "$x{k}"),
+    ("l", "$x{l}"),
+]
 
 
 def create():
@@ -47,18 +111,19 @@ def create():
     cami_meta = {}
 
     num_formatter = NumberFormatter(format="0.00", nan_format="")
+    frame_prefetcher = app.FramePrefetcher(calculate_frame)
+    doc.on_session_destroyed(lambda _session_context: frame_prefetcher.shutdown())
+
+    proposal_path = ""
+    proposal_files = []
 
     def file_select_update():
         if data_source.value == "proposal number":
-            proposal_path = proposal_textinput.name
-            if proposal_path:
-                file_list = []
-                for file in os.listdir(proposal_path):
-                    if file.endswith(".hdf"):
-                        file_list.append((os.path.join(proposal_path, file), file))
-                file_select.options = file_list
-            else:
-                file_select.options = []
+            file_select.options = [
+                (os.path.join(proposal_path, file), file)
+                for file in catalog_filter.apply(proposal_path, proposal_files)
+                if file.endswith(".hdf")
+            ]
 
         else:  # "cami file"
             if not cami_meta:
@@ -79,13 +144,15 @@ def create():
     )
     data_source.on_change("value", data_source_callback)
 
-    doc.add_periodic_callback(file_select_update, 5000)
+    catalog_filter = app.CatalogFilter(file_select_update)
 
-    def proposal_textinput_callback(_attr, _old, _new):
+    def proposal_files_callback(path, files):
+        nonlocal proposal_path, proposal_files
+        proposal_path = path
+        proposal_files = files
         file_select_update()
 
-    proposal_textinput = doc.proposal_textinput
-    proposal_textinput.on_change("name", proposal_textinput_callback)
+    app.watch_proposal_files(proposal_files_callback)
 
     def upload_cami_button_callback(_attr, _old, new):
         nonlocal cami_meta
@@ -109,6 +176,10 @@ def create():
         dataset = [scan]
         last_im_index = scan["counts"].shape[0] - 1
 
+        # stop playback of the replaced data
+        play_toggle.active = False
+        play_toggle.disabled = False
+
         index_spinner.value = 0
         index_spinner.high = last_im_index
         if last_im_index == 0:
@@ -221,6 +292,10 @@ def create():
         scan = _get_selected_scan()
         last_im_index = scan["counts"].shape[0] - 1
 
+        # stop playback of the replaced data
+        play_toggle.active = False
+        play_toggle.disabled = False
+
         index_spinner.value = 0
         index_spinner.high = last_im_index
         if last_im_index == 0:
@@ -279,6 +354,7 @@ def create():
     def monitor_spinner_callback(_attr, _old, new):
         if dataset:
             pyzebra.normalize_dataset(dataset, new)
+            frame_prefetcher.clear()
             _update_image()
             _update_proj_plots()
 
@@ -296,6 +372,7 @@ def create():
             return
 
         pyzebra.merge_h5_scans(scan_into, scan_from)
+        frame_prefetcher.clear()
         _update_table()
         _update_image()
         _update_proj_plots()
@@ -305,6 +382,7 @@ def create():
 
     def restore_button_callback():
         pyzebra.restore_scan(_get_selected_scan())
+        frame_prefetcher.clear()
         _update_table()
         _update_image()
         _update_proj_plots()
@@ -317,93 +395,105 @@ def create():
             index = index_spinner.value
 
         scan = _get_selected_scan()
-        current_image = scan["counts"][index]
-        proj_v_line_source.data.update(
-            x=np.arange(0, IMAGE_W) + 0.5, y=np.mean(current_image, axis=0)
-        )
-        proj_h_line_source.data.update(
-            x=np.mean(current_image, axis=1), y=np.arange(0, IMAGE_H) + 0.5
-        )
+        frame = frame_prefetcher.get(scan, index)
+        frame_prefetcher.prefetch(scan, index)
 
-        image_source.data.update(h=[np.zeros((1, 1))], k=[np.zeros((1, 1))], l=[np.zeros((1, 1))])
-        image_source.data.update(image=[current_image])
+        proj_v_line_source.data.update(x=np.arange(0, IMAGE_W) + 0.5, y=frame["proj_v"])
+        proj_h_line_source.data.update(x=frame["proj_h"], y=np.arange(0, IMAGE_H) + 0.5)
 
         if main_auto_checkbox.active:
-            im_min = np.min(current_image)
-            im_max = np.max(current_image)
+            display_min_spinner.value = frame["im_min"]
+            display_max_spinner.value = frame["im_max"]
+
+        if render_rgba_checkbox.active:
+            image_rgba = render_rgba(
+                frame["image"],
+                getattr(palettes, colormap_select.value),
+                display_min_spinner.value,
+                display_max_spinner.value,
+                log=bool(colormap_scale_rg.active),
+            )
+            image_source.data.update(
+                image=[np.zeros((1, 1), dtype="float32")], image_rgba=[image_rgba]
+            )
+        else:
+            image_source.data.update(
+                image=[frame["image"]], image_rgba=[np.zeros((1, 1), dtype="uint32")]
+            )
 
-            display_min_spinner.value = im_min
-            display_max_spinner.value = im_max
+        metadata_table_source.data.update(mf=[frame["mf"]], temp=[frame["temp"]])
+        det_geom_source.data.update(**frame["det_geom"])
+        detcenter_table_source.data.update(**frame["det_center"])
 
-        if "mf" in scan:
-            metadata_table_source.data.update(mf=[scan["mf"][index]])
-        else:
-            metadata_table_source.data.update(mf=[None])
+    proj_lod = None
 
-        if "temp" in scan:
-            metadata_table_source.data.update(temp=[scan["temp"][index]])
-        else:
-            metadata_table_source.data.update(temp=[None])
-
-        gamma, nu = calculate_pol(scan, index)
-        omega = np.ones((IMAGE_H, IMAGE_W)) * scan["omega"][index]
-        image_source.data.update(gamma=[gamma], nu=[nu], omega=[omega])
-
-        # update detector center angles
-        det_c_x = int(IMAGE_W / 2)
-        det_c_y = int(IMAGE_H / 2)
-        if scan["zebra_mode"] == "nb":
-            gamma_c = gamma[det_c_y, det_c_x]
-            nu_c = nu[det_c_y, det_c_x]
-            omega_c = omega[det_c_y, det_c_x]
-            chi_c = scan["chi"][index]
-            phi_c = scan["phi"][index]
+    def _update_proj_images(force=False):
+        nonlocal proj_lod
+        scan = _get_selected_scan()
+        n_im = scan["counts"].shape[0]
+        pyramid = pyzebra.get_proj_pyramid(scan)
+
+        # pick the coarsest level that still has at least one bin per screen pixel
+        frame_start = max(frame_range.start, 0)
+        frame_end = min(frame_range.end, n_im)
+        n_visible = max(frame_end - frame_start, 1)
+        level = max(int(np.floor(np.log2(n_visible / PROJ_PLOT_FRAMES_H))), 0)
+        level = min(level, len(pyramid["proj_x"]) - 1)
+        bin_size = 2**level
+
+        if not force and proj_lod is not None:
+            lod_level, lod_start, lod_end = proj_lod
+            if lod_level == level and lod_start <= frame_start and frame_end <= lod_end:
+                # the visible range is already covered with the required resolution
+                return
 
-        else:  # zebra_mode == "bi"
-            wave = scan["wave"]
-            ddist = scan["ddist"]
-            gammad = scan["gamma"][index]
-            om = scan["omega"][index]
-            ch = scan["chi"][index]
-            ph = scan["phi"][index]
-            nud = scan["nu"]
-
-            nu_c = 0
-            chi_c, phi_c, gamma_c, omega_c = pyzebra.ang_proc(
-                wave, ddist, gammad, om, ch, ph, nud, det_c_x, det_c_y
-            )
+        # send the visible range together with margins for panning
+        bin_start = max(int(np.floor((frame_start - n_visible / 2) / bin_size)), 0)
+        bin_end = int(np.ceil((frame_end + n_visible / 2) / bin_size))
 
-        detcenter_table_source.data.update(
-            gamma=[gamma_c], nu=[nu_c], omega=[omega_c], chi=[chi_c], phi=[phi_c]
-        )
+        im_proj_x = pyramid["proj_x"][level][bin_start:bin_end]
+        im_proj_y = pyramid["proj_y"][level][bin_start:bin_end]
+        n_bins = im_proj_x.shape[0]
+
+        # normalize for simpler colormapping
+        im_proj_x = 1000 * im_proj_x / proj_max_val
+        im_proj_y = 1000 * im_proj_y / proj_max_val
+
+        y = bin_start * bin_size
+        dh = n_bins * bin_size
+        proj_x_image_source.data.update(image=[im_proj_x], y=[y], dw=[im_proj_x.shape[1]], dh=[dh])
+        proj_y_image_source.data.update(image=[im_proj_y], y=[y], dw=[im_proj_y.shape[1]], dh=[dh])
+
+        proj_lod = (level, y, min(y + dh, n_im))
+
+    def proj_ranges_update_callback(_event):
+        if dataset:
+            _update_proj_images()
+
+    proj_max_val = 1
 
     def _update_proj_plots():
+        nonlocal proj_max_val
         scan = _get_selected_scan()
-        counts = scan["counts"]
-        n_im, n_y, n_x = counts.shape
-        im_proj_x = np.mean(counts, axis=1)
-        im_proj_y = np.mean(counts, axis=2)
+        n_im = scan["counts"].shape[0]
+        counts_stats = pyzebra.get_counts_stats(scan)
+        im_proj_x = counts_stats["proj_x"]
+        im_proj_y = counts_stats["proj_y"]
 
-        # normalize for simpler colormapping
-        im_proj_max_val = max(np.max(im_proj_x), np.max(im_proj_y))
-        im_proj_x = 1000 * im_proj_x / im_proj_max_val
-        im_proj_y = 1000 * im_proj_y / im_proj_max_val
-
-        proj_x_image_source.data.update(image=[im_proj_x], dw=[n_x], dh=[n_im])
-        proj_y_image_source.data.update(image=[im_proj_y], dw=[n_y], dh=[n_im])
+        proj_max_val = max(np.max(im_proj_x), np.max(im_proj_y))
 
         if proj_auto_checkbox.active:
             im_min = min(np.min(im_proj_x), np.min(im_proj_y))
-            im_max = max(np.max(im_proj_x), np.max(im_proj_y))
 
-            proj_display_min_spinner.value = im_min
-            proj_display_max_spinner.value = im_max
+            proj_display_min_spinner.value = 1000 * im_min / proj_max_val
+            proj_display_max_spinner.value = 1000
 
         frame_range.start = 0
         frame_range.end = n_im
         frame_range.reset_start = 0
         frame_range.reset_end = n_im
         frame_range.bounds = (0, n_im)
+        _update_proj_images(force=True)
 
         scan_motor = scan["scan_motor"]
         proj_y_plot.yaxis.axis_label = f"Scanning motor, {scan_motor}"
@@ -419,7 +509,7 @@ def create():
         # handle both, ascending and descending sequences
         scanning_motor_range.bounds = (min(var_start, var_end), max(var_start, var_end))
 
-        gamma = image_source.data["gamma"][0]
+        gamma, nu = calculate_pol(scan, index_spinner.value)
         gamma_start = gamma[0, 0]
         gamma_end = gamma[0, -1]
 
@@ -429,7 +519,6 @@ def create():
         gamma_range.reset_end = gamma_end
         gamma_range.bounds = (min(gamma_start, gamma_end), max(gamma_start, gamma_end))
 
-        nu = image_source.data["nu"][0]
         nu_start = nu[0, 0]
         nu_end = nu[-1, 0]
 
@@ -449,9 +538,43 @@ def create():
     index_spinner = Spinner(title="Image index:", value=0, low=0, width=100)
     index_spinner.on_change("value", index_callback)
 
-    index_slider.js_link("value_throttled", index_spinner, "value")
+    # frames around the current one are prefetched, so follow the slider while it is dragged
+    index_slider.js_link("value", index_spinner, "value")
     index_spinner.js_link("value", index_slider, "value")
 
+    play_callback = None
+
+    def _play_next_frame():
+        if index_spinner.high is None:
+            return
+
+        index_spinner.value = (index_spinner.value + 1) % (index_spinner.high + 1)
+
+    def play_toggle_callback(_attr, _old, new):
+        nonlocal play_callback
+        if play_callback is not None:
+            doc.remove_periodic_callback(play_callback)
+            play_callback = None
+
+        if new:
+            play_toggle.label = "Pause"
+            play_callback = doc.add_periodic_callback(
+                _play_next_frame, 1000 / play_fps_spinner.value
+            )
+        else:
+            play_toggle.label = "Play"
+
+    play_toggle = Toggle(label="Play", width=70, disabled=True)
+    play_toggle.on_change("active", play_toggle_callback)
+
+    def play_fps_spinner_callback(_attr, _old, _new):
+        if play_toggle.active:
+            # restart playback with the new frame rate
+            play_toggle_callback(None, None, True)
+
+    play_fps_spinner = Spinner(title="FPS:", value=10, low=1, high=30, width=70)
+    play_fps_spinner.on_change("value", play_fps_spinner_callback)
+
     # image viewer figure
     plot = figure(
         x_range=Range1d(0, IMAGE_W, bounds=(0, IMAGE_W)),
@@ -472,12 +595,7 @@ def create():
     image_source = ColumnDataSource(
         dict(
             image=[np.zeros((IMAGE_H, IMAGE_W), dtype="float32")],
-            h=[np.zeros((1, 1))],
-            k=[np.zeros((1, 1))],
-            l=[np.zeros((1, 1))],
-            gamma=[np.zeros((1, 1))],
-            nu=[np.zeros((1, 1))],
-            omega=[np.zeros((1, 1))],
+            image_rgba=[np.zeros((1, 1), dtype="uint32")],
             x=[0],
             y=[0],
             dw=[IMAGE_W],
@@ -488,22 +606,25 @@ def create():
     lin_color_mapper = LinearColorMapper(low=0, high=1)
     log_color_mapper = LogColorMapper(low=0, high=1)
     plot_image = plot.image(source=image_source, color_mapper=lin_color_mapper)
-    plot.image(source=image_source, image="h", global_alpha=0)
-    plot.image(source=image_source, image="k", global_alpha=0)
-    plot.image(source=image_source, image="l", global_alpha=0)
-    plot.image(source=image_source, image="gamma", global_alpha=0)
-    plot.image(source=image_source, image="nu", global_alpha=0)
-    plot.image(source=image_source, image="omega", global_alpha=0)
-
-    # calculate hkl-indices of first mouse entry
-    def mouse_enter_callback(_event):
-        if dataset and np.array_equal(image_source.data["h"][0], np.zeros((1, 1))):
-            scan = _get_selected_scan()
-            index = index_spinner.value
-            h, k, l = calculate_hkl(scan, index)
-            image_source.data.update(h=[h], k=[k], l=[l])
+    plot_image_rgba = plot.image_rgba(source=image_source, image="image_rgba", visible=False)
 
-    plot.on_event(MouseEnter, mouse_enter_callback)
+    # scalar parameters of the current frame, used to calculate hover values in the browser
+    det_geom_source = ColumnDataSource(
+        dict(
+            wave=[1],
+            ddist=[1],
+            gammad=[0],
+            om=[0],
+            chi=[0],
+            phi=[0],
+            nud=[0],
+            ub_inv=[np.eye(3).ravel()],
+            xnorm=[pyzebra.XNORM],
+            ynorm=[pyzebra.YNORM],
+            xpix=[pyzebra.XPIX],
+            ypix=[pyzebra.YPIX],
+        )
+    )
 
     # Single frame projection plots
     proj_v = figure(
@@ -536,16 +657,11 @@ def create():
     proj_h.line(source=proj_h_line_source, line_color="steelblue")
 
     # extra tools
+    det_geom_hover = CustomJSHover(args=dict(source=det_geom_source), code=det_geom_js_code)
     hovertool = HoverTool(
-        tooltips=[
-            ("intensity", "@image"),
-            ("gamma", "@gamma"),
-            ("nu", "@nu"),
-            ("omega", "@omega"),
-            ("h", "@h"),
-            ("k", "@k"),
-            ("l", "@l"),
-        ]
+        renderers=[plot_image],
+        tooltips=[("intensity", "@image"), *GEOM_TOOLTIPS],
+        formatters={"$x": det_geom_hover},
     )
 
     box_edit_source = ColumnDataSource(dict(x=[], y=[], width=[], height=[]))
@@ -555,13 +671,12 @@ def create():
     def box_edit_callback(_attr, _old, new):
         if new["x"]:
             scan = _get_selected_scan()
-            counts = scan["counts"]
-            x_val = np.arange(counts.shape[0])
+            x_val = np.arange(scan["counts"].shape[0])
             left = int(np.floor(new["x"][0]))
             right = int(np.ceil(new["x"][0] + new["width"][0]))
             bottom = int(np.floor(new["y"][0]))
             top = int(np.ceil(new["y"][0] + new["height"][0]))
-            y_val = np.sum(counts[:, bottom:top, left:right], axis=(1, 2))
+            y_val = pyzebra.get_roi_counts(scan, bottom, top, left, right)
         else:
             x_val = []
             y_val = []
@@ -605,6 +720,7 @@ def create():
     )
 
     proj_x_image = proj_x_plot.image(source=proj_x_image_source, color_mapper=lin_color_mapper_proj)
+    proj_x_plot.on_event(RangesUpdate, proj_ranges_update_callback)
 
     det_y_range = Range1d(0, IMAGE_H, bounds=(0, IMAGE_H))
     nu_range = Range1d(0, 1, bounds=(0, 1))
@@ -634,6 +750,7 @@ def create():
     )
 
     proj_y_image = proj_y_plot.image(source=proj_y_image_source, color_mapper=lin_color_mapper_proj)
+    proj_y_plot.on_event(RangesUpdate, proj_ranges_update_callback)
 
     # ROI slice plot
     roi_avg_plot = figure(height=150, width=IMAGE_PLOT_W, tools="", toolbar_location=None)
@@ -646,6 +763,8 @@ def create():
         log_color_mapper.palette = new
         lin_color_mapper_proj.palette = new
         log_color_mapper_proj.palette = new
+        if dataset and render_rgba_checkbox.active:
+            _update_image()
 
     colormap_select = Select(
         title="Colormap:",
@@ -673,10 +792,33 @@ def create():
                 proj_y_image.glyph.color_mapper = log_color_mapper_proj
             else:
                 colormap_scale_rg.active = 0
+                return
+
+        if dataset and render_rgba_checkbox.active:
+            _update_image()
 
     colormap_scale_rg = RadioGroup(labels=["Linear", "Logarithmic"], active=0, width=100)
     colormap_scale_rg.on_change("active", colormap_scale_rg_callback)
 
+    def render_rgba_checkbox_callback(_attr, _old, new):
+        if 0 in new:
+            plot_image.visible = False
+            plot_image_rgba.visible = True
+            hovertool.renderers = [plot_image_rgba]
+            # intensities are not sent to the browser in this mode
+            hovertool.tooltips = GEOM_TOOLTIPS
+        else:
+            plot_image.visible = True
+            plot_image_rgba.visible = False
+            hovertool.renderers = [plot_image]
+            hovertool.tooltips = [("intensity", "@image"), *GEOM_TOOLTIPS]
+
+        if dataset:
+            _update_image()
+
+    render_rgba_checkbox = CheckboxGroup(labels=["Render frames on server"], width=200)
+    render_rgba_checkbox.on_change("active", render_rgba_checkbox_callback)
+
     def main_auto_checkbox_callback(_attr, _old, new):
         if 0 in new:
             display_min_spinner.disabled = True
@@ -757,7 +899,9 @@ def create():
     )
     doc.events_data = events_data
 
-    events_table_source = ColumnDataSource(events_data)
+    # lists are copied, otherwise in-place changes of events_data are not detected as data updates
+    events_table_source = ColumnDataSource({key: list(value) for key, value in events_data.items()})
+    doc.events_table_source = events_table_source
     events_table = DataTable(
         source=events_table_source,
         columns=[
@@ -856,7 +1000,7 @@ def create():
         events_data["phi"].append(phi)
         events_data["nu"].append(nu)
 
-        events_table_source.data = events_data
+        events_table_source.data = {key: list(value) for key, value in events_data.items()}
 
     add_event_button = Button(label="Add peak center", width=145)
     add_event_button.on_click(add_event_button_callback)
@@ -867,7 +1011,7 @@ def create():
             for ind in reversed(ind2remove):
                 del value[ind]
 
-        events_table_source.data = events_data
+        events_table_source.data = {key: list(value) for key, value in events_data.items()}
 
     remove_event_button = Button(label="Remove peak center", width=145)
     remove_event_button.on_click(remove_event_button_callback)
@@ -900,6 +1044,7 @@ def create():
         upload_cami_button,
         upload_hdf_div,
         upload_hdf_button,
+        catalog_filter.textinput,
         file_select,
         row(file_open_button, file_append_button),
     )
@@ -907,6 +1052,7 @@ def create():
     layout_image = column(gridplot([[proj_v, None], [plot, proj_h]], merge_tools=False))
     colormap_layout = column(
         row(colormap_select, column(Spacer(height=15), colormap_scale_rg)),
+        render_rgba_checkbox,
         main_auto_checkbox,
         row(display_min_spinner, display_max_spinner),
         proj_auto_checkbox,
@@ -914,7 +1060,13 @@ def create():
     )
 
     layout_controls = column(
-        row(metadata_table, index_spinner, column(Spacer(height=25), index_slider)),
+        row(
+            metadata_table,
+            index_spinner,
+            column(Spacer(height=25), index_slider),
+            play_fps_spinner,
+            column(Spacer(height=19), play_toggle),
+        ),
         row(column(add_event_button, remove_event_button), peak_tables),
     )
 
@@ -939,6 +1091,64 @@ def create():
     return Panel(child=tab_layout, title="hdf viewer")
 
 
+def calculate_frame(scan, index):
+    """Prepare display data of a single detector frame.
+
+    Args:
+        scan (dict): An hdf scan.
+        index (int): Frame index within the scan.
+
+    Returns:
+        dict: Frame image and its projections, metadata and detector geometry.
+    """
+    image = scan["counts"][index]
+    counts_stats = pyzebra.get_counts_stats(scan)
+
+    wave = scan["wave"]
+    ddist = scan["ddist"]
+    gammad = scan["gamma"][index]
+    om = scan["omega"][index]
+    ch = scan["chi"][index]
+    ph = scan["phi"][index]
+    nud = scan["nu"]
+
+    # detector center angles
+    det_c_x = int(IMAGE_W / 2)
+    det_c_y = int(IMAGE_H / 2)
+    if scan["zebra_mode"] == "nb":
+        gamma_c, nu_c = pyzebra.det2pol(ddist, gammad, nud, det_c_x, det_c_y)
+        omega_c, chi_c, phi_c = om, ch, ph
+        # chi and phi are not used for hkl calculation in normal beam geometry
+        ch, ph = 0, 0
+
+    else:  # zebra_mode == "bi"
+        nu_c = 0
+        chi_c, phi_c, gamma_c, omega_c = pyzebra.ang_proc(
+            wave, ddist, gammad, om, ch, ph, nud, det_c_x, det_c_y
+        )
+
+    return dict(
+        image=image.astype("float32"),
+        proj_v=np.mean(image, axis=0),
+        proj_h=np.mean(image, axis=1),
+        im_min=counts_stats["min"][index],
+        im_max=counts_stats["max"][index],
+        mf=scan["mf"][index] if "mf" in scan else None,
+        temp=scan["temp"][index] if "temp" in scan else None,
+        det_geom=dict(
+            wave=[wave],
+            ddist=[ddist],
+            gammad=[gammad],
+            om=[om],
+            chi=[ch],
+            phi=[ph],
+            nud=[nud],
+            ub_inv=[np.linalg.inv(scan["ub"]).ravel()],
+        ),
+        det_center=dict(gamma=[gamma_c], nu=[nu_c], omega=[omega_c], chi=[chi_c], phi=[phi_c]),
+    )
+
+
 def calculate_hkl(scan, index):
     h = np.empty(shape=(IMAGE_H, IMAGE_W))
     k = np.empty(shape=(IMAGE_H, IMAGE_W))
@@ -974,3 +1184,41 @@ def calculate_pol(scan, index):
     gamma, nu = pyzebra.det2pol(ddist, gammad, nud, xi, yi)
 
     return gamma, nu
+
+
+@lru_cache(maxsize=None)
+def _palette_to_rgba(palette):
+    rgba = [[int(color[i : i + 2], 16) for i in (1, 3, 5)] + [255] for color in palette]
+    return np.array(rgba, dtype=np.uint8)
+
+
+def render_rgba(image, palette, low, high, log=False):
+    """Colormap an image on the server side.
+
+    Mapping follows bokeh LinearColorMapper and LogColorMapper, so that both rendering modes
+    produce identical images.
+
+    Args:
+        image (ndarray): A 2D array of intensities.
+        palette (tuple): A sequence of hex colors.
+        low, high (float): Intensities that are mapped to the first and the last palette colors.
+        log (bool): Use logarithmic scale (falls back to linear for non-positive limits).
+
+    Returns:
+        ndarray: A 2D array of uint32 values packing uint8 RGBA colors, as expected by image_rgba.
+    """
+    colors = _palette_to_rgba(palette)
+    n_colors = len(colors)
+
+    if high <= low:
+        key = np.where(image < high, 0, n_colors - 1)
+    else:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if log and low > 0:
+                scaled = (np.log(image) - np.log(low)) / (np.log(high) - np.log(low))
+            else:
+                scaled = (image - low) / (high - low)
+        # NaNs come from logarithm of non-positive values, which are below the low limit
+        key = np.clip(np.floor(np.nan_to_num(scaled, nan=0) * n_colors), 0, n_colors - 1)
+
+    return colors[key.astype(int)].view(np.uint32).reshape(image.shape)
@@ -1,6 +1,7 @@
 import base64
 import io
 import os
+import shutil
 
 import numpy as np
 from bokeh.layouts import column, row
@@ -23,12 +24,39 @@ from bokeh.models import (
     TextInput,
 )
 from bokeh.plotting import figure
-from scipy import interpolate
 
 import pyzebra
 from pyzebra import app
 from pyzebra.app.panel_hdf_viewer import calculate_hkl
 
+VOLUME_CACHE_PATH = os.path.join(pyzebra.RESULT_CACHE_PATH, "volumes")
+VOLUME_CACHE_MAX_ENTRIES = 5
+
+
+def _volume_key(fnames, fdata, scans, step):
+    # the key is based only on metadata, so that cached volumes are found without reading counts
+    parts = [step]
+    for fname, data, scan in zip(fnames, fdata, scans):
+        parts.extend((fname, len(data), scan["zebra_mode"], scan["monitor"]))
+        for var in ("omega", "gamma", "chi", "phi", "nu", "ddist", "wave", "ub"):
+            parts.append(np.asarray(scan[var]).tolist())
+
+    return pyzebra.ResultCache.make_key(*parts)
+
+
+def _evict_volumes():
+    entries = []
+    for entry in os.scandir(VOLUME_CACHE_PATH):
+        if entry.is_dir():
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+
+    entries.sort(reverse=True)
+    for _, entry_path in entries[VOLUME_CACHE_MAX_ENTRIES:]:
+        shutil.rmtree(entry_path, ignore_errors=True)
+
 
 def create():
     _update_slice = None
@@ -54,11 +82,15 @@ def create():
         # Load data files
         md_fnames = measured_data.filename
         md_fdata = measured_data.value
+        flag_volume = bool(volume_cb.active)
+        file_data = []
 
         for ind, (fname, fdata) in enumerate(zip(md_fnames, md_fdata)):
-            # Read data
+            # Read data, counts are not needed for volumes that are already cached
             try:
-                det_data = pyzebra.read_detector_data(io.BytesIO(base64.b64decode(fdata)))
+                det_data = pyzebra.read_detector_data(
+                    io.BytesIO(base64.b64decode(fdata)), metadata_only=flag_volume
+                )
             except:
                 print(f"Error loading {fname}")
                 return None
@@ -69,13 +101,17 @@ def create():
                 if not flag_lattice:
                     redef_lattice_ti.value = " ".join(map(str, det_data["cell"]))
 
-            num_slices = np.shape(det_data["counts"])[0]
-
             # Change parameter
             if flag_ub:
                 ub = list(map(float, redef_ub_ti.value.strip().split()))
                 det_data["ub"] = np.array(ub).reshape(3, 3)
 
+            if flag_volume:
+                file_data.append(det_data)
+                continue
+
+            num_slices = np.shape(det_data["counts"])[0]
+
             # Convert h k l for all images in file
             h_temp = np.empty(np.shape(det_data["counts"]))
             k_temp = np.empty(np.shape(det_data["counts"]))
@@ -95,6 +131,30 @@ def create():
                 l = np.append(l, l_temp, axis=0)
                 I_matrix = np.append(I_matrix, det_data["counts"], axis=0)
 
+        if flag_volume:
+            # Bin data into hkl volume once, and reuse it for the same files, UB and step
+            volume_step = volume_step_ni.value
+            key = _volume_key(md_fnames, md_fdata, file_data, volume_step)
+            volume_path = os.path.join(VOLUME_CACHE_PATH, key)
+
+            if os.path.isfile(os.path.join(volume_path, "grid.json")):
+                # mark the volume as recently used
+                os.utime(volume_path)
+                volume = pyzebra.load_volume(volume_path)
+            else:
+                for ind, fdata in enumerate(md_fdata):
+                    counts = pyzebra.read_detector_data(io.BytesIO(base64.b64decode(fdata)))[
+                        "counts"
+                    ]
+                    file_data[ind]["counts"] = counts
+
+                try:
+                    volume = pyzebra.reconstruct_volume(file_data, volume_path, volume_step)
+                except ValueError as e:
+                    print(e)
+                    return None
+                _evict_volumes()
+
         if flag_lattice:
             vals = list(map(float, redef_lattice_ti.value.strip().split()))
             lattice = np.array(vals)
@@ -167,10 +227,23 @@ def create():
         x_c = x_c / np.linalg.norm(x_c)
         o_c = o_c / np.linalg.norm(o_c)
 
-        # Convert all hkls to cartesian
-        hkl = [[h, k, l]]
-        hkl = np.transpose(hkl)
-        hkl_c = np.matmul(M, hkl)
+        if not flag_volume:
+            # Convert all hkls to cartesian
+            hkl = np.stack((h.ravel(), k.ravel(), l.ravel()))
+            hkl_c = M @ hkl
+
+            # Project points onto axes
+            x = x_c @ hkl_c
+            y = y_c @ hkl_c
+
+            # Sort points by their position along orthogonal direction, so that a cut is a
+            # contiguous range of points
+            o = o_c @ hkl_c
+            sort_ind = np.argsort(o)
+            o = o[sort_ind]
+            x = x[sort_ind]
+            y = y[sort_ind]
+            I_matrix = I_matrix.ravel()[sort_ind]
 
         # Prepare hkl/mhkl data
         hkl_coord = []
@@ -197,62 +270,85 @@ def create():
             # Width of cut
             delta = hkl_delta.value
 
-            # Calculate distance of all points to plane
-            Q = np.array(o_c) * orth_cut
-            N = o_c / np.sqrt(np.sum(o_c**2))
-            v = np.empty(np.shape(hkl_c))
-            v[:, :, :, :, 0] = hkl_c[:, :, :, :, 0] - Q
-            dist = np.abs(np.dot(N, v))
-            dist = np.squeeze(dist)
-            dist = np.transpose(dist)
-
-            # Find points within acceptable distance of plane defined by o_c
-            ind = np.where(abs(dist) < delta)
-            if ind[0].size == 0:
-                image_source.data.update(image=[np.zeros((1, 1))])
-                return
-
-            # Project points onto axes
-            x = np.dot(x_c / np.sqrt(np.sum(x_c**2)), hkl_c)
-            y = np.dot(y_c / np.sqrt(np.sum(y_c**2)), hkl_c)
-
-            # take care of dimensions
-            x = np.squeeze(x)
-            x = np.transpose(x)
-            y = np.squeeze(y)
-            y = np.transpose(y)
-
-            # Get slices:
-            x_slice = x[ind]
-            y_slice = y[ind]
-            I_slice = I_matrix[ind]
-
-            # Meshgrid limits for plotting
-            if auto_range_cb.active:
-                min_x = np.min(x_slice)
-                max_x = np.max(x_slice)
-                min_y = np.min(y_slice)
-                max_y = np.max(y_slice)
-                xrange_min_ni.value = min_x
-                xrange_max_ni.value = max_x
-                yrange_min_ni.value = min_y
-                yrange_max_ni.value = max_y
-            else:
-                min_x = xrange_min_ni.value
-                max_x = xrange_max_ni.value
-                min_y = yrange_min_ni.value
-                max_y = yrange_max_ni.value
-
             delta_x = xrange_step_ni.value
             delta_y = yrange_step_ni.value
 
-            # Create interpolated mesh grid for plotting
-            grid_x, grid_y = np.mgrid[min_x:max_x:delta_x, min_y:max_y:delta_y]
-            I = interpolate.griddata((x_slice, y_slice), I_slice, (grid_x, grid_y))
+            if flag_volume:
+                # Meshgrid limits for plotting
+                if auto_range_cb.active:
+                    extents = None
+                else:
+                    extents = (
+                        xrange_min_ni.value,
+                        xrange_max_ni.value,
+                        yrange_min_ni.value,
+                        yrange_max_ni.value,
+                    )
+
+                # Average voxels within acceptable distance of plane defined by o_c
+                I, (min_x, max_x, min_y, max_y) = pyzebra.slice_volume(
+                    volume,
+                    orth_dir,
+                    x_dir,
+                    orth_cut,
+                    delta,
+                    delta_x,
+                    delta_y,
+                    metric=M,
+                    in_plane_y=y_dir,
+                    extents=extents,
+                )
+                if np.all(np.isnan(I)):
+                    image_source.data.update(image=[np.zeros((1, 1))])
+                    return
+
+                if auto_range_cb.active:
+                    xrange_min_ni.value = min_x
+                    xrange_max_ni.value = max_x
+                    yrange_min_ni.value = min_y
+                    yrange_max_ni.value = max_y
+
+                I_max = np.nanmax(I)
+
+            else:
+                # Find points within acceptable distance of plane defined by o_c
+                ind_from = np.searchsorted(o, orth_cut - delta, side="right")
+                ind_to = np.searchsorted(o, orth_cut + delta, side="left")
+                if ind_from >= ind_to:
+                    image_source.data.update(image=[np.zeros((1, 1))])
+                    return
+
+                # Get slices:
+                x_slice = x[ind_from:ind_to]
+                y_slice = y[ind_from:ind_to]
+                I_slice = I_matrix[ind_from:ind_to]
+
+                # Meshgrid limits for plotting
+                if auto_range_cb.active:
+                    min_x = np.min(x_slice)
+                    max_x = np.max(x_slice)
+                    min_y = np.min(y_slice)
+                    max_y = np.max(y_slice)
+                    xrange_min_ni.value = min_x
+                    xrange_max_ni.value = max_x
+                    yrange_min_ni.value = min_y
+                    yrange_max_ni.value = max_y
+                else:
+                    min_x = xrange_min_ni.value
+                    max_x = xrange_max_ni.value
+                    min_y = yrange_min_ni.value
+                    max_y = yrange_max_ni.value
+
+                # Average intensities on mesh grid for plotting
+                I = pyzebra.bin_slice(
+                    x_slice, y_slice, I_slice, min_x, max_x, delta_x, min_y, max_y, delta_y
+                )
+
+                I_max = np.max(I_slice)
 
             # Update plot
             display_min_ni.value = 0
-            display_max_ni.value = np.max(I_slice) * 0.25
+            display_max_ni.value = I_max * 0.25
             image_source.data.update(
                 image=[I.T], x=[min_x], dw=[max_x - min_x], y=[min_y], dh=[max_y - min_y]
             )
@@ -282,7 +378,8 @@ def create():
     def plot_file_callback():
         nonlocal _update_slice
         _update_slice = _prepare_plotting()
-        _update_slice()
+        if _update_slice is not None:
+            _update_slice()
 
     plot_file = Button(label="Plot selected file(s)", button_type="primary", width=200)
     plot_file.on_click(plot_file_callback)
@@ -410,6 +507,9 @@ def create():
     auto_range_cb.on_change("active", auto_range_cb_callback)
     auto_range_cb.active = [0]
 
+    volume_cb = CheckboxGroup(labels=["Bin into hkl volume, step:"], width=200)
+    volume_step_ni = NumericInput(value=0.02, low=0.005, mode="float", width=70)
+
     column1_layout = column(
         row(
             column(row(measured_data_div, measured_data), row(upload_hkl_div, upload_hkl_fi)),
@@ -431,6 +531,7 @@ def create():
         ),
         row(column(Spacer(height=7), redef_lattice_cb), redef_lattice_ti),
         row(column(Spacer(height=7), redef_ub_cb), redef_ub_ti),
+        row(column(Spacer(height=7), volume_cb), volume_step_ni),
     )
     column2_layout = app.PlotHKL().layout
 
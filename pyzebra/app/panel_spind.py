@@ -1,3 +1,4 @@
+import io
 import os
 import subprocess
 import tempfile
@@ -18,6 +19,49 @@ from bokeh.models import (
 
 import pyzebra
 
+SPIND_HKL_CACHE_PATH = os.path.join(pyzebra.RESULT_CACHE_PATH, "spind_hkl")
+
+
+def _get_hkl_table(spind_path, lattice_const, max_res, mpi_ranks):
+    """Return a path to hkl table for the lattice, generating it only on the first request."""
+    gen_hkl_script = os.path.join(spind_path, "gen_hkl_table.py")
+    cache_key = pyzebra.ResultCache.make_key(
+        lattice_const, max_res, gen_hkl_script, os.path.getmtime(gen_hkl_script)
+    )
+    hkl_file = os.path.join(SPIND_HKL_CACHE_PATH, cache_key + ".h5")
+    if os.path.isfile(hkl_file):
+        print(f"Using cached hkl table for lattice constants {lattice_const}, max-res {max_res}")
+        return hkl_file
+
+    os.makedirs(SPIND_HKL_CACHE_PATH, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=SPIND_HKL_CACHE_PATH) as temp_dir:
+        temp_hkl_file = os.path.join(temp_dir, "hkl.h5")
+        comp_proc = subprocess.run(
+            [
+                "mpiexec",
+                "-n",
+                str(mpi_ranks),
+                "python",
+                gen_hkl_script,
+                lattice_const,
+                "--max-res",
+                str(max_res),
+                "-o",
+                temp_hkl_file,
+            ],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        print(" ".join(comp_proc.args))
+        print(comp_proc.stdout)
+
+        # other sessions should never see a partially written table
+        os.replace(temp_hkl_file, hkl_file)
+
+    return hkl_file
+
 
 def create():
     doc = curdoc()
@@ -31,7 +75,7 @@ def create():
     seed_angle_tol_spinner = Spinner(title="seed-angle-tol:", value=1, step=0.01, width=145)
     eval_hkl_tol_spinner = Spinner(title="eval-hkl-tol:", value=0.15, step=0.01, width=145)
 
-    diff_vec = []
+    diff_vec = np.empty((0, 3))
     ub_matrices = []
 
     def process_button_callback():
@@ -43,56 +87,27 @@ def create():
             temp_peak_list_dir = os.path.join(temp_dir, "peak_list")
             os.mkdir(temp_peak_list_dir)
             temp_event_file = os.path.join(temp_peak_list_dir, "event-0.txt")
-            temp_hkl_file = os.path.join(temp_dir, "hkl.h5")
-
-            comp_proc = subprocess.run(
-                [
-                    "mpiexec",
-                    "-n",
-                    "2",
-                    "python",
-                    os.path.join(doc.spind_path, "gen_hkl_table.py"),
-                    lattice_const_textinput.value,
-                    "--max-res",
-                    str(max_res_spinner.value),
-                    "-o",
-                    temp_hkl_file,
-                ],
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
+            hkl_file = _get_hkl_table(
+                doc.spind_path,
+                lattice_const_textinput.value,
+                max_res_spinner.value,
+                doc.spind_mpi_ranks,
             )
-            print(" ".join(comp_proc.args))
-            print(comp_proc.stdout)
 
             # prepare an event file
-            diff_vec = []
-            with open(temp_event_file, "w") as f:
-                npeaks = len(next(iter(doc.events_data.values())))
-                for ind in range(npeaks):
-                    wave = events_data["wave"][ind]
-                    ddist = events_data["ddist"][ind]
-                    x_pos = events_data["x_pos"][ind]
-                    y_pos = events_data["y_pos"][ind]
-                    intensity = events_data["intensity"][ind]
-                    snr_cnts = events_data["snr_cnts"][ind]
-                    gamma = events_data["gamma"][ind]
-                    omega = events_data["omega"][ind]
-                    chi = events_data["chi"][ind]
-                    phi = events_data["phi"][ind]
-                    nu = events_data["nu"][ind]
-
-                    ga, nu = pyzebra.det2pol(ddist, gamma, nu, x_pos, y_pos)
-                    diff_vector = pyzebra.z1frmd(wave, ga, omega, chi, phi, nu)
-                    d_spacing = float(pyzebra.dandth(wave, diff_vector)[0])
-                    diff_vector = diff_vector.flatten() * 1e10
-                    dv1, dv2, dv3 = diff_vector
-
-                    diff_vec.append(diff_vector)
-                    f.write(
-                        f"{x_pos} {y_pos} {intensity} {snr_cnts} {dv1} {dv2} {dv3} {d_spacing}\n"
-                    )
+            wave, ddist, x_pos, y_pos, gamma, omega, chi, phi, nu = (
+                np.asarray(events_data[key], dtype=float)
+                for key in ("wave", "ddist", "x_pos", "y_pos", "gamma", "omega", "chi", "phi", "nu")
+            )
+            ga, nu = pyzebra.det2pol(ddist, gamma, nu, x_pos, y_pos)
+            diff_vec = pyzebra.z1frmd_vec(wave, ga, omega, chi, phi, nu)
+            d_spacing, _ = pyzebra.dandth_vec(wave, diff_vec)
+            diff_vec = diff_vec * 1e10
+
+            intensity = events_data["intensity"]
+            snr_cnts = events_data["snr_cnts"]
+            event_table = np.column_stack((x_pos, y_pos, intensity, snr_cnts, diff_vec, d_spacing))
+            np.savetxt(temp_event_file, event_table, fmt="%.17g")
 
             print(f"Content of {temp_event_file}:")
             with open(temp_event_file) as f:
@@ -102,11 +117,11 @@ def create():
                 [
                     "mpiexec",
                     "-n",
-                    "2",
+                    str(doc.spind_mpi_ranks),
                     "python",
                     os.path.join(doc.spind_path, "SPIND.py"),
                     temp_peak_list_dir,
-                    temp_hkl_file,
+                    hkl_file,
                     "-o",
                     temp_dir,
                     "--seed-pool-size",
@@ -168,11 +183,11 @@ def create():
         if new:
             ind = new[0]
             ub_matrix_spind = ub_matrices[ind]
-            res = ""
-            for vec in diff_vec:
-                res += f"{np.linalg.inv(ub_matrix_spind) @ vec}\n"
+            hkl = diff_vec @ np.linalg.inv(ub_matrix_spind).T
+            with io.StringIO() as f:
+                np.savetxt(f, hkl, fmt="%8.3f")
+                hkl_textareainput.value = f.getvalue()
             ub_matrix_textareainput.value = str(ub_matrix_spind * 1e-10)
-            hkl_textareainput.value = res
         else:
             ub_matrix_textareainput.value = ""
             hkl_textareainput.value = ""
@@ -210,13 +225,14 @@ def create():
         column(results_table, row(ub_matrix_textareainput, hkl_textareainput)),
     )
 
-    async def update_npeaks_spinner():
+    def update_npeaks_spinner(_attr, _old, _new):
         npeaks = len(next(iter(doc.events_data.values())))
         npeaks_spinner.value = npeaks
         # TODO: check cell parameter for consistency?
         if npeaks:
             lattice_const_textinput.value = ",".join(map(str, doc.events_data["cell"][0]))
 
-    doc.add_periodic_callback(update_npeaks_spinner, 1000)
+    doc.events_table_source.on_change("data", update_npeaks_spinner)
+    update_npeaks_spinner(None, None, None)
 
     return Panel(child=tab_layout, title="spind")
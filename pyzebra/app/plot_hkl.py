@@ -28,6 +28,36 @@ from scipy.integrate import simpson, trapezoid
 import pyzebra
 
 
+def grid_lines(x_lim, y_lim, step, x_dir, y_dir, M, x_c, y_vert, x_length, y_length):
+    """Calculate lines of a regular hkl grid in the plotting plane.
+
+    Args:
+        x_lim, y_lim (tuple): (min, max) grid extents along x_dir and y_dir.
+        step (float): Grid step.
+        x_dir, y_dir (ndarray): In-plane directions in hkl.
+        M (ndarray): Matrix converting hkl to cartesian coordinates.
+        x_c, y_vert (ndarray): Horizontal and vertical plotting directions in cartesian coordinates.
+        x_length, y_length (float): Scaling factors of horizontal and vertical coordinates.
+
+    Returns:
+        tuple: Lists of [start, end] horizontal and vertical coordinates of lines.
+    """
+    yy = np.arange(*y_lim, step)[:, None]
+    xx = np.arange(*x_lim, step)[:, None]
+
+    # Calculate end and start points
+    hkl1 = np.concatenate((x_lim[0] * x_dir + yy * y_dir, xx * x_dir + y_lim[0] * y_dir))
+    hkl2 = np.concatenate((x_lim[1] * x_dir + yy * y_dir, xx * x_dir + y_lim[1] * y_dir))
+    hkl1 = hkl1 @ M.T
+    hkl2 = hkl2 @ M.T
+
+    # Project points onto axes
+    xs = np.stack((hkl1 @ x_c, hkl2 @ x_c), axis=1) * x_length
+    ys = np.stack((hkl1 @ y_vert, hkl2 @ y_vert), axis=1) * y_length
+
+    return xs.tolist(), ys.tolist()
+
+
 class PlotHKL:
     def __init__(self):
         _update_slice = None
@@ -57,16 +87,23 @@ class PlotHKL:
             md_fnames = measured_data.filename
             md_fdata = measured_data.value
 
-            # Load first data file, read angles and define matrices to perform conversion to cartesian
-            # coordinates and back
-            with io.StringIO(base64.b64decode(md_fdata[0]).decode()) as file:
-                _, ext = os.path.splitext(md_fnames[0])
-                try:
-                    file_data = pyzebra.parse_1D(file, ext)
-                except:
-                    print(f"Error loading {md_fnames[0]}")
-                    return None
+            # Read all data
+            files_data = []
+            for md_fname, md_fdatum in zip(md_fnames, md_fdata):
+                with io.StringIO(base64.b64decode(md_fdatum).decode()) as file:
+                    _, ext = os.path.splitext(md_fname)
+                    try:
+                        file_data = pyzebra.parse_1D(file, ext)
+                    except:
+                        print(f"Error loading {md_fname}")
+                        return None
 
+                pyzebra.normalize_dataset(file_data)
+                files_data.append(file_data)
+
+            # Use angles of the first data file to define matrices to perform conversion to
+            # cartesian coordinates and back
+            file_data = files_data[0]
             alpha = file_data[0]["alpha_cell"] * np.pi / 180.0
             beta = file_data[0]["beta_cell"] * np.pi / 180.0
             gamma = file_data[0]["gamma_cell"] * np.pi / 180.0
@@ -132,70 +169,71 @@ class PlotHKL:
             x_c = x_c / np.linalg.norm(x_c)
             o_c = o_c / np.linalg.norm(o_c)
 
-            # Read all data
-            hkl_coord = []
-            intensity_vec = []
-            k_flag_vec = []
-            file_flag_vec = []
-            res_vec = []
             res_N = 10
 
-            for j, md_fname in enumerate(md_fnames):
-                with io.StringIO(base64.b64decode(md_fdata[j]).decode()) as file:
-                    _, ext = os.path.splitext(md_fname)
-                    try:
-                        file_data = pyzebra.parse_1D(file, ext)
-                    except:
-                        print(f"Error loading {md_fname}")
-                        return None
-
-                pyzebra.normalize_dataset(file_data)
-
-                # Loop throguh all data
+            scan_params = []
+            intensity_vec = []
+            file_flag_vec = []
+            for j, file_data in enumerate(files_data):
                 for scan in file_data:
                     om = scan["omega"]
-                    gammad = scan["twotheta"]
-                    chi = scan["chi"]
-                    phi = scan["phi"]
-                    nud = 0  # 1d detector
-                    ub_inv = np.linalg.inv(scan["ub"])
                     counts = scan["counts"]
-                    wave = scan["wavelength"]
-
-                    # Calculate resolution in degrees
-                    expr = np.tan(gammad / 2 * np.pi / 180)
-                    fwhm = np.sqrt(0.4639 * expr**2 - 0.4452 * expr + 0.1506) * res_mult
-                    res = 4 * np.pi / wave * np.sin(fwhm * np.pi / 180)
-
-                    # Get first and final hkl
-                    hkl1 = pyzebra.ang2hkl_1d(wave, gammad, om[0], chi, phi, nud, ub_inv)
-                    hkl2 = pyzebra.ang2hkl_1d(wave, gammad, om[-1], chi, phi, nud, ub_inv)
+                    ub_inv = np.linalg.inv(scan["ub"])
 
-                    # Get hkl at best intensity
-                    hkl_m = pyzebra.ang2hkl_1d(
-                        wave, gammad, om[np.argmax(counts)], chi, phi, nud, ub_inv
+                    # Angles and ub_inv of scan start, end and the best intensity
+                    scan_params.append(
+                        (
+                            scan["wavelength"],
+                            scan["twotheta"],
+                            om[0],
+                            om[-1],
+                            om[np.argmax(counts)],
+                            scan["chi"],
+                            scan["phi"],
+                            ub_inv,
+                        )
                     )
 
                     # Estimate intensity for marker size scaling
                     y_bkg = [counts[0], counts[-1]]
                     x_bkg = [om[0], om[-1]]
-                    c = int(simpson(counts, x=om) - trapezoid(y_bkg, x=x_bkg))
-
-                    # Recognize k_flag_vec
-                    reduced_hkl_m = np.minimum(1 - hkl_m % 1, hkl_m % 1)
-                    for ind, _k in enumerate(k):
-                        if all(np.abs(reduced_hkl_m - _k) < tol_k):
-                            k_flag_vec.append(ind)
-                            break
-                    else:
-                        # not required
-                        continue
-
-                    # Save data
-                    hkl_coord.append([hkl1, hkl2, hkl_m])
-                    intensity_vec.append(c)
+                    intensity_vec.append(int(simpson(counts, x=om) - trapezoid(y_bkg, x=x_bkg)))
                     file_flag_vec.append(j)
-                    res_vec.append(res)
+
+            wave, gammad, om1, om2, om_m, chi, phi, ub_inv = map(np.array, zip(*scan_params))
+            intensity_vec = np.array(intensity_vec)
+            file_flag_vec = np.array(file_flag_vec)
+            nud = 0  # 1d detector
+
+            # Calculate resolution in degrees
+            expr = np.tan(gammad / 2 * np.pi / 180)
+            fwhm = np.sqrt(0.4639 * expr**2 - 0.4452 * expr + 0.1506) * res_mult
+            res_vec = 4 * np.pi / wave * np.sin(fwhm * np.pi / 180)
+
+            # Get first and final hkl, and hkl at best intensity
+            hkl1 = pyzebra.ang2hkl_1d_vec(wave, gammad, om1, chi, phi, nud, ub_inv)
+            hkl2 = pyzebra.ang2hkl_1d_vec(wave, gammad, om2, chi, phi, nud, ub_inv)
+            hkl_m = pyzebra.ang2hkl_1d_vec(wave, gammad, om_m, chi, phi, nud, ub_inv)
+
+            # Recognize k_flag_vec, the first matching k vector is used
+            reduced_hkl_m = np.minimum(1 - hkl_m % 1, hkl_m % 1)
+            k_match = np.all(np.abs(reduced_hkl_m[:, None, :] - k) < tol_k, axis=2)
+            k_flag_vec = np.argmax(k_match, axis=1)
+
+            # Save only required data
+            required = np.any(k_match, axis=1)
+            hkl1 = hkl1[required]
+            hkl2 = hkl2[required]
+            hkl_m = hkl_m[required]
+            k_flag_vec = k_flag_vec[required]
+            intensity_vec = intensity_vec[required]
+            file_flag_vec = file_flag_vec[required]
+            res_vec = res_vec[required]
+
+            # Convert to cartesian coordinates
+            hkl1_c = hkl1 @ M.T
+            hkl2_c = hkl2 @ M.T
+            hkl_m_c = hkl_m @ M.T
 
             x_spacing = np.dot(M @ x_dir, x_c) * x_length
             y_spacing = np.dot(M @ y_dir, y_vert) * y_length
@@ -215,77 +253,17 @@ class PlotHKL:
             )
 
             # Plot grid lines
-            xs, ys = [], []
-            xs_minor, ys_minor = [], []
-            for yy in np.arange(min_grid_y, max_grid_y, 1):
-                # Calculate end and start point
-                hkl1 = min_grid_x * x_dir + yy * y_dir
-                hkl2 = max_grid_x * x_dir + yy * y_dir
-                hkl1 = M @ hkl1
-                hkl2 = M @ hkl2
-
-                # Project points onto axes
-                x1 = np.dot(x_c, hkl1) * x_length
-                y1 = np.dot(y_vert, hkl1) * y_length
-                x2 = np.dot(x_c, hkl2) * x_length
-                y2 = np.dot(y_vert, hkl2) * y_length
-
-                xs.append([x1, x2])
-                ys.append([y1, y2])
-
-            for xx in np.arange(min_grid_x, max_grid_x, 1):
-                # Calculate end and start point
-                hkl1 = xx * x_dir + min_grid_y * y_dir
-                hkl2 = xx * x_dir + max_grid_y * y_dir
-                hkl1 = M @ hkl1
-                hkl2 = M @ hkl2
-
-                # Project points onto axes
-                x1 = np.dot(x_c, hkl1) * x_length
-                y1 = np.dot(y_vert, hkl1) * y_length
-                x2 = np.dot(x_c, hkl2) * x_length
-                y2 = np.dot(y_vert, hkl2) * y_length
-
-                xs.append([x1, x2])
-                ys.append([y1, y2])
-
-            for yy in np.arange(min_grid_y, max_grid_y, 0.5):
-                # Calculate end and start point
-                hkl1 = min_grid_x * x_dir + yy * y_dir
-                hkl2 = max_grid_x * x_dir + yy * y_dir
-                hkl1 = M @ hkl1
-                hkl2 = M @ hkl2
-
-                # Project points onto axes
-                x1 = np.dot(x_c, hkl1) * x_length
-                y1 = np.dot(y_vert, hkl1) * y_length
-                x2 = np.dot(x_c, hkl2) * x_length
-                y2 = np.dot(y_vert, hkl2) * y_length
-
-                xs_minor.append([x1, x2])
-                ys_minor.append([y1, y2])
-
-            for xx in np.arange(min_grid_x, max_grid_x, 0.5):
-                # Calculate end and start point
-                hkl1 = xx * x_dir + min_grid_y * y_dir
-                hkl2 = xx * x_dir + max_grid_y * y_dir
-                hkl1 = M @ hkl1
-                hkl2 = M @ hkl2
-
-                # Project points onto axes
-                x1 = np.dot(x_c, hkl1) * x_length
-                y1 = np.dot(y_vert, hkl1) * y_length
-                x2 = np.dot(x_c, hkl2) * x_length
-                y2 = np.dot(y_vert, hkl2) * y_length
-
-                xs_minor.append([x1, x2])
-                ys_minor.append([y1, y2])
+            grid_args = (x_dir, y_dir, M, x_c, y_vert, x_length, y_length)
+            xs, ys = grid_lines((min_grid_x, max_grid_x), (min_grid_y, max_grid_y), 1, *grid_args)
+            xs_minor, ys_minor = grid_lines(
+                (min_grid_x, max_grid_x), (min_grid_y, max_grid_y), 0.5, *grid_args
+            )
 
             grid_source.data.update(xs=xs, ys=ys)
             minor_grid_source.data.update(xs=xs_minor, ys=ys_minor)
 
             # Prepare hkl/mhkl data
-            hkl_coord2 = []
+            hkl_coord2 = [np.empty((0, 3))]
             for j, fname in enumerate(upload_hkl_fi.filename):
                 with io.StringIO(base64.b64decode(upload_hkl_fi.value[j]).decode()) as file:
                     _, ext = os.path.splitext(fname)
@@ -295,12 +273,10 @@ class PlotHKL:
                         print(f"Error loading {fname}")
                         return
 
-                for ind in range(len(fdata["counts"])):
-                    # Recognize k_flag_vec
-                    hkl = np.array([fdata["h"][ind], fdata["k"][ind], fdata["l"][ind]])
+                hkl_coord2.append(np.stack((fdata["h"], fdata["k"], fdata["l"]), axis=1))
 
-                    # Save data
-                    hkl_coord2.append(hkl)
+            hkl_coord2 = np.concatenate(hkl_coord2)
+            hkl_coord2_c = hkl_coord2 @ M.T
 
             def _update_slice():
                 cut_tol = hkl_delta.value
@@ -315,67 +291,60 @@ class PlotHKL:
                 # use resolution ellipsis
                 res_flag = disting_opt_rb.active
 
+                # Decide if points are in the cut
+                in_cut = np.abs(hkl_m_c @ o_c - cut_or) < cut_tol
+
+                # Project onto axes
+                hkl1x = hkl1_c[in_cut] @ x_c
+                hkl1y = hkl1_c[in_cut] @ y_vert
+                hkl2x = hkl2_c[in_cut] @ x_c
+                hkl2y = hkl2_c[in_cut] @ y_vert
+                hklmx = hkl_m_c[in_cut] @ x_c
+                hklmy = hkl_m_c[in_cut] @ y_vert
+                n_points = len(hklmx)
+
+                if intensity_flag and n_points:
+                    markersize = intensity_vec[in_cut] / np.max(intensity_vec) * 30
+                    markersize = np.maximum(6, markersize.astype(int))
+                else:
+                    markersize = np.full(n_points, 6)
+
+                if file_flag:
+                    plot_symbol = [syms[ind] for ind in file_flag_vec[in_cut]]
+                else:
+                    plot_symbol = ["circle"] * n_points
+
+                if prop_legend_flag:
+                    col_value = [cmap[ind] for ind in k_flag_vec[in_cut]]
+                else:
+                    col_value = ["black"] * n_points
+
                 el_x, el_y, el_w, el_h, el_c = [], [], [], [], []
                 scan_xs, scan_ys, scan_x, scan_y = [], [], [], []
                 scan_m, scan_s, scan_c, scan_l, scan_hkl = [], [], [], [], []
-                for j in range(len(hkl_coord)):
-                    # Get middle hkl from list
-                    hklm = M @ hkl_coord[j][2]
-
-                    # Decide if point is in the cut
-                    proj = np.dot(hklm, o_c)
-                    if abs(proj - cut_or) >= cut_tol:
-                        continue
-
-                    hkl1 = M @ hkl_coord[j][0]
-                    hkl2 = M @ hkl_coord[j][1]
-
-                    # Project onto axes
-                    hkl1x = np.dot(hkl1, x_c)
-                    hkl1y = np.dot(hkl1, y_vert)
-                    hkl2x = np.dot(hkl2, x_c)
-                    hkl2y = np.dot(hkl2, y_vert)
-                    hklmx = np.dot(hklm, x_c)
-                    hklmy = np.dot(hklm, y_vert)
-
-                    if intensity_flag:
-                        markersize = max(6, int(intensity_vec[j] / max(intensity_vec) * 30))
-                    else:
-                        markersize = 6
-
-                    if file_flag:
-                        plot_symbol = syms[file_flag_vec[j]]
-                    else:
-                        plot_symbol = "circle"
-
-                    if prop_legend_flag:
-                        col_value = cmap[k_flag_vec[j]]
-                    else:
-                        col_value = "black"
-
-                    if res_flag:
-                        # Generate series of circles along scan line
-                        res = res_vec[j]
-                        el_x.extend(np.linspace(hkl1x, hkl2x, num=res_N))
-                        el_y.extend(np.linspace(hkl1y, hkl2y, num=res_N))
-                        el_w.extend([res / 2] * res_N)
-                        el_h.extend([res / 2] * res_N)
-                        el_c.extend([col_value] * res_N)
-                    else:
-                        # Plot scan line
-                        scan_xs.append([hkl1x, hkl2x])
-                        scan_ys.append([hkl1y, hkl2y])
-
-                        # Plot middle point of scan
-                        scan_x.append(hklmx)
-                        scan_y.append(hklmy)
-                        scan_m.append(plot_symbol)
-                        scan_s.append(markersize)
-
-                        # Color and legend label
-                        scan_c.append(col_value)
-                        scan_l.append(md_fnames[file_flag_vec[j]])
-                        scan_hkl.append(hkl_coord[j][2])
+                if res_flag:
+                    # Generate series of circles along scan lines
+                    res = np.repeat(res_vec[in_cut], res_N)
+                    el_x = np.linspace(hkl1x, hkl2x, num=res_N, axis=1).ravel()
+                    el_y = np.linspace(hkl1y, hkl2y, num=res_N, axis=1).ravel()
+                    el_w = res / 2
+                    el_h = res / 2
+                    el_c = np.repeat(col_value, res_N).tolist()
+                else:
+                    # Plot scan lines
+                    scan_xs = np.stack((hkl1x, hkl2x), axis=1).tolist()
+                    scan_ys = np.stack((hkl1y, hkl2y), axis=1).tolist()
+
+                    # Plot middle points of scans
+                    scan_x = hklmx
+                    scan_y = hklmy
+                    scan_m = plot_symbol
+                    scan_s = markersize
+
+                    # Color and legend label
+                    scan_c = col_value
+                    scan_l = [md_fnames[ind] for ind in file_flag_vec[in_cut]]
+                    scan_hkl = list(hkl_m[in_cut])
 
                 ellipse_source.data.update(x=el_x, y=el_y, width=el_w, height=el_h, c=el_c)
                 scan_source.data.update(
@@ -411,23 +380,13 @@ class PlotHKL:
 
                 plot.legend.items = legend_items
 
-                scan_x2, scan_y2, scan_hkl2 = [], [], []
-                for j in range(len(hkl_coord2)):
-                    # Get middle hkl from list
-                    hklm = M @ hkl_coord2[j]
-
-                    # Decide if point is in the cut
-                    proj = np.dot(hklm, o_c)
-                    if abs(proj - cut_or) >= cut_tol:
-                        continue
-
-                    # Project onto axes
-                    hklmx = np.dot(hklm, x_c)
-                    hklmy = np.dot(hklm, y_vert)
+                # Decide if points are in the cut
+                in_cut = np.abs(hkl_coord2_c @ o_c - cut_or) < cut_tol
 
-                    scan_x2.append(hklmx)
-                    scan_y2.append(hklmy)
-                    scan_hkl2.append(hkl_coord2[j])
+                # Project onto axes
+                scan_x2 = hkl_coord2_c[in_cut] @ x_c
+                scan_y2 = hkl_coord2_c[in_cut] @ y_vert
+                scan_hkl2 = list(hkl_coord2[in_cut])
 
                 scatter_source2.data.update(x=scan_x2, y=scan_y2, hkl=scan_hkl2)
 
@@ -0,0 +1,225 @@
+import os
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+
+from pyzebra.ccl_io import parse_1D
+from pyzebra.h5 import read_detector_data
+
+CATALOG_EXTENSIONS = (".ccl", ".dat", ".hdf")
+
+CATALOG_NUM_FIELDS = (
+    "h",
+    "k",
+    "l",
+    "twotheta",
+    "gamma",
+    "omega",
+    "chi",
+    "phi",
+    "nu",
+    "temp",
+    "mf",
+    "n_points",
+)
+
+CATALOG_STR_FIELDS = ("zebra_mode", "scan_motor")
+
+CATALOG_FIELDS = CATALOG_NUM_FIELDS + CATALOG_STR_FIELDS
+
+
+def _scalar(value):
+    # angles, temperature and field can be recorded per scan point, keep their median values
+    if value is None or isinstance(value, str):
+        return value
+
+    value = np.asarray(value, dtype=float).ravel()
+    value = value[~np.isnan(value)]
+    if value.size == 0:
+        return None
+
+    return float(np.median(value))
+
+
+def _read_scans(filepath):
+    _, ext = os.path.splitext(filepath)
+    if ext == ".hdf":
+        scan = read_detector_data(filepath, metadata_only=True)
+        scan["n_points"] = len(scan["omega"])
+        scans = [scan]
+    else:
+        with open(filepath) as f:
+            scans = parse_1D(f, ext, header_only=True)
+
+    records = []
+    for scan in scans:
+        record = {"idx": scan.get("idx", 1)}
+        for field in CATALOG_FIELDS:
+            record[field] = _scalar(scan.get(field))
+        records.append(record)
+
+    return records
+
+
+class MetadataCatalog:
+    """SQLite catalog of scan metadata in proposal directories.
+
+    Files are indexed incrementally, only new and modified files are read, and only their headers
+    are parsed.
+
+    Args:
+        path (str): A database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        columns = ", ".join(
+            [f"{field} REAL" for field in CATALOG_NUM_FIELDS]
+            + [f"{field} TEXT" for field in CATALOG_STR_FIELDS]
+        )
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(path TEXT PRIMARY KEY, directory TEXT, name TEXT, mtime REAL, n_scans INTEGER)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS files_directory ON files (directory)")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS scans (path TEXT, idx INTEGER, {columns})")
+            conn.execute("CREATE INDEX IF NOT EXISTS scans_path ON scans (path)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def update(self, directory, files=None):
+        """Index new and modified files in a directory and drop records of removed files.
+
+        Args:
+            directory (str): A directory with data files.
+            files (list): File names in the directory, listed if not provided.
+
+        Returns:
+            int: Number of new, modified and removed files.
+        """
+        if files is None:
+            files = os.listdir(directory)
+        files = [file for file in files if file.endswith(CATALOG_EXTENSIONS)]
+
+        with closing(self._connect()) as conn:
+            known = dict(
+                conn.execute("SELECT name, mtime FROM files WHERE directory = ?", (directory,))
+            )
+
+            n_changed = 0
+            for file in files:
+                filepath = os.path.join(directory, file)
+                try:
+                    mtime = os.path.getmtime(filepath)
+                except OSError:
+                    continue
+
+                if known.get(file) == mtime:
+                    continue
+
+                try:
+                    records = _read_scans(filepath)
+                except Exception as e:
+                    # keep the file in the catalog, so that it is not read again until modified
+                    print(f"Error indexing {filepath}: {e}")
+                    records = []
+
+                columns = ("path", "idx", *CATALOG_FIELDS)
+                query = (
+                    f"INSERT INTO scans ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' * len(columns))})"
+                )
+                # commit every file separately, so that the catalog is usable while indexing
+                with conn:
+                    conn.execute("DELETE FROM scans WHERE path = ?", (filepath,))
+                    conn.executemany(
+                        query,
+                        [
+                            (filepath, record["idx"], *(record[f] for f in CATALOG_FIELDS))
+                            for record in records
+                        ],
+                    )
+                    conn.execute(
+                        "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                        (filepath, directory, file, mtime, len(records)),
+                    )
+                n_changed += 1
+
+            removed = known.keys() - set(files)
+            if removed:
+                with conn:
+                    for file in removed:
+                        filepath = os.path.join(directory, file)
+                        conn.execute("DELETE FROM scans WHERE path = ?", (filepath,))
+                        conn.execute("DELETE FROM files WHERE path = ?", (filepath,))
+                n_changed += len(removed)
+
+        return n_changed
+
+    def query(self, directory, conditions):
+        """Find files in a directory with at least one scan matching all conditions.
+
+        Args:
+            directory (str): A directory with data files.
+            conditions (dict): Field names and their values, or (min, max) tuples of numeric
+                fields.
+
+        Returns:
+            set: File names.
+        """
+        where = ["files.directory = ?"]
+        params = [directory]
+        for field, value in conditions.items():
+            if field not in CATALOG_FIELDS:
+                raise ValueError(f"Unknown catalog field '{field}'")
+
+            if isinstance(value, tuple):
+                where.append(f"scans.{field} BETWEEN ? AND ?")
+                params.extend(value)
+            else:
+                where.append(f"scans.{field} = ?")
+                params.append(value)
+
+        query = (
+            "SELECT DISTINCT files.name FROM scans JOIN files ON scans.path = files.path "
+            f"WHERE {' AND '.join(where)}"
+        )
+        with closing(self._connect()) as conn:
+            return {name for (name,) in conn.execute(query, params)}
+
+
+def parse_catalog_filter(text):
+    """Parse a filter string, e.g. "temp=1.4:1.6, h=2, zebra_mode=bi", into query conditions.
+
+    Numeric fields accept either a single value or a "min:max" range.
+    """
+    conditions = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+
+        try:
+            field, value = (part.strip() for part in item.split("="))
+        except ValueError:
+            raise ValueError(f"Can not parse filter condition '{item.strip()}'") from None
+
+        if field in CATALOG_STR_FIELDS:
+            conditions[field] = value
+        elif field in CATALOG_NUM_FIELDS:
+            try:
+                if ":" in value:
+                    v_min, v_max = value.split(":")
+                    conditions[field] = (float(v_min), float(v_max))
+                else:
+                    conditions[field] = float(value)
+            except ValueError:
+                raise ValueError(f"Can not parse value of '{field}' filter: '{value}'") from None
+        else:
+            raise ValueError(f"Unknown filter field '{field}', use one of {CATALOG_FIELDS}")
+
+    return conditions
@@ -110,7 +110,7 @@ def load_1D(filepath):
     return dataset
 
 
-def parse_1D(fileobj, data_type):
+def parse_1D(fileobj, data_type, header_only=False):
     metadata = {"data_type": data_type}
 
     # read metadata
@@ -209,11 +209,16 @@ def parse_1D(fileobj, data_type):
             )
 
             # subsequent lines with counts
-            counts = []
-            while len(counts) < scan["n_points"]:
-                counts.extend(map(float, next(fileobj).split()))
-            scan["counts"] = np.array(counts)
-            scan["counts_err"] = np.sqrt(np.maximum(scan["counts"], 1))
+            if header_only:
+                n_counts = 0
+                while n_counts < scan["n_points"]:
+                    n_counts += len(next(fileobj).split())
+            else:
+                counts = []
+                while len(counts) < scan["n_points"]:
+                    counts.extend(map(float, next(fileobj).split()))
+                scan["counts"] = np.array(counts)
+                scan["counts_err"] = np.sqrt(np.maximum(scan["counts"], 1))
 
             if scan["h"].is_integer() and scan["k"].is_integer() and scan["l"].is_integer():
                 scan["h"], scan["k"], scan["l"] = map(int, (scan["h"], scan["k"], scan["l"]))
@@ -5,6 +5,7 @@ from lmfit.models import GaussianModel, LinearModel, PseudoVoigtModel, VoigtMode
 from scipy.integrate import simpson, trapezoid
 
 from pyzebra import CCL_ANGLES
+from pyzebra.h5 import clear_counts_cache
 
 PARAM_PRECISIONS = {
     "twotheta": 0.1,
@@ -31,6 +32,7 @@ def normalize_dataset(dataset, monitor=100_000):
         scan["counts"] *= monitor_ratio
         scan["counts_err"] *= monitor_ratio
         scan["monitor"] = monitor
+        clear_counts_cache(scan)
 
 
 def merge_duplicates(dataset):
@@ -207,6 +209,7 @@ def merge_h5_scans(scan_into, scan_from):
     scan_into[scan_motor] = pos_tmp
     scan_into["counts"] = val_tmp / num_tmp[:, None, None]
     scan_into["counts_err"] = np.sqrt(err_tmp) / num_tmp[:, None, None]
+    clear_counts_cache(scan_into)
 
     scan_from["export"] = False
 
@@ -224,6 +227,7 @@ def restore_scan(scan):
         tmp = scan["init_scan"]
         scan.clear()
         scan.update(tmp)
+        clear_counts_cache(scan)
         # force scan export to True, otherwise in the sequence of incorrectly merged scans
         # a <- b <- c the scan b will be restored with scan["export"] = False if restoring executed
         # in the same order, i.e. restore a -> restore b
@@ -6,6 +6,10 @@ META_MATRIX = ("UB",)
 META_CELL = ("cell",)
 META_STR = ("name",)
 
+# quantities derived from scan["counts"], which are cached on the scan and have to be dropped
+# whenever counts change (normalization, merging, restoring)
+COUNTS_CACHE_KEYS = ("counts_sat", "counts_stats", "counts_proj_pyramid")
+
 
 def read_h5meta(filepath):
     """Open and parse content of a h5meta file.
@@ -59,26 +63,32 @@ def parse_h5meta(file):
     return content
 
 
-def read_detector_data(filepath, cami_meta=None):
+def read_detector_data(filepath, cami_meta=None, metadata_only=False):
     """Read detector data and angles from an h5 file.
 
     Args:
         filepath (str): File path of an h5 file.
+        metadata_only (bool): Skip reading detector counts.
 
     Returns:
         ndarray: A 3D array of data, omega, gamma, nu.
     """
     with h5py.File(filepath, "r") as h5f:
-        counts = h5f["/entry1/area_detector2/data"][:].astype(float)
-
-        n, cols, rows = counts.shape
-        if "/entry1/experiment_identifier" in h5f:  # old format
-            # reshape images (counts) to a correct shape (2006 issue)
-            counts = counts.reshape(n, rows, cols)
+        if metadata_only:
+            n = h5f["/entry1/area_detector2/data"].shape[0]
+            scan = {}
         else:
-            counts = counts.swapaxes(1, 2)
+            counts = h5f["/entry1/area_detector2/data"][:].astype(float)
+
+            n, cols, rows = counts.shape
+            if "/entry1/experiment_identifier" in h5f:  # old format
+                # reshape images (counts) to a correct shape (2006 issue)
+                counts = counts.reshape(n, rows, cols)
+            else:
+                counts = counts.swapaxes(1, 2)
+
+            scan = {"counts": counts, "counts_err": np.sqrt(np.maximum(counts, 1))}
 
-        scan = {"counts": counts, "counts_err": np.sqrt(np.maximum(counts, 1))}
         scan["original_filename"] = filepath
         scan["export"] = True
 
@@ -180,6 +190,107 @@ def read_detector_data(filepath, cami_meta=None):
     return scan
 
 
+def clear_counts_cache(scan):
+    """Drop all cached quantities derived from scan counts.
+
+    Args:
+        scan (dict): A scan, which counts were modified.
+    """
+    for key in COUNTS_CACHE_KEYS:
+        scan.pop(key, None)
+
+
+def get_roi_counts(scan, y_from, y_to, x_from, x_to):
+    """Calculate a sum of counts within a rectangular region of interest for every frame.
+
+    A summed-area table of counts is built on the first call and cached in the scan, so that any
+    subsequent ROI is evaluated in O(frames) time.
+
+    Args:
+        scan (dict): A scan with 3D counts array.
+        y_from, y_to, x_from, x_to (int): ROI boundaries in detector pixels (upper ones are
+            exclusive), which are clipped to the detector size.
+
+    Returns:
+        ndarray: A 1D array of ROI counts per frame.
+    """
+    if "counts_sat" not in scan:
+        counts = scan["counts"]
+        n, rows, cols = counts.shape
+        sat = np.zeros((n, rows + 1, cols + 1))
+        np.cumsum(counts, axis=1, out=sat[:, 1:, 1:])
+        np.cumsum(sat[:, 1:, 1:], axis=2, out=sat[:, 1:, 1:])
+        scan["counts_sat"] = sat
+
+    sat = scan["counts_sat"]
+    _, rows, cols = sat.shape
+    y_from = min(max(y_from, 0), rows - 1)
+    y_to = min(max(y_to, y_from), rows - 1)
+    x_from = min(max(x_from, 0), cols - 1)
+    x_to = min(max(x_to, x_from), cols - 1)
+
+    return sat[:, y_to, x_to] - sat[:, y_from, x_to] - sat[:, y_to, x_from] + sat[:, y_from, x_from]
+
+
+def get_counts_stats(scan):
+    """Get projections and per-frame statistics of scan counts.
+
+    The values are calculated on the first call and cached in the scan.
+
+    Args:
+        scan (dict): A scan with 3D counts array.
+
+    Returns:
+        dict: Projections on X and Y axes ("proj_x", "proj_y") and per-frame "sum", "min", "max",
+            "mean" of counts.
+    """
+    if "counts_stats" not in scan:
+        counts = scan["counts"]
+        _, rows, cols = counts.shape
+        frame_sum = np.sum(counts, axis=(1, 2))
+        scan["counts_stats"] = {
+            "proj_x": np.mean(counts, axis=1),
+            "proj_y": np.mean(counts, axis=2),
+            "sum": frame_sum,
+            "min": np.min(counts, axis=(1, 2)),
+            "max": np.max(counts, axis=(1, 2)),
+            "mean": frame_sum / (rows * cols),
+        }
+
+    return scan["counts_stats"]
+
+
+def get_proj_pyramid(scan):
+    """Get multi-resolution pyramids of scan projections on X and Y axes.
+
+    Level 0 holds full-resolution projections, and every next level averages pairs of frames of
+    the previous one, until a single frame is left. Pyramids are cached in the scan.
+
+    Args:
+        scan (dict): A scan with 3D counts array.
+
+    Returns:
+        dict: Lists of projections on X and Y axes ("proj_x", "proj_y"), one per level.
+    """
+    if "counts_proj_pyramid" not in scan:
+        counts_stats = get_counts_stats(scan)
+        pyramid = {}
+        for key in ("proj_x", "proj_y"):
+            levels = [counts_stats[key]]
+            while levels[-1].shape[0] > 1:
+                level = levels[-1]
+                n_bins = level.shape[0]
+                bin_starts = np.arange(0, n_bins, 2)
+                # the last bin of an odd number of frames contains only a single frame
+                bin_sizes = np.diff(bin_starts, append=n_bins)
+                levels.append(np.add.reduceat(level, bin_starts, axis=0) / bin_sizes[:, None])
+            pyramid[key] = levels
+
+        scan["counts_proj_pyramid"] = pyramid
+
+    return scan["counts_proj_pyramid"]
+
+
 def fit_event(scan, fr_from, fr_to, y_from, y_to, x_from, x_to):
     data_roi = scan["counts"][fr_from:fr_to, y_from:y_to, x_from:x_to]
 
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+RESULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), "pyzebra_cache")
+
+
+class ResultCache:
+    """Content-addressed cache of text output files produced by external programs.
+
+    Every entry is stored as a single json file named by a hash of the inputs. Entries are
+    evicted in least recently used order, once their number exceeds the limit.
+
+    Args:
+        path (str): A directory to store cache entries.
+        max_entries (int): Maximum number of entries to keep.
+    """
+
+    def __init__(self, path, max_entries=50):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        """Calculate a cache key from all inputs that define results of a run."""
+        key_hash = hashlib.sha256()
+        for part in parts:
+            key_hash.update(str(part).encode())
+            key_hash.update(b"\0")
+
+        return key_hash.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, key):
+        """Return cached output files and log for the key, or None if there is no such entry.
+
+        Returns:
+            tuple: A dict of file names and their contents, and the log of the run.
+        """
+        entry_path = self._entry_path(key)
+        with self._lock:
+            try:
+                with open(entry_path) as f:
+                    entry = json.load(f)
+                # mark the entry as recently used
+                os.utime(entry_path)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return None
+
+        return entry["files"], entry["log"]
+
+    def put(self, key, files, log=""):
+        """Store output files and log of a run.
+
+        Args:
+            key (str): A cache key of the run.
+            files (dict): File names and their contents.
+            log (str): Output of the run.
+        """
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            # write to a temporary file first, so that other processes never see partial entries
+            fd, temp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"files": files, "log": log}, f)
+            os.replace(temp_path, self._entry_path(key))
+
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".json"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+
+        entries.sort(reverse=True)
+        for _, entry_path in entries[self.max_entries :]:
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            if os.path.isdir(self.path):
+                for entry in os.scandir(self.path):
+                    if entry.name.endswith(".json"):
+                        os.remove(entry.path)
@@ -0,0 +1,262 @@
+import json
+import os
+
+import numpy as np
+from numba import njit
+from numpy.lib.format import open_memmap
+
+from pyzebra.xtal import ang2hkl_det
+
+# limit of the number of voxels in a reconstructed volume, 800 MB of signal and weight arrays
+MAX_VOLUME_VOXELS = 100_000_000
+
+
+@njit(cache=True)
+def _bin2d(x, y, values, weights, x_min, x_step, nx, y_min, y_step, ny):
+    signal = np.zeros((nx, ny))
+    weight = np.zeros((nx, ny))
+    for i in range(x.size):
+        # bins are centered at grid points
+        ix = int(np.floor((x[i] - x_min) / x_step + 0.5))
+        iy = int(np.floor((y[i] - y_min) / y_step + 0.5))
+        if 0 <= ix < nx and 0 <= iy < ny:
+            signal[ix, iy] += values[i]
+            weight[ix, iy] += weights[i]
+
+    return signal, weight
+
+
+def _grid_size(v_min, v_max, v_step):
+    """Number of grid points in [v_min, v_max) with v_step spacing, the same as for np.mgrid."""
+    return max(int(np.ceil((v_max - v_min) / v_step)), 1)
+
+
+def bin_slice(x, y, values, x_min, x_max, x_step, y_min, y_max, y_step, weights=None):
+    """Average values of scattered points on a regular 2D grid.
+
+    Every point contributes to the bin of the nearest grid point, and bins are normalized by
+    the total weight of contributing points.
+
+    Args:
+        x, y (ndarray): Coordinates of points.
+        values (ndarray): Values of points.
+        x_min, x_max, x_step (float): Grid along x, as in np.mgrid[x_min:x_max:x_step].
+        y_min, y_max, y_step (float): Grid along y, as in np.mgrid[y_min:y_max:y_step].
+        weights (ndarray): Weights of points, 1 for every point by default.
+
+    Returns:
+        ndarray: A 2D array of (x, y) shape with mean values, NaN in bins without points.
+    """
+    if weights is None:
+        weights = np.ones_like(values, dtype=np.float64)
+
+    nx = _grid_size(x_min, x_max, x_step)
+    ny = _grid_size(y_min, y_max, y_step)
+    signal, weight = _bin2d(
+        np.ascontiguousarray(x, dtype=np.float64),
+        np.ascontiguousarray(y, dtype=np.float64),
+        np.ascontiguousarray(values, dtype=np.float64),
+        np.ascontiguousarray(weights, dtype=np.float64),
+        x_min,
+        x_step,
+        nx,
+        y_min,
+        y_step,
+        ny,
+    )
+
+    with np.errstate(invalid="ignore"):
+        return signal / weight
+
+
+@njit(cache=True)
+def _bin3d(h, k, l, values, origin, step, signal, weight):
+    nh, nk, nl = signal.shape
+    for i in range(h.size):
+        ih = int(np.floor((h[i] - origin[0]) / step + 0.5))
+        ik = int(np.floor((k[i] - origin[1]) / step + 0.5))
+        il = int(np.floor((l[i] - origin[2]) / step + 0.5))
+        if 0 <= ih < nh and 0 <= ik < nk and 0 <= il < nl:
+            signal[ih, ik, il] += values[i]
+            weight[ih, ik, il] += 1
+
+
+def _frame_hkl(scan, index, ub_inv):
+    if scan["zebra_mode"] == "nb":
+        # chi and phi are not used for hkl calculation in normal beam geometry
+        chi, phi = 0, 0
+    else:  # zebra_mode == "bi"
+        chi, phi = scan["chi"][index], scan["phi"][index]
+
+    return ang2hkl_det(
+        scan["wave"],
+        scan["ddist"],
+        scan["gamma"][index],
+        scan["omega"][index],
+        chi,
+        phi,
+        scan["nu"],
+        ub_inv,
+    )
+
+
+def reconstruct_volume(scans, path, step=0.02, max_voxels=MAX_VOLUME_VOXELS):
+    """Bin counts of hdf scans into a regular hkl volume.
+
+    The volume is stored in a directory with memory-mapped "signal" (sum of counts) and "weight"
+    (number of detector pixels) arrays, so that it can be sliced many times without reading and
+    transforming raw data again.
+
+    Args:
+        scans (list): Hdf scans with 3D counts arrays.
+        path (str): A directory to store the volume.
+        step (float): Voxel size in rlu.
+        max_voxels (int): Maximum number of voxels in the volume.
+
+    Returns:
+        dict: The volume, as returned by load_volume.
+    """
+    if step is None or step <= 0:
+        raise ValueError(f"Voxel size must be positive, got {step}")
+
+    ub_invs = [np.linalg.inv(scan["ub"]) for scan in scans]
+
+    # first pass to find extents of the volume
+    hkl_min = np.full(3, np.inf)
+    hkl_max = np.full(3, -np.inf)
+    for scan, ub_inv in zip(scans, ub_invs):
+        for index in range(scan["counts"].shape[0]):
+            hkl = _frame_hkl(scan, index, ub_inv).reshape(3, -1)
+            hkl_min = np.minimum(hkl_min, hkl.min(axis=1))
+            hkl_max = np.maximum(hkl_max, hkl.max(axis=1))
+
+    origin = np.floor(hkl_min / step) * step
+    shape = tuple(np.floor((hkl_max - origin) / step + 0.5).astype(int) + 1)
+    if np.prod(shape, dtype=np.float64) > max_voxels:
+        raise ValueError(
+            f"Volume of {shape} voxels exceeds the limit of {max_voxels}, increase the voxel size"
+        )
+
+    os.makedirs(path, exist_ok=True)
+    signal = open_memmap(os.path.join(path, "signal.npy"), mode="w+", dtype=np.float32, shape=shape)
+    weight = open_memmap(os.path.join(path, "weight.npy"), mode="w+", dtype=np.float32, shape=shape)
+
+    for scan, ub_inv in zip(scans, ub_invs):
+        counts = scan["counts"]
+        for index in range(counts.shape[0]):
+            h, k, l = _frame_hkl(scan, index, ub_inv).reshape(3, -1)
+            values = np.ascontiguousarray(counts[index], dtype=np.float64).ravel()
+            _bin3d(h, k, l, values, origin, step, np.asarray(signal), np.asarray(weight))
+
+    signal.flush()
+    weight.flush()
+    del signal, weight
+
+    with open(os.path.join(path, "grid.json"), "w") as f:
+        json.dump({"origin": origin.tolist(), "step": step}, f)
+
+    return load_volume(path)
+
+
+def load_volume(path):
+    """Open an hkl volume created by reconstruct_volume.
+
+    Args:
+        path (str): A directory with the volume.
+
+    Returns:
+        dict: Memory-mapped "signal" and "weight" arrays, hkl of the first voxel ("origin") and
+            voxel size ("step").
+    """
+    with open(os.path.join(path, "grid.json")) as f:
+        grid = json.load(f)
+
+    return {
+        "signal": np.load(os.path.join(path, "signal.npy"), mmap_mode="r"),
+        "weight": np.load(os.path.join(path, "weight.npy"), mmap_mode="r"),
+        "origin": np.array(grid["origin"]),
+        "step": grid["step"],
+    }
+
+
+def volume_points(volume):
+    """Get hkl, signal and weight of all non-empty voxels of an hkl volume.
+
+    The values are calculated on the first call and cached in the volume.
+
+    Args:
+        volume (dict): An hkl volume.
+
+    Returns:
+        tuple: A (3, N) array of voxel centers in hkl, and arrays of their signal and weight.
+    """
+    if "points" not in volume:
+        weight = np.asarray(volume["weight"])
+        ind = np.nonzero(weight)
+        hkl = volume["origin"][:, None] + volume["step"] * np.array(ind)
+        volume["points"] = (hkl, np.asarray(volume["signal"])[ind], weight[ind])
+
+    return volume["points"]
+
+
+def slice_volume(
+    volume,
+    normal,
+    in_plane_x,
+    cut,
+    delta,
+    x_step,
+    y_step,
+    metric=None,
+    in_plane_y=None,
+    extents=None,
+):
+    """Extract an arbitrary plane from an hkl volume.
+
+    Args:
+        volume (dict): An hkl volume.
+        normal (array_like): Direction orthogonal to the plane in hkl.
+        in_plane_x (array_like): Horizontal direction of the plane in hkl, its component along
+            the normal is ignored.
+        cut (float): Position of the plane along the normal, in units of the metric.
+        delta (float): Maximum distance of voxels from the plane.
+        x_step, y_step (float): Mesh steps of the resulting image.
+        metric (ndarray): Matrix converting hkl to cartesian coordinates, identity by default.
+        in_plane_y (array_like): Vertical direction of the plane in hkl. If provided, image
+            coordinates are plain projections on both in-plane directions, without
+            orthogonalization. By default, it is orthogonal to the normal and in_plane_x.
+        extents (tuple): (x_min, x_max, y_min, y_max) extents of the image, extents of the
+            points in the plane by default.
+
+    Returns:
+        tuple: A 2D array of (x, y) shape with mean values (NaN in empty bins) and a tuple of its
+            (x_min, x_max, y_min, y_max) extents.
+    """
+    if metric is None:
+        metric = np.eye(3)
+
+    o_c = metric @ np.asarray(normal, dtype=float)
+    o_c /= np.linalg.norm(o_c)
+    x_c = metric @ np.asarray(in_plane_x, dtype=float)
+    if in_plane_y is None:
+        x_c -= np.dot(x_c, o_c) * o_c
+        x_c /= np.linalg.norm(x_c)
+        y_c = np.cross(o_c, x_c)
+    else:
+        x_c /= np.linalg.norm(x_c)
+        y_c = metric @ np.asarray(in_plane_y, dtype=float)
+        y_c /= np.linalg.norm(y_c)
+
+    # project hkl directly, so that only voxels in the plane are converted to the image axes
+    hkl, signal, weight = volume_points(volume)
+    ind = np.abs((o_c @ metric) @ hkl - cut) < delta
+    x = (x_c @ metric) @ hkl[:, ind]
+    y = (y_c @ metric) @ hkl[:, ind]
+    if x.size == 0:
+        return np.full((1, 1), np.nan), extents or (0, 0, 0, 0)
+
+    if extents is None:
+        extents = (np.min(x), np.max(x), np.min(y), np.max(y))
+    image = bin_slice(x, y, signal[ind], *extents[:2], x_step, *extents[2:], y_step, weight[ind])
+
+    return image, extents
@@ -1,10 +1,10 @@
 import io
-import os
-import subprocess
-import tempfile
-from math import ceil, floor
+import time
 
 import numpy as np
+from numba import njit
+
+from pyzebra.xtal import angs4c_vec, angsnb_vec
 
 SXTAL_REFGEN_PATH = "/afs/psi.ch/project/sinq/rhel7/bin/Sxtal_Refgen"
 
@@ -144,36 +144,92 @@ def export_geom_file(path, ang_lims, template=None):
                     out_file.write(f"{'':<8}{ang:<10}{vals[0]:<10}{vals[1]:<10}{vals[2]:<10}\n")
 
 
-def calc_ub_matrix(params):
-    with tempfile.TemporaryDirectory() as temp_dir:
-        cfl_file = os.path.join(temp_dir, "ub_matrix.cfl")
+def calc_b_matrix(cell):
+    """Calculate the Busing-Levy B matrix of a crystal lattice.
+
+    Args:
+        cell (str): Lattice parameters "a b c alpha beta gamma" in angstrom and degrees.
+
+    Returns:
+        ndarray: B matrix, converting hkl to cartesian coordinates in reciprocal angstrom.
+    """
+    a, b, c, alpha, beta, gamma = map(float, cell.split()[:6])
+    alpha, beta, gamma = np.deg2rad([alpha, beta, gamma])
+
+    volume = (
+        a
+        * b
+        * c
+        * np.sqrt(
+            1
+            - np.cos(alpha) ** 2
+            - np.cos(beta) ** 2
+            - np.cos(gamma) ** 2
+            + 2 * np.cos(alpha) * np.cos(beta) * np.cos(gamma)
+        )
+    )
 
-        with open(cfl_file, "w") as fileobj:
-            for key, value in params.items():
-                fileobj.write(f"{key} {value}\n")
+    # reciprocal lattice parameters
+    a_r = b * c * np.sin(alpha) / volume
+    b_r = a * c * np.sin(beta) / volume
+    c_r = a * b * np.sin(gamma) / volume
+    cos_beta_r = (np.cos(alpha) * np.cos(gamma) - np.cos(beta)) / (np.sin(alpha) * np.sin(gamma))
+    cos_gamma_r = (np.cos(alpha) * np.cos(beta) - np.cos(gamma)) / (np.sin(alpha) * np.sin(beta))
+    sin_beta_r = np.sqrt(1 - cos_beta_r**2)
+    sin_gamma_r = np.sqrt(1 - cos_gamma_r**2)
 
-        comp_proc = subprocess.run(
-            [SXTAL_REFGEN_PATH, cfl_file],
-            cwd=temp_dir,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-        )
-        print(" ".join(comp_proc.args))
-        print(comp_proc.stdout)
+    return np.array(
+        [
+            [a_r, b_r * cos_gamma_r, c_r * cos_beta_r],
+            [0, b_r * sin_gamma_r, -c_r * sin_beta_r * np.cos(alpha)],
+            [0, 0, 1 / c],
+        ]
+    )
 
-        sfa_file = os.path.join(temp_dir, "ub_matrix.sfa")
-        ub_matrix = []
-        with open(sfa_file, "r") as fileobj:
-            for line in fileobj:
-                if "BL_M" in line:  # next 3 lines contain the matrix
-                    for _ in range(3):
-                        next_line = next(fileobj)
-                        *vals, _ = next_line.split(maxsplit=3)
-                        ub_matrix.extend(vals)
 
-    return ub_matrix
+def calc_u_matrix(b_matrix, hkl1, hkl2, z1_1, z1_2):
+    """Calculate the orientation matrix U from two non-collinear reflections (Busing-Levy).
+
+    Args:
+        b_matrix (ndarray): B matrix of the crystal lattice.
+        hkl1, hkl2 (array_like): Miller indices of the orientation reflections.
+        z1_1, z1_2 (array_like): Diffraction vectors of the reflections in the phi axis frame,
+            e.g. as returned by z1frmd.
+
+    Returns:
+        ndarray: U matrix.
+    """
+
+    def triad(v1, v2):
+        t1 = v1 / np.linalg.norm(v1)
+        t3 = np.cross(v1, v2)
+        t3 /= np.linalg.norm(t3)
+        return np.stack((t1, np.cross(t3, t1), t3), axis=1)
+
+    t_c = triad(b_matrix @ np.asarray(hkl1, dtype=float), b_matrix @ np.asarray(hkl2, dtype=float))
+    t_phi = triad(np.asarray(z1_1, dtype=float), np.asarray(z1_2, dtype=float))
+
+    return t_phi @ t_c.T
+
+
+def calc_ub_matrix(params, orient_refl=None):
+    """Calculate UB matrix from lattice parameters and orientation reflections.
+
+    Args:
+        params (dict): Parameters with a "CELL" entry as in read_cfl_file.
+        orient_refl (tuple): Two orientation reflections as (hkl, z1) pairs. If not provided, U is
+            an identity matrix, as in Sxtal_Refgen output.
+
+    Returns:
+        list: UB matrix elements as strings, in a row-major order.
+    """
+    ub = calc_b_matrix(params["CELL"])
+    if orient_refl is not None:
+        (hkl1, z1_1), (hkl2, z1_2) = orient_refl
+        ub = calc_u_matrix(ub, hkl1, hkl2, z1_1, z1_2) @ ub
+
+    # adding 0 converts negative zeros after rounding
+    return [f"{val:.8f}" for val in np.round(ub, 8).ravel() + 0]
 
 
 def read_cfl_file(fileobj):
@@ -308,176 +364,405 @@ def export_cfl_file(path, params, template=None):
                 out_file.write(f"ATOM {atom_line}\n")
 
 
-def sort_hkl_file_bi(file_in, file_out, priority, chunks):
-    with open(file_in) as fileobj:
-        file_in_data = fileobj.readlines()
-
-    data = np.genfromtxt(file_in, skip_header=3)
-    stt = data[:, 4]
-    omega = data[:, 5]
-    chi = data[:, 6]
-    phi = data[:, 7]
-
-    lines = file_in_data[3:]
-    lines_update = []
-
-    angles = {"2theta": stt, "omega": omega, "chi": chi, "phi": phi}
-
-    # Reverse flag
-    to_reverse = False
-    to_reverse_p2 = False
-    to_reverse_p3 = False
-
-    # Get indices within first priority
-    ang_p1 = angles[priority[0]]
-    begin_p1 = floor(min(ang_p1))
-    end_p1 = ceil(max(ang_p1))
-    delta_p1 = chunks[0]
-    for p1 in range(begin_p1, end_p1, delta_p1):
-        ind_p1 = [j for j, x in enumerate(ang_p1) if p1 <= x and x < p1 + delta_p1]
-
-        stt_new = [stt[x] for x in ind_p1]
-        omega_new = [omega[x] for x in ind_p1]
-        chi_new = [chi[x] for x in ind_p1]
-        phi_new = [phi[x] for x in ind_p1]
-        lines_new = [lines[x] for x in ind_p1]
-
-        angles_p2 = {"stt": stt_new, "omega": omega_new, "chi": chi_new, "phi": phi_new}
-
-        # Get indices for second priority
-        ang_p2 = angles_p2[priority[1]]
-        if len(ang_p2) > 0 and to_reverse_p2:
-            begin_p2 = ceil(max(ang_p2))
-            end_p2 = floor(min(ang_p2))
-            delta_p2 = -chunks[1]
-        elif len(ang_p2) > 0 and not to_reverse_p2:
-            end_p2 = ceil(max(ang_p2))
-            begin_p2 = floor(min(ang_p2))
-            delta_p2 = chunks[1]
+# reflection conditions of centered lattices
+_LATTICE_CONDITIONS = {
+    "P": lambda h, k, l: np.ones_like(h, dtype=bool),
+    "A": lambda h, k, l: (k + l) % 2 == 0,
+    "B": lambda h, k, l: (h + l) % 2 == 0,
+    "C": lambda h, k, l: (h + k) % 2 == 0,
+    "I": lambda h, k, l: (h + k + l) % 2 == 0,
+    "F": lambda h, k, l: ((h + k) % 2 == 0) & ((k + l) % 2 == 0),
+    "R": lambda h, k, l: (-h + k + l) % 3 == 0,
+}
+
+GEOM_ANGLES = {"bi": ("2theta", "omega", "chi", "phi"), "nb": ("gamma", "omega", "nu")}
+
+
+def generate_hkl_list(params, ang_lims, kvect=None):
+    """Generate a list of reflections accessible with the instrument.
+
+    This is an in-process alternative to Sxtal_Refgen. Reflections within HLIM and SRANG
+    (sin(theta)/lambda) are filtered by the lattice centering of the space group (other
+    systematic absences and structure factors are not calculated), and by angular limits.
+
+    Args:
+        params (dict): Parameters as returned by read_cfl_file.
+        ang_lims (dict): Angular limits as returned by read_geom_file.
+        kvect (str): Propagation vector, satellites hkl+k and hkl-k are generated if provided.
+
+    Returns:
+        dict: Arrays of "h", "k", "l" and instrument angles of reflections.
+    """
+    h_min, h_max, k_min, k_max, l_min, l_max = map(int, params["HLIM"].split())
+    h, k, l = np.mgrid[h_min : h_max + 1, k_min : k_max + 1, l_min : l_max + 1].reshape(3, -1)
+
+    # the lattice centering is the first letter of the space group or of the magnetic lattice
+    symbol = (params["SPGR"] if kvect is None else params["lattiCE"]) or ""
+    lattice = symbol.strip()[:1].upper()
+    if lattice not in _LATTICE_CONDITIONS:
+        field = "space group" if kvect is None else "magnetic lattice"
+        raise ValueError(f"Can not determine lattice centering from {field} '{symbol.strip()}'")
+    hkl = np.stack((h, k, l), axis=1)[_LATTICE_CONDITIONS[lattice](h, k, l)]
+
+    if kvect is not None:
+        kvect = np.array(kvect.split(), dtype=float)
+        if np.any(kvect):
+            hkl = np.unique(np.concatenate((hkl + kvect, hkl - kvect)), axis=0)
         else:
-            end_p2 = 0
-            begin_p2 = 0
-            delta_p2 = 1
-
-        to_reverse_p2 = not to_reverse_p2
-
-        for p2 in range(begin_p2, end_p2, delta_p2):
-            min_p2 = min([p2, p2 + delta_p2])
-            max_p2 = max([p2, p2 + delta_p2])
-            ind_p2 = [j for j, x in enumerate(ang_p2) if min_p2 <= x and x < max_p2]
-
-            stt_new2 = [stt_new[x] for x in ind_p2]
-            omega_new2 = [omega_new[x] for x in ind_p2]
-            chi_new2 = [chi_new[x] for x in ind_p2]
-            phi_new2 = [phi_new[x] for x in ind_p2]
-            lines_new2 = [lines_new[x] for x in ind_p2]
-
-            angles_p3 = {"stt": stt_new2, "omega": omega_new2, "chi": chi_new2, "phi": phi_new2}
-
-            # Get indices for third priority
-            ang_p3 = angles_p3[priority[2]]
-            if len(ang_p3) > 0 and to_reverse_p3:
-                begin_p3 = ceil(max(ang_p3)) + chunks[2]
-                end_p3 = floor(min(ang_p3)) - chunks[2]
-                delta_p3 = -chunks[2]
-            elif len(ang_p3) > 0 and not to_reverse_p3:
-                end_p3 = ceil(max(ang_p3)) + chunks[2]
-                begin_p3 = floor(min(ang_p3)) - chunks[2]
-                delta_p3 = chunks[2]
-            else:
-                end_p3 = 0
-                begin_p3 = 0
-                delta_p3 = 1
+            hkl = hkl.astype(float)
+
+    ub = np.array(params["UBMAT"], dtype=float).reshape(3, 3)
+    wave = float(params["WAVE"])
+    z1 = hkl @ ub.T
+
+    s_min, s_max = map(float, params["SRANG"].split())
+    stl = np.linalg.norm(z1, axis=1) / 2
+    mask = (s_min <= stl) & (stl <= s_max)
+
+    geom = ang_lims["geom"]
+    if geom == "bi":
+        angles = angs4c_vec(wave, z1)
+    else:  # geom == "nb"
+        angles = angsnb_vec(wave, z1)
+
+    res = {"h": hkl[:, 0], "k": hkl[:, 1], "l": hkl[:, 2]}
+    for name, ang in zip(GEOM_ANGLES[geom], angles):
+        lim_name = "gamma" if name == "2theta" else name
+        ang_min, ang_max, _ = map(float, ang_lims[lim_name])
+        if name == "phi":
+            # phi is periodic, so bring it to the allowed range if possible
+            ang = ang_min + (ang - ang_min) % 360
+
+        mask &= (ang_min <= ang) & (ang <= ang_max)
+        res[name] = ang
+
+    return {key: val[mask] for key, val in res.items()}
+
+
+def export_hkl_file(path, hkl_list, geom, title="pyzebra"):
+    """Write a list of reflections in .hkl/.mhkl format of Sxtal_Refgen.
+
+    Args:
+        path (str): Output file path, the extension defines the format of hkl indices.
+        hkl_list (dict): Reflections as returned by generate_hkl_list.
+        geom (str): Geometry of the instrument, "bi" or "nb".
+        title (str): The first line of the file.
+    """
+    ang_names = GEOM_ANGLES[geom]
+    hkl = np.stack((hkl_list["h"], hkl_list["k"], hkl_list["l"]), axis=1)
+    # structure factors are not calculated
+    f2 = np.zeros((len(hkl), 1))
+    angles = np.stack([hkl_list[name] for name in ang_names], axis=1)
+
+    if path.endswith(".mhkl"):
+        hkl_fmt = "%8.3f%8.3f%8.3f"
+        hkl_fort = "3f8.3"
+    else:
+        hkl_fmt = "%4d%4d%4d"
+        hkl_fort = "3i4"
+
+    n_ang = len(ang_names)
+    with open(path, "w") as fileobj:
+        fileobj.write(title + "\n")
+        fileobj.write("! h k l f2 " + " ".join(ang_names) + "\n")
+        fileobj.write(f"({hkl_fort},f12.2,{n_ang}f10.3)\n")
+        np.savetxt(fileobj, np.hstack((hkl, f2, angles)), fmt=hkl_fmt + "%12.2f" + "%10.3f" * n_ang)
+
+
+def _serpentine_order(angles, chunks, pads):
+    """Order reflections by angle chunks with alternating direction in every next chunk.
+
+    Reflections are split into chunks of the first angle, then every chunk is split into chunks
+    of the second angle, and so on; reflections within the last chunks are sorted by the last
+    angle. Chunks of the first angle go in ascending order, while the direction of chunks at
+    every next level (and of the final sorting) alternates with each chunk of the previous level.
+
+    Args:
+        angles (list): Arrays of angles in priority order, one more than chunks.
+        chunks (list): Chunk sizes for all but the last angle.
+        pads (list): Number of extra chunks added on both sides of a chunk range at every level.
+
+    Returns:
+        ndarray: Indices that sort the reflections.
+    """
+    # global index of a chunk at the previous level, the first level is a single chunk
+    chunk_ind = np.zeros(len(angles[0]), dtype=np.int64)
+    for ang, chunk, pad in zip(angles, chunks, pads):
+        # group reflections by chunks of the previous level
+        order = np.argsort(chunk_ind, kind="stable")
+        sorted_ind = chunk_ind[order]
+        is_start = np.concatenate(([True], sorted_ind[1:] != sorted_ind[:-1]))
+        starts = np.flatnonzero(is_start)
+        groups = sorted_ind[starts]
+        group_ind = np.empty_like(chunk_ind)
+        group_ind[order] = np.cumsum(is_start) - 1
+
+        ang_min = np.minimum.reduceat(ang[order], starts)
+        ang_max = np.maximum.reduceat(ang[order], starts)
+
+        # chunks are aligned to the start of the group range in the current direction
+        begin = np.floor(ang_min) - pad * chunk
+        end = np.ceil(ang_max) + pad * chunk
+        num_chunks = np.maximum(np.ceil((end - begin) / chunk), 1).astype(np.int64)
+        reverse = groups % 2 == 1
+
+        begin, end, reverse = begin[group_ind], end[group_ind], reverse[group_ind]
+        ind = np.where(
+            reverse, np.ceil((end - ang) / chunk) - 1, np.floor((ang - begin) / chunk)
+        ).astype(np.int64)
+        # reflections at the far edge of a range belong to its last chunk
+        ind = np.clip(ind, 0, num_chunks[group_ind] - 1)
+
+        offsets = np.concatenate(([0], np.cumsum(num_chunks)[:-1]))
+        chunk_ind = offsets[group_ind] + ind
+
+    reverse = chunk_ind % 2 == 1
+    pos = np.arange(len(chunk_ind))
+    ang = angles[-1]
+
+    return np.lexsort((np.where(reverse, -pos, pos), np.where(reverse, -ang, ang), chunk_ind))
+
+
+def _read_hkl_file(path):
+    with open(path) as fileobj:
+        header = [next(fileobj) for _ in range(3)]
+        lines = [line for line in fileobj if line.strip()]
+
+    if lines:
+        data = np.loadtxt(lines, ndmin=2)
+    else:
+        data = np.empty((0, 0))
 
-            to_reverse_p3 = not to_reverse_p3
+    return header, lines, data
 
-            for p3 in range(begin_p3, end_p3, delta_p3):
-                min_p3 = min([p3, p3 + delta_p3])
-                max_p3 = max([p3, p3 + delta_p3])
-                ind_p3 = [j for j, x in enumerate(ang_p3) if min_p3 <= x and x < max_p3]
 
-                angle_new3 = [angles_p3[priority[3]][x] for x in ind_p3]
+def _write_hkl_file(path, header, lines):
+    with open(path, "w") as fileobj:
+        fileobj.writelines(header)
+        fileobj.writelines(lines)
 
-                ind_final = [x for _, x in sorted(zip(angle_new3, ind_p3), reverse=to_reverse)]
 
-                to_reverse = not to_reverse
+def _sort_hkl_file(file_in, file_out, angle_names, priority, chunks, pads):
+    header, lines, data = _read_hkl_file(file_in)
 
-                for i in ind_final:
-                    lines_update.append(lines_new2[i])
+    if lines:
+        angles = {name: data[:, 4 + i] for i, name in enumerate(angle_names)}
+        order = _serpentine_order([angles[name] for name in priority], chunks, pads)
+        lines = [lines[i] for i in order]
 
-    with open(file_out, "w") as fileobj:
-        for _ in range(3):
-            fileobj.write(file_in_data.pop(0))
+    _write_hkl_file(file_out, header, lines)
+
+
+def sort_hkl_file_bi(file_in, file_out, priority, chunks):
+    """Sort reflections of bisecting geometry to reduce motor travel between them.
 
-        fileobj.writelines(lines_update)
+    Args:
+        file_in (str): Input .hkl/.mhkl file.
+        file_out (str): Output file.
+        priority (list): Order of "2theta", "omega", "chi" and "phi" angles for sorting.
+        chunks (list): Chunk sizes of the first three angles in the priority.
+    """
+    _sort_hkl_file(file_in, file_out, GEOM_ANGLES["bi"], priority, chunks, pads=(0, 0, 1))
 
 
 def sort_hkl_file_nb(file_in, file_out, priority, chunks):
-    with open(file_in) as fileobj:
-        file_in_data = fileobj.readlines()
-
-    data = np.genfromtxt(file_in, skip_header=3)
-    gamma = data[:, 4]
-    omega = data[:, 5]
-    nu = data[:, 6]
-
-    lines = file_in_data[3:]
-    lines_update = []
-
-    angles = {"gamma": gamma, "omega": omega, "nu": nu}
-
-    to_reverse = False
-    to_reverse_p2 = False
-
-    # Get indices within first priority
-    ang_p1 = angles[priority[0]]
-    begin_p1 = floor(min(ang_p1))
-    end_p1 = ceil(max(ang_p1))
-    delta_p1 = chunks[0]
-    for p1 in range(begin_p1, end_p1, delta_p1):
-        ind_p1 = [j for j, x in enumerate(ang_p1) if p1 <= x and x < p1 + delta_p1]
-
-        # Get angles from within nu range
-        lines_new = [lines[x] for x in ind_p1]
-        gamma_new = [gamma[x] for x in ind_p1]
-        omega_new = [omega[x] for x in ind_p1]
-        nu_new = [nu[x] for x in ind_p1]
-
-        angles_p2 = {"gamma": gamma_new, "omega": omega_new, "nu": nu_new}
-
-        # Get indices for second priority
-        ang_p2 = angles_p2[priority[1]]
-        if len(gamma_new) > 0 and to_reverse_p2:
-            begin_p2 = ceil(max(ang_p2))
-            end_p2 = floor(min(ang_p2))
-            delta_p2 = -chunks[1]
-        elif len(gamma_new) > 0 and not to_reverse_p2:
-            end_p2 = ceil(max(ang_p2))
-            begin_p2 = floor(min(ang_p2))
-            delta_p2 = chunks[1]
-        else:
-            end_p2 = 0
-            begin_p2 = 0
-            delta_p2 = 1
+    """Sort reflections of normal beam geometry to reduce motor travel between them.
+
+    Args:
+        file_in (str): Input .hkl/.mhkl file.
+        file_out (str): Output file.
+        priority (list): Order of "gamma", "omega" and "nu" angles for sorting.
+        chunks (list): Chunk sizes of the first two angles in the priority.
+    """
+    _sort_hkl_file(file_in, file_out, GEOM_ANGLES["nb"], priority, chunks, pads=(0, 0))
+
+
+@njit(cache=True)
+def _drive_time(angles, inv_speeds, i, j):
+    # all motors move simultaneously, so the slowest one defines the time
+    res = 0.0
+    for k in range(angles.shape[1]):
+        res = max(res, abs(angles[i, k] - angles[j, k]) * inv_speeds[k])
+    return res
+
+
+@njit(cache=True)
+def _path_time(angles, inv_speeds, order):
+    res = 0.0
+    for i in range(order.size - 1):
+        res += _drive_time(angles, inv_speeds, order[i], order[i + 1])
+    return res
+
+
+@njit(cache=True, nogil=True)
+def _nearest_neighbour(angles, inv_speeds, order, visited, i_start, i_stop):
+    # extend the path order[:i_start] with nearest unvisited reflections
+    n = angles.shape[0]
+    for i in range(i_start, min(i_stop, n)):
+        best, best_time = -1, np.inf
+        for j in range(n):
+            if not visited[j]:
+                t = _drive_time(angles, inv_speeds, order[i - 1], j)
+                if t < best_time:
+                    best, best_time = j, t
+        order[i] = best
+        visited[best] = True
+
+
+@njit(cache=True, nogil=True)
+def _two_opt_pass(angles, inv_speeds, order, i_start, i_stop):
+    # reverse order[i + 1 : j + 1] if that shortens the path
+    n = order.size
+    n_improved = 0
+    for i in range(i_start, min(i_stop, n - 2)):
+        for j in range(i + 2, n):
+            a, b = order[i], order[i + 1]
+            c = order[j]
+            delta = _drive_time(angles, inv_speeds, a, c) - _drive_time(angles, inv_speeds, a, b)
+            if j < n - 1:
+                d = order[j + 1]
+                delta += _drive_time(angles, inv_speeds, b, d)
+                delta -= _drive_time(angles, inv_speeds, c, d)
+            if delta < -1e-9:
+                order[i + 1 : j + 1] = order[i + 1 : j + 1][::-1].copy()
+                n_improved += 1
+    return n_improved
+
+
+@njit(cache=True, nogil=True)
+def _or_opt_pass(angles, inv_speeds, order, i_start, i_stop, seg_len):
+    # move a segment order[i : i + seg_len] between other neighbours, possibly reversed
+    n = order.size
+    n_improved = 0
+    for i in range(i_start, min(i_stop, n - seg_len + 1)):
+        s_first, s_last = order[i], order[i + seg_len - 1]
+        removal = 0.0
+        if i > 0:
+            removal += _drive_time(angles, inv_speeds, order[i - 1], s_first)
+        if i + seg_len < n:
+            removal += _drive_time(angles, inv_speeds, s_last, order[i + seg_len])
+        if 0 < i and i + seg_len < n:
+            removal -= _drive_time(angles, inv_speeds, order[i - 1], order[i + seg_len])
+
+        best_delta, best_pos, best_rev = -1e-9, -1, False
+        # insert between order[p - 1] and order[p], p = 0 and p = n are the path ends
+        for p in range(n + 1):
+            if i <= p <= i + seg_len:
+                continue
+            for rev in (False, True):
+                first, last = (s_last, s_first) if rev else (s_first, s_last)
+                insertion = 0.0
+                if p > 0:
+                    insertion += _drive_time(angles, inv_speeds, order[p - 1], first)
+                if p < n:
+                    insertion += _drive_time(angles, inv_speeds, last, order[p])
+                if 0 < p < n:
+                    insertion -= _drive_time(angles, inv_speeds, order[p - 1], order[p])
+                delta = insertion - removal
+                if delta < best_delta:
+                    best_delta, best_pos, best_rev = delta, p, rev
+
+        if best_pos >= 0:
+            segment = order[i : i + seg_len].copy()
+            if best_rev:
+                segment = segment[::-1].copy()
+            rest = np.concatenate((order[:i], order[i + seg_len :]))
+            pos = best_pos if best_pos < i else best_pos - seg_len
+            order[:] = np.concatenate((rest[:pos], segment, rest[pos:]))
+            n_improved += 1
+    return n_improved
+
+
+def optimize_hkl_order(angles, speeds, order=None, time_limit=1.0):
+    """Find a measurement order of reflections with a short total drive time of motors.
+
+    The nearest neighbour path, started from the first reflection of the initial order, is
+    improved with 2-opt and Or-opt moves until no improvement is found or the time limit is
+    reached. If the time limit is reached while the path is constructed, the remaining
+    reflections follow in their initial order. Motors are assumed to move simultaneously with
+    constant speeds.
+
+    Args:
+        angles (ndarray): A (N, M) array of M motor angles of N reflections.
+        speeds (array_like): Speeds of M motors in deg/s.
+        order (ndarray): Initial order of reflections, the given one by default.
+        time_limit (float): Time budget of the optimization in seconds.
+
+    Returns:
+        tuple: The optimized order, and estimated drive times in seconds for the initial and the
+            optimized orders.
+    """
+    deadline = time.perf_counter() + time_limit
+    angles = np.ascontiguousarray(angles, dtype=np.float64)
+    inv_speeds = 1 / np.asarray(speeds, dtype=np.float64)
+    n = angles.shape[0]
+    if order is None:
+        order = np.arange(n)
+    order = np.array(order, dtype=np.int64)
+
+    init_time = _path_time(angles, inv_speeds, order)
+    if n < 3:
+        return order, init_time, init_time
+
+    # process reflections in blocks to check the time limit regularly
+    block = max(100_000 // n, 1)
+
+    nn_order = np.empty(n, dtype=np.int64)
+    visited = np.zeros(n, dtype=np.bool_)
+    nn_order[0] = order[0]
+    visited[order[0]] = True
+    i = 1
+    while i < n and time.perf_counter() < deadline:
+        _nearest_neighbour(angles, inv_speeds, nn_order, visited, i, i + block)
+        i += block
+    if i < n:
+        nn_order[i:] = order[~visited[order]]
+
+    if _path_time(angles, inv_speeds, nn_order) < init_time:
+        res_order = nn_order
+    else:
+        res_order = order.copy()
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for move in ("2-opt", 1, 2, 3):
+            for i in range(0, n, block):
+                if time.perf_counter() > deadline:
+                    break
+                if move == "2-opt":
+                    n_improved = _two_opt_pass(angles, inv_speeds, res_order, i, i + block)
+                else:
+                    n_improved = _or_opt_pass(angles, inv_speeds, res_order, i, i + block, move)
+                improved |= n_improved > 0
 
-        to_reverse_p2 = not to_reverse_p2
+    return res_order, init_time, _path_time(angles, inv_speeds, res_order)
 
-        for p2 in range(begin_p2, end_p2, delta_p2):
-            min_p2 = min([p2, p2 + delta_p2])
-            max_p2 = max([p2, p2 + delta_p2])
-            ind_p2 = [j for j, x in enumerate(ang_p2) if min_p2 <= x and x < max_p2]
 
-            angle_new2 = [angles_p2[priority[2]][x] for x in ind_p2]
+def optimize_hkl_file(file_in, file_out, geom, speeds, time_limit=1.0):
+    """Reorder reflections of a .hkl/.mhkl file to reduce the total drive time of motors.
 
-            ind_final = [x for _, x in sorted(zip(angle_new2, ind_p2), reverse=to_reverse)]
+    Args:
+        file_in (str): Input .hkl/.mhkl file, its order is used as a starting point.
+        file_out (str): Output file, can be the same as the input file.
+        geom (str): Geometry of the instrument, "bi" or "nb".
+        speeds (dict): Motor speeds in deg/s for angles of the geometry.
+        time_limit (float): Time budget of the optimization in seconds.
 
-            to_reverse = not to_reverse
+    Returns:
+        tuple: Estimated drive times in seconds for the initial and the optimized orders.
+    """
+    header, lines, data = _read_hkl_file(file_in)
 
-            for i in ind_final:
-                lines_update.append(lines_new[i])
+    ang_names = GEOM_ANGLES[geom]
+    if lines:
+        angles = data[:, 4 : 4 + len(ang_names)]
+        order, init_time, opt_time = optimize_hkl_order(
+            angles, [speeds[name] for name in ang_names], time_limit=time_limit
+        )
+        lines = [lines[i] for i in order]
+    else:
+        init_time = opt_time = 0.0
 
-    with open(file_out, "w") as fileobj:
-        for _ in range(3):
-            fileobj.write(file_in_data.pop(0))
+    _write_hkl_file(file_out, header, lines)
 
-        fileobj.writelines(lines_update)
+    return init_time, opt_time
@@ -1,4 +1,8 @@
+import json
 import os
+import tempfile
+import threading
+import time
 
 import numpy as np
 
@@ -6,17 +10,136 @@ SINQ_PATH = "/afs/psi.ch/project/sinqdata"
 ZEBRA_PROPOSALS_PATH = os.path.join(SINQ_PATH, "{year}/zebra/{proposal}")
 
 
+class ProposalIndex:
+    """In-memory index of proposal numbers to their data paths.
+
+    Every year directory is listed once, and only listed again after its modification time has
+    changed, so that lookups do not need to access the file system. The index can optionally be
+    stored in a json file to be available right after a server restart.
+
+    Args:
+        sinq_path (str): A root directory with year subdirectories.
+        cache_file (str): A json file to store the index, no file is used by default.
+    """
+
+    def __init__(self, sinq_path=SINQ_PATH, cache_file=None):
+        self.sinq_path = sinq_path
+        self.cache_file = cache_file
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._years = {}
+        self._proposals = {}
+        self._thread = None
+
+        if cache_file:
+            try:
+                with open(cache_file) as f:
+                    self._years = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+            self._update_proposals()
+
+    def _zebra_path(self, year):
+        return os.path.dirname(ZEBRA_PROPOSALS_PATH.format(year=year, proposal=""))
+
+    def _update_proposals(self):
+        proposals = {}
+        for year in sorted(self._years):
+            for proposal in self._years[year]["proposals"]:
+                proposals[proposal] = ZEBRA_PROPOSALS_PATH.format(year=year, proposal=proposal)
+        self._proposals = proposals
+
+    def refresh(self):
+        """Update the index for new and modified year directories."""
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        years = dict(self._years)
+        for entry in os.scandir(self.sinq_path):
+            if not (entry.is_dir() and len(entry.name) == 4 and entry.name.isdigit()):
+                continue
+
+            # a single inaccessible year directory must not break lookups in all other years
+            zebra_path = self._zebra_path(entry.name)
+            try:
+                mtime = os.stat(zebra_path).st_mtime
+                if entry.name in years and years[entry.name]["mtime"] == mtime:
+                    continue
+
+                proposals = [e.name for e in os.scandir(zebra_path) if e.is_dir()]
+            except OSError:
+                continue
+
+            years[entry.name] = {"mtime": mtime, "proposals": proposals}
+
+        with self._lock:
+            self._years = years
+            self._update_proposals()
+
+        if self.cache_file:
+            # write to a unique temporary file first, as several processes can share the cache
+            try:
+                fd, temp_file = tempfile.mkstemp(
+                    dir=os.path.dirname(self.cache_file) or None, suffix=".tmp"
+                )
+                with os.fdopen(fd, "w") as f:
+                    json.dump(years, f)
+                os.replace(temp_file, self.cache_file)
+            except OSError as e:
+                print(f"Error writing proposal index cache: {e}")
+
+    def start(self, interval=600):
+        """Keep the index up to date in a background thread.
+
+        Args:
+            interval (float): Time between refreshes, in seconds.
+        """
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.refresh()
+                except OSError as e:
+                    print(e)
+                time.sleep(interval)
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def find(self, proposal):
+        """Return a path to the proposal data.
+
+        Proposals that are not in the index yet trigger its refresh.
+        """
+        with self._lock:
+            proposal_path = self._proposals.get(proposal)
+
+        if proposal_path is None:
+            try:
+                self.refresh()
+            except OSError as e:
+                print(e)
+
+            with self._lock:
+                proposal_path = self._proposals.get(proposal)
+
+        if proposal_path is None:
+            raise ValueError(f"Can not find data for proposal '{proposal}'")
+
+        return proposal_path
+
+
+proposal_index = ProposalIndex(
+    cache_file=os.path.join(tempfile.gettempdir(), "pyzebra_proposals.json")
+)
+
+
 def find_proposal_path(proposal):
-    for entry in os.scandir(SINQ_PATH):
-        if entry.is_dir() and len(entry.name) == 4 and entry.name.isdigit():
-            proposal_path = ZEBRA_PROPOSALS_PATH.format(year=entry.name, proposal=proposal)
-            if os.path.isdir(proposal_path):
-                # found it
-                break
-    else:
-        raise ValueError(f"Can not find data for proposal '{proposal}'")
-
-    return proposal_path
+    return proposal_index.find(proposal)
 
 
 def parse_hkl(fileobj, data_type):
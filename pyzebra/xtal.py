@@ -351,6 +351,126 @@ def ang2hkl_1d(wave, ga, om, ch, ph, nu, ub_inv):
     return hkl
 
 
+def ang2hkl_1d_vec(wave, ga, om, ch, ph, nu, ub_inv):
+    """Calculate hkl-indices of multiple reflections from their positions (angles) at the
+    1d-detector
+
+    Args:
+        wave, ga, om, ch, ph, nu: Arrays (or scalars) of wavelengths and angles in degrees.
+        ub_inv: Inverse UB matrix (3, 3), or a stack of matrices (N, 3, 3).
+
+    Returns:
+        An array of hkl-indices with (N, 3) shape.
+    """
+
+    z1 = z1frmd_vec(wave, ga, om, ch, ph, nu)
+    hkl = np.einsum("...ij,...j->...i", ub_inv, z1)
+
+    return hkl
+
+
+def z1frmd_vec(wave, ga, om, chi, phi, nu):
+    """Calculate diffraction vectors z1 of multiple reflections from their angles
+
+    Args:
+        wave, ga, om, chi, phi, nu: Arrays (or scalars) of wavelengths and angles in degrees.
+
+    Returns:
+        An array of diffraction vectors with (N, 3) shape.
+    """
+
+    def rotate(x, y, angle):
+        angle_r = angle / pi_r
+        return np.cos(angle_r) * x - np.sin(angle_r) * y, np.sin(angle_r) * x + np.cos(angle_r) * y
+
+    ga_r = np.asarray(ga) / pi_r
+    nu_r = np.asarray(nu) / pi_r
+    z_x = np.sin(ga_r) * np.cos(nu_r) / wave
+    z_y = (np.cos(ga_r) * np.cos(nu_r) - 1) / wave
+    z_z = np.sin(nu_r) / wave
+
+    # the same sequence of rotations as in z1frmd
+    z_x, z_y = rotate(z_x, z_y, om)
+    z_x, z_z = rotate(z_x, z_z, chi)
+    z_x, z_y = rotate(z_x, z_y, phi)
+
+    return np.stack(np.broadcast_arrays(z_x, z_y, z_z), axis=-1)
+
+
+def dandth_vec(wave, z1):
+    """Calculate d-spacings (real space) and thetas of multiple diffraction vectors z1
+
+    Args:
+        wave: Wavelength.
+        z1: An array of diffraction vectors with (N, 3) shape.
+
+    Returns:
+        ds, th: Arrays of d-spacings and thetas in degrees, 0 where dandth reports an error.
+    """
+    dstar = np.linalg.norm(z1, axis=-1)
+    sint = wave * dstar / 2
+
+    valid = dstar > 0.0001
+    ds = np.divide(1, dstar, out=np.zeros_like(dstar), where=valid)
+    valid &= np.abs(sint) <= 1
+    th = np.arcsin(np.where(valid, sint, 0)) * pi_r
+
+    return ds, th
+
+
+def angs4c_vec(wave, z1):
+    """Calculate 2-theta, omega (=theta), chi, phi to put multiple vectors z1 in the bisecting
+    diffraction condition
+
+    Args:
+        wave: Wavelength.
+        z1: An array of diffraction vectors with (N, 3) shape.
+
+    Returns:
+        tth, om, ch, ph: Arrays of angles in degrees, NaN for unreachable reflections.
+    """
+    z1 = np.asarray(z1, dtype=float)
+    dstar = np.linalg.norm(z1, axis=-1)
+
+    # the same conventions as in eqchph
+    ph = 180 + np.arctan2(z1[..., 1], z1[..., 0]) * pi_r
+    ch = 180 - np.arctan2(z1[..., 2], np.hypot(z1[..., 0], z1[..., 1])) * pi_r
+
+    with np.errstate(invalid="ignore"):
+        th = np.arcsin(wave * dstar / 2) * pi_r
+    th[dstar <= 0.0001] = np.nan
+
+    return 2 * th, th, ch, ph
+
+
+def angsnb_vec(wave, z1):
+    """Calculate gamma, omega, nu to put multiple vectors z1 in the diffraction condition of the
+    normal beam geometry (chi = phi = 0)
+
+    Args:
+        wave: Wavelength.
+        z1: An array of diffraction vectors with (N, 3) shape.
+
+    Returns:
+        ga, om, nu: Arrays of angles in degrees, NaN for unreachable reflections.
+    """
+    z1 = np.asarray(z1, dtype=float)
+
+    # omega rotation does not change z component and length of the diffraction vector
+    with np.errstate(invalid="ignore"):
+        nu_r = np.arcsin(wave * z1[..., 2])
+        cosga = (1 - wave**2 * np.sum(z1**2, axis=-1) / 2) / np.cos(nu_r)
+        ga_r = np.arccos(cosga)
+
+    # omega rotates z1 onto the diffraction vector in the lab system (see z1frnb)
+    z4_x = np.sin(ga_r) * np.cos(nu_r)
+    z4_y = np.cos(ga_r) * np.cos(nu_r) - 1
+    om = (np.arctan2(z1[..., 1], z1[..., 0]) - np.arctan2(z4_y, z4_x)) * pi_r
+    om = (om + 180) % 360 - 180
+
+    return ga_r * pi_r, om, nu_r * pi_r
+
+
 def ang_proc(wave, ddist, gammad, om, ch, ph, nud, x, y):
     """Utility function to calculate ch, ph, ga, om"""
     ga, nu = det2pol(ddist, gammad, nud, x, y)